@@ -0,0 +1,48 @@
+"""
+Access control for admin endpoints.
+
+If the ADMIN_TOKEN environment variable is set, admin endpoints require it in
+the X-Admin-Token header. Otherwise they are only served to loopback clients
+that did not come through a proxy: behind a local reverse proxy every request
+arrives from loopback, so requests carrying forwarding headers are refused
+and ADMIN_TOKEN must be set to use admin endpoints there.
+"""
+
+import os
+import hmac
+import logging
+from functools import wraps
+
+from flask import request, jsonify
+
+logger = logging.getLogger(__name__)
+
+ADMIN_TOKEN = os.environ.get('ADMIN_TOKEN')
+
+LOOPBACK_ADDRESSES = ('127.0.0.1', '::1', 'localhost')
+
+# Headers added by reverse proxies; their presence means remote_addr is the proxy
+FORWARDING_HEADERS = ('X-Forwarded-For', 'X-Real-IP', 'Forwarded')
+
+
+def is_admin_request():
+    """Return True if the current request may use admin endpoints"""
+    if ADMIN_TOKEN:
+        # Compared as bytes: compare_digest rejects non-ASCII str with TypeError.
+        # WSGI decodes header bytes as latin-1, so encoding back gives the bytes sent.
+        token = request.headers.get('X-Admin-Token', '')
+        return hmac.compare_digest(token.encode('latin-1', 'replace'), ADMIN_TOKEN.encode('utf-8'))
+    if any(header in request.headers for header in FORWARDING_HEADERS):
+        return False
+    return request.remote_addr in LOOPBACK_ADDRESSES
+
+
+def admin_required(view):
+    """Decorator rejecting non-admin requests with 403"""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not is_admin_request():
+            logger.warning(f"Rejected admin request to {request.path} from {request.remote_addr}")
+            return jsonify({"error": "Admin access required"}), 403
+        return view(*args, **kwargs)
+    return wrapper
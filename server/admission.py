@@ -0,0 +1,242 @@
+"""
+Admission control for expensive endpoints.
+
+Heavy requests take a slot in a pool before doing any work:
+
+    ingest   POST /api/upload/icons, POST /api/diagrams/import
+    delete   DELETE /api/icons/all (held until its job ends), POST /api/icons/delete,
+             DELETE /api/icons/<provider>/<filename>
+
+A pool admits `limit` requests at a time across all server processes: each
+slot is a file under ADMISSION_DIR locked with flock, so a slot held by a
+process that dies is freed with it. Up to `queue` more requests per process
+wait for a slot for at most `timeout` seconds; past that, requests are
+rejected with 429 and a Retry-After estimated from how long slots are held.
+Limits are set per pool, e.g. ADMISSION_INGEST_LIMIT, ADMISSION_INGEST_QUEUE,
+ADMISSION_INGEST_TIMEOUT.
+
+Cheap reads get priority: GET requests being served are counted, and heavy
+loops call yield_to_reads() between items, which sleeps ADMISSION_YIELD_MS
+while any read is in flight in the process, so listing and icon requests are
+not starved of the GIL and the disk by an upload or a wipe.
+
+Wait times and rejections are recorded in admission_wait_seconds{pool} and
+admission_rejections_total{pool, reason} (see metrics.py).
+"""
+
+import os
+import math
+import time
+import fcntl
+import logging
+import threading
+from functools import wraps
+
+from metrics import ADMISSION_WAIT_SECONDS, ADMISSION_REJECTIONS
+from serialization import json_response
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('ADMISSION_ENABLED', 'true').lower() == 'true'
+YIELD_SECONDS = float(os.environ.get('ADMISSION_YIELD_MS', 1)) / 1000
+# How often a waiting request retries the slot files held by other processes
+SLOT_POLL_SECONDS = 0.05
+
+
+class Rejected(Exception):
+    def __init__(self, pool, reason, retry_after):
+        super().__init__(f"Too many {pool} requests in progress; retry in {retry_after} s")
+        self.pool = pool
+        self.reason = reason
+        self.retry_after = retry_after
+
+    def response(self, build=json_response):
+        """429 with Retry-After, built with the given json_response (Flask or Starlette)"""
+        return build({"error": str(self), "pool": self.pool, "retryAfter": self.retry_after},
+                     429, headers={"Retry-After": str(self.retry_after)})
+
+
+class Permit:
+    """A pool slot; release() (or leaving the with block) frees it"""
+
+    def __init__(self, pool, slot_file):
+        self.pool = pool
+        self.slot_file = slot_file
+        self.acquired_at = time.monotonic()
+        self.released = False
+
+    def release(self):
+        if self.released:
+            return
+        self.released = True
+        if self.pool is None:
+            return
+        if self.slot_file is not None:
+            fcntl.flock(self.slot_file, fcntl.LOCK_UN)
+            self.slot_file.close()
+        self.pool._release(time.monotonic() - self.acquired_at)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class Pool:
+    def __init__(self, name, limit, queue, timeout):
+        self.name = name
+        self.limit = int(os.environ.get(f'ADMISSION_{name.upper()}_LIMIT', limit))
+        self.queue = int(os.environ.get(f'ADMISSION_{name.upper()}_QUEUE', queue))
+        self.timeout = float(os.environ.get(f'ADMISSION_{name.upper()}_TIMEOUT', timeout))
+        self.directory = None
+        self.active = 0
+        self.waiting = 0
+        self.admitted = 0
+        self.rejected = 0
+        # Moving average of how long a slot is held, for Retry-After
+        self.hold_seconds = None
+        self._condition = threading.Condition()
+
+    def retry_after(self):
+        hold = self.hold_seconds if self.hold_seconds is not None else 1.0
+        return max(1, math.ceil(hold * (self.waiting + 1) / max(self.limit, 1)))
+
+    def _reject(self, reason):
+        self.rejected += 1
+        ADMISSION_REJECTIONS.inc(self.name, reason)
+        logger.warning(f"Rejected {self.name} request ({reason}): {self.active} active, {self.waiting} waiting")
+        raise Rejected(self.name, reason, self.retry_after())
+
+    def acquire(self, wait=True):
+        """A Permit, waiting up to the pool's timeout for a slot; raises Rejected.
+        With wait=False, returns None instead of waiting (a full queue still raises)."""
+        started = time.monotonic()
+        deadline = started + self.timeout
+        with self._condition:
+            if self.active >= self.limit:
+                if self.waiting >= self.queue:
+                    self._reject('queue_full')
+                if not wait:
+                    return None
+                self.waiting += 1
+                try:
+                    while self.active >= self.limit:
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._reject('timeout')
+                        self._condition.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            self.active += 1
+        try:
+            slot_file = self._lock_slot(deadline if wait else None) if self.directory is not None else None
+        except BaseException:
+            self._release(None)
+            raise
+        if slot_file is None and self.directory is not None:
+            self._release(None)
+            return None
+        ADMISSION_WAIT_SECONDS.observe(time.monotonic() - started, self.name)
+        with self._condition:
+            self.admitted += 1
+        return Permit(self, slot_file)
+
+    def _lock_slot(self, deadline):
+        """Lock one of the pool's slot files, shared by all server processes
+        (with deadline None, only try once and return None if all are taken)"""
+        while True:
+            for index in range(self.limit):
+                slot_file = open(os.path.join(self.directory, f"{self.name}-{index}.lock"), 'a')
+                try:
+                    fcntl.flock(slot_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    return slot_file
+                except BlockingIOError:
+                    slot_file.close()
+            if deadline is None:
+                return None
+            if time.monotonic() >= deadline:
+                with self._condition:
+                    self._reject('timeout')
+            time.sleep(SLOT_POLL_SECONDS)
+
+    def _release(self, held_seconds):
+        with self._condition:
+            self.active -= 1
+            if held_seconds is not None:
+                self.hold_seconds = held_seconds if self.hold_seconds is None \
+                    else 0.8 * self.hold_seconds + 0.2 * held_seconds
+            self._condition.notify()
+
+    def status(self):
+        return {"limit": self.limit, "queue": self.queue, "active": self.active, "waiting": self.waiting,
+                "admitted": self.admitted, "rejected": self.rejected,
+                "holdSeconds": round(self.hold_seconds, 3) if self.hold_seconds is not None else None}
+
+
+pools = {
+    'ingest': Pool('ingest', limit=2, queue=8, timeout=60),
+    'delete': Pool('delete', limit=1, queue=2, timeout=30),
+}
+
+
+def configure(directory):
+    """Share each pool's slots between the server processes using directory"""
+    os.makedirs(directory, exist_ok=True)
+    for pool in pools.values():
+        pool.directory = directory
+
+
+def acquire(pool_name, wait=True):
+    """A Permit of the named pool (a no-op permit when admission control is off)"""
+    if not ENABLED:
+        return Permit(None, None)
+    return pools[pool_name].acquire(wait)
+
+
+def limited(pool_name):
+    """Decorator for Flask views: hold a slot of the pool while the view runs, or return 429"""
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            try:
+                permit = acquire(pool_name)
+            except Rejected as e:
+                return e.response()
+            with permit:
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def status():
+    return {"enabled": ENABLED, "readsInFlight": reads.active,
+            "pools": {name: pool.status() for name, pool in pools.items()}}
+
+
+# Read priority
+
+class Reads:
+    """Reads being served in this process"""
+
+    def __init__(self):
+        self.active = 0
+        self._lock = threading.Lock()
+
+    def enter(self):
+        with self._lock:
+            self.active += 1
+
+    def leave(self):
+        with self._lock:
+            self.active -= 1
+
+
+reads = Reads()
+
+
+def yield_to_reads():
+    """Called by heavy work between items: pause briefly while reads are in flight"""
+    if reads.active and YIELD_SECONDS > 0 and ENABLED:
+        time.sleep(YIELD_SECONDS)
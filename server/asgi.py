@@ -0,0 +1,12 @@
+"""
+ASGI entry point, serving the icon and diagram endpoints asynchronously
+(see async_api.py):
+
+    cd server && gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app
+
+Like wsgi.py, each worker runs the startup sequence after the fork.
+"""
+
+from async_api import create_asgi_app
+
+app = create_asgi_app()
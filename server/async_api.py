@@ -0,0 +1,527 @@
+"""
+ASGI variant of the API, with async handlers for the icon and diagram endpoints.
+
+    cd server && gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app
+
+In the WSGI app every request holds a thread while it waits on MongoDB, disk
+or the GCS replication queue, so concurrency is capped by the thread count.
+Here the busiest routes are coroutines on one event loop per worker: MongoDB
+is awaited through motor, and blocking calls are offloaded to threads through
+bounded lanes (see async_io.py). Behaviour matches the Flask handlers, whose
+local JSON fallback and upload helpers are shared from upload.py.
+
+Native routes:
+    GET               /api/icons
+    GET               /cloudicons/<path>
+    POST              /api/upload/icons
+    GET, POST         /api/diagrams
+    GET, PUT, DELETE  /api/diagrams/<diagram_id>
+
+Every other route (admin, jobs, versions, import/export...) is served by the
+Flask app from upload.py mounted behind them, so both deployments expose the
+same API and share the startup sequence, storage, icon snapshot and
+replication queue.
+"""
+
+import os
+import json
+import time
+import asyncio
+import logging
+import tempfile
+import traceback
+import functools
+import contextlib
+
+import anyio.to_thread
+
+from a2wsgi import WSGIMiddleware
+from pymongo import ReturnDocument
+from bson import ObjectId
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.datastructures import Headers
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response, StreamingResponse
+from starlette.routing import Mount, Route
+from starlette.staticfiles import StaticFiles
+
+import upload
+import metrics
+import tracing
+import async_io
+import structured_logging
+import admission
+import mongo_listing
+from async_io import Lane, filesystem, object_store, mongodb
+from diagram_codec import encode_diagram, decode_diagram, is_encoded, settable, summary_projection, BODY_FIELD
+from mongodb_client import get_async_db, close_async_mongodb, mongo_breaker
+from serialization import dumps, stream_object, MIMETYPE, STREAM_THRESHOLD, STREAM_BATCH_SIZE
+from icon_catalog import DEFAULT_CATEGORY
+
+logger = logging.getLogger(__name__)
+
+# Threads serving the routes handled by the Flask app
+WSGI_WORKERS = int(os.environ.get('ASGI_WSGI_WORKERS', 10))
+
+# The JSON diagram store is rewritten whole on every change, so changes run one at a time.
+# The store's file lock (upload.diagrams_lock) orders them against the Flask app and other workers;
+# this lane keeps waiting changes from filling the offload threads.
+json_writes = Lane('json-writes', 1)
+
+
+async def _stream_batches(payload, stream_key):
+    """Like serialization.stream_object, for an async iterator of lists at payload[stream_key]"""
+    head = {key: value for key, value in payload.items() if key != stream_key and not callable(value)}
+    yield dumps(head)[:-1] + (b',' if head else b'') + dumps(stream_key) + b':['
+    separator = b''
+    async for batch in payload[stream_key]:
+        if batch:
+            yield separator + dumps(batch)[1:-1]
+            separator = b','
+    yield b']' + b''.join(b',' + dumps(str(key)) + b':' + dumps(value())
+                          for key, value in payload.items() if callable(value)) + b'}'
+
+
+def json_response(payload, status=200, stream=None, headers=None):
+    """Starlette counterpart of serialization.json_response; stream may also be an async iterator of batches"""
+    if stream is not None:
+        items = payload.get(stream)
+        if hasattr(items, '__aiter__'):
+            return StreamingResponse(_stream_batches(payload, stream), status, headers, media_type=MIMETYPE)
+        if not isinstance(items, (list, tuple)) or len(items) >= STREAM_THRESHOLD:
+            # Starlette iterates synchronous generators in a worker thread
+            return StreamingResponse(stream_object(payload, stream), status, headers, media_type=MIMETYPE)
+        payload = {k: (v() if callable(v) else v) for k, v in payload.items()}
+    return Response(dumps(payload), status, headers, media_type=MIMETYPE)
+
+
+def error_response(where, e):
+    logger.error(f"Error in {where}: {e}")
+    logger.error(traceback.format_exc())
+    return json_response({"error": str(e)}, 500)
+
+
+async def request_json(request):
+    """The JSON request body, or None when the request is not JSON (like Flask's request.json)"""
+    mimetype = request.headers.get('content-type', '').split(';')[0].strip()
+    if mimetype != 'application/json' and not (mimetype.startswith('application/') and mimetype.endswith('+json')):
+        return None
+    return json.loads(await request.body())
+
+
+async def async_db():
+    """The motor database if MongoDB should be tried for this request, else None"""
+    # Wait for a backend that is still initializing without holding a thread
+    deadline = time.monotonic() + upload.BACKEND_WAIT_SECONDS
+    while not upload.startup.wait('mongodb', 0) and time.monotonic() < deadline:
+        await asyncio.sleep(0.05)
+    if not upload.mongodb_initialized:
+        return None
+    return get_async_db()
+
+
+# Icons
+
+def encode_icon_listing(provider):
+    # Encoded in one worker thread call rather than streamed chunk by chunk from the event loop
+    result, headers = upload.icon_listing(provider)
+    return b''.join(stream_object(result, 'icons')), headers
+
+
+async def list_icons(request):
+    """List the uploaded icons of a provider from MongoDB or the shared icon snapshot"""
+    try:
+        provider = request.query_params.get('provider', 'azure')
+        # The MongoDB listing uses the pymongo client, in a worker thread of the mongodb lane
+        lane = mongodb if upload.ICON_LISTING_SOURCE == 'mongodb' and upload.mongodb_initialized else filesystem
+        body, headers = await lane.offload(encode_icon_listing, provider)
+        return Response(body, media_type=MIMETYPE, headers={'Access-Control-Allow-Origin': '*', **headers})
+    except Exception as e:
+        return error_response('list_icons', e)
+
+
+async def list_categories(request):
+    """Icon categories of a provider with their counts and descriptions"""
+    try:
+        provider = request.query_params.get('provider', 'azure')
+        lane = mongodb if upload.ICON_LISTING_SOURCE == 'mongodb' and upload.mongodb_initialized else filesystem
+        body, headers = await lane.offload(upload.category_listing, provider)
+        return Response(body, media_type=MIMETYPE, headers={'Access-Control-Allow-Origin': '*', **headers})
+    except Exception as e:
+        return error_response('list_categories', e)
+
+
+def extract_upload(zip_source, provider):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        return upload.copy_icons_from_zip(zip_source, provider, temp_dir)
+
+
+async def save_icon_metadata(db, icon_data, count_changes):
+    """Insert or update an uploaded icon's MongoDB record in one round trip,
+    noting any change in its category's icon count in count_changes"""
+    file = icon_data['filename']
+    try:
+        if not mongo_breaker.allow():
+            return
+        # motor runs commands in its own threads, outside this trace: time the round trip here
+        with tracing.span('upload.icon.metadata', file=file, category=icon_data['category']):
+            # The _id is chosen here so the previous category comes back along with it
+            new_id = ObjectId()
+            previous = await mongodb.run(
+                db.icons.find_one_and_update,
+                {"provider": icon_data['provider'], "filename": file},
+                {"$set": icon_data, "$setOnInsert": {"_id": new_id}},
+                projection={"_id": 1, "category": 1},
+                upsert=True,
+                return_document=ReturnDocument.BEFORE
+            )
+        if previous is None:
+            icon_data['_id'] = new_id
+            upload.count_icon(count_changes, icon_data['provider'], icon_data['category'], 1)
+        else:
+            icon_data['_id'] = previous['_id']
+            previous_category = previous.get('category') or DEFAULT_CATEGORY
+            if previous_category != icon_data['category']:
+                upload.count_icon(count_changes, icon_data['provider'], previous_category, -1)
+                upload.count_icon(count_changes, icon_data['provider'], icon_data['category'], 1)
+        structured_logging.count('icons.saved')
+    except Exception as e:
+        logger.error(f"MongoDB error for {file}: {str(e)}")
+        # Don't stop the upload for MongoDB errors
+        upload.mongodb_failed(e)
+
+
+async def icons_changed(db, count_changes):
+    """Apply uploaded icons to the stored category counts and make every worker reread them
+    (see upload.icons_changed)"""
+    try:
+        if mongo_breaker.allow():
+            updates = mongo_listing.count_updates(count_changes)
+            if updates:
+                await mongodb.run(db.category_counts.bulk_write, updates, ordered=False)
+            await mongodb.run(mongo_listing.bump_version, db)
+    except Exception as e:
+        logger.error(f"Error bumping the icon catalog version: {str(e)}")
+        upload.mongodb_failed(e)
+
+
+def register_uploaded_icons(uploaded, errors):
+    for icon_data, target_path in uploaded:
+        admission.yield_to_reads()
+        try:
+            upload.register_uploaded_icon(icon_data, target_path, errors)
+        except Exception as e:
+            errors.append(f"File processing error: {str(e)}")
+            logger.error(f"Error processing file {icon_data['filename']}: {str(e)}")
+
+
+async def upload_icons(request):
+    """Upload icons from a ZIP file"""
+    try:
+        db = await async_db()
+        form = await request.form()
+        zip_file = form.get('iconsZip')
+        if zip_file is None or isinstance(zip_file, str):
+            return json_response({"error": "No file part"}, 400)
+        if not zip_file.filename:
+            return json_response({"error": "No selected file"}, 400)
+        if not zip_file.filename.endswith('.zip'):
+            return json_response({"error": "File must be a ZIP archive"}, 400)
+        provider = form.get('provider', 'azure')
+
+        with tracing.span('upload.extract', provider=provider):
+            copied, errors = await filesystem.offload(extract_upload, zip_file.file, provider)
+        structured_logging.annotate(provider=provider, icons=len(copied))
+        uploaded = [(upload.uploaded_icon_data(provider, category, file), target_path)
+                    for category, file, target_path in copied]
+
+        # MongoDB records are written concurrently (bounded by the mongodb lane),
+        # before replication is queued so the replication callback can update them
+        count_changes = {}
+        if db is not None:
+            await asyncio.gather(*(save_icon_metadata(db, icon_data, count_changes) for icon_data, _ in uploaded))
+        await object_store.offload(register_uploaded_icons, uploaded, errors)
+
+        # Publish the new icons to every server process before responding
+        await filesystem.offload(upload.icon_snapshot.flush)
+        if db is not None:
+            await icons_changed(db, count_changes)
+
+        uploaded_files = [icon_data for icon_data, _ in uploaded]
+        return json_response(upload.upload_result(uploaded_files, errors, db is not None), stream='uploadedFiles')
+    except Exception as e:
+        logger.error(f"Error uploading icons: {str(e)}")
+        logger.error(traceback.format_exc())
+        return json_response({"error": str(e)}, 500)
+
+
+# Diagrams
+
+async def json_store(function, *args):
+    """Apply a change to the local JSON diagram store"""
+    payload, status = await json_writes.offload(function, *args)
+    return json_response(payload, status)
+
+
+async def diagrams(request):
+    """
+    Endpoint to create and retrieve diagrams.
+    Uses MongoDB if available, falls back to local JSON storage.
+    """
+    try:
+        diagram_data = await request_json(request) if request.method == 'POST' else None
+        if request.method == 'POST' and not diagram_data:
+            return json_response({"error": "No data provided"}, 400)
+
+        db = await async_db()
+        if db is not None:
+            if request.method == 'GET':
+                try:
+                    summary_only = request.query_params.get('summary') == 'true'
+                    cursor = db.diagrams.find({}, summary_projection() if summary_only else {'_id': 0})
+                    # Fetch the first batch here so MongoDB errors can still fall back to JSON,
+                    # then stream the rest batch by batch
+                    first = await mongodb.run(cursor.to_list, STREAM_BATCH_SIZE)
+
+                    async def batches():
+                        batch = first
+                        while batch:
+                            yield batch if summary_only else [decode_diagram(d) for d in batch]
+                            if len(batch) < STREAM_BATCH_SIZE:
+                                break
+                            batch = await mongodb.run(cursor.to_list, STREAM_BATCH_SIZE)
+
+                    return json_response({"diagrams": batches()}, stream='diagrams')
+                except Exception as e:
+                    logger.error(f"Error retrieving diagrams from MongoDB: {e}")
+                    upload.mongodb_failed(e)
+
+            else:
+                try:
+                    upload.new_diagram(diagram_data)
+                    result = await mongodb.run(db.diagrams.insert_one, encode_diagram(diagram_data))
+                    upload.diagram_changed(diagram_data['diagramId'])
+                    await mongodb.offload(upload.record_diagram_version, True, diagram_data['diagramId'],
+                                          None, diagram_data)
+                    created_diagram = dict(diagram_data)
+                    created_diagram['_id'] = result.inserted_id
+                    return json_response({"success": True, "diagram": created_diagram}, 201)
+                except Exception as e:
+                    logger.error(f"Error creating diagram in MongoDB: {e}")
+                    upload.mongodb_failed(e)
+
+        # Fall back to JSON storage
+        if request.method == 'GET':
+            summary_only = request.query_params.get('summary') == 'true'
+            diagram_list = await filesystem.offload(upload.json_list_diagrams, summary_only)
+            return json_response({"diagrams": diagram_list}, stream='diagrams')
+        return await json_store(upload.json_create_diagram, diagram_data)
+
+    except Exception as e:
+        return error_response('diagrams', e)
+
+
+async def fetch_diagram(db, diagram_id):
+    """A diagram from MongoDB, decoded (None if not found); shared by concurrent GETs of the id"""
+    found = await mongodb.run(db.diagrams.find_one, {"diagramId": diagram_id}, {'_id': 0})
+    return decode_diagram(found) if found else None
+
+
+async def update_diagram(db, diagram_id, update_data):
+    """Merge update_data into a MongoDB diagram without losing concurrent updates
+    (see upload.update_diagram_mongodb); (previous, updated) or None if not found"""
+    revision_field = upload.REVISION_FIELD
+    update_data = {key: value for key, value in update_data.items() if key != revision_field}
+    for attempt in range(upload.UPDATE_ATTEMPTS):
+        if settable(update_data):
+            previous = await mongodb.run(
+                db.diagrams.find_one_and_update,
+                {"diagramId": diagram_id, BODY_FIELD: {"$exists": False}},
+                {"$set": update_data, "$inc": {revision_field: 1}},
+                projection={'_id': 0}, return_document=ReturnDocument.BEFORE)
+            if previous is not None:
+                revision = previous.get(revision_field, 0) + 1
+                updated = {**previous, **update_data, revision_field: revision}
+                encoded = encode_diagram(updated)
+                if is_encoded(encoded):
+                    await mongodb.run(db.diagrams.replace_one,
+                                      {"diagramId": diagram_id, revision_field: revision,
+                                       BODY_FIELD: {"$exists": False}}, encoded)
+                return previous, updated
+        stored = await mongodb.run(db.diagrams.find_one, {"diagramId": diagram_id}, {'_id': 0})
+        if stored is None:
+            return None
+        previous = decode_diagram(stored)
+        updated = {**previous, **update_data, revision_field: stored.get(revision_field, 0) + 1}
+        result = await mongodb.run(db.diagrams.replace_one,
+                                   {"diagramId": diagram_id, revision_field: stored.get(revision_field)},
+                                   encode_diagram(updated))
+        if result.matched_count:
+            return previous, updated
+        await asyncio.sleep(upload.update_conflict_delay(attempt))
+    raise RuntimeError(f"Diagram {diagram_id} kept changing during the update")
+
+
+async def diagram(request):
+    """
+    Endpoint to retrieve, update or delete a specific diagram.
+    Uses MongoDB if available, falls back to local JSON storage.
+    """
+    diagram_id = request.path_params['diagram_id']
+    try:
+        update_data = await request_json(request) if request.method == 'PUT' else None
+        if request.method == 'PUT' and not update_data:
+            return json_response({"error": "No data provided"}, 400)
+
+        db = await async_db()
+        if db is not None:
+            try:
+                if request.method == 'GET':
+                    found = await upload.diagram_fetches.do_async(('mongodb', diagram_id), fetch_diagram, db, diagram_id)
+                    if found:
+                        return json_response({"diagram": found})
+
+                elif request.method == 'PUT':
+                    update_data['updatedAt'] = time.time()
+                    updated = await update_diagram(db, diagram_id, update_data)
+                    if updated is not None:
+                        upload.diagram_changed(diagram_id)
+                        previous_diagram, updated_diagram = updated
+                        await mongodb.offload(upload.record_diagram_version, True, diagram_id,
+                                              previous_diagram, updated_diagram)
+                        return json_response({"success": True, "diagram": updated_diagram})
+
+                elif request.method == 'DELETE':
+                    result = await mongodb.run(db.diagrams.delete_one, {"diagramId": diagram_id})
+                    upload.diagram_changed(diagram_id)
+                    if result.deleted_count:
+                        await mongodb.offload(upload.get_version_store(True).delete, diagram_id)
+                        return json_response({"success": True, "message": f"Diagram {diagram_id} deleted"})
+                # Not found in MongoDB: fall back to JSON
+            except Exception as e:
+                logger.error(f"Error accessing diagram {diagram_id} in MongoDB: {e}")
+                upload.mongodb_failed(e)
+
+        # Fall back to JSON storage
+        if request.method == 'GET':
+            payload, status = await filesystem.offload(upload.json_get_diagram, diagram_id)
+            return json_response(payload, status)
+        if request.method == 'PUT':
+            return await json_store(upload.json_update_diagram, diagram_id, update_data)
+        return await json_store(upload.json_delete_diagram, diagram_id)
+
+    except Exception as e:
+        return error_response('diagram', e)
+
+
+async def admit(pool_name):
+    """A slot of an admission pool (see admission.py); only waits for it in a worker thread when the pool is full"""
+    permit = admission.acquire(pool_name, wait=False)
+    if permit is None:
+        permit = await anyio.to_thread.run_sync(admission.acquire, pool_name)
+    return permit
+
+
+def limited(pool_name, handler):
+    """Run a heavy handler holding a slot of the pool, or answer 429"""
+    @functools.wraps(handler)
+    async def endpoint(request):
+        try:
+            permit = await admit(pool_name)
+        except admission.Rejected as e:
+            return e.response(json_response)
+        with permit:
+            return await handler(request)
+    return endpoint
+
+
+def timed_route(route, handler):
+    """Record request metrics for a native route, labelled like the Flask rule
+    (Flask-served routes are recorded by the Flask app)"""
+    @functools.wraps(handler)
+    async def endpoint(request):
+        started = time.perf_counter()
+        tracing.clear()
+        structured_logging.begin_request()
+        read = request.method == 'GET'
+        if read:
+            admission.reads.enter()
+        try:
+            with tracing.start_request(request.method, route, request.headers) as root:
+                response = await handler(request)
+                root.set('http.status_code', response.status_code)
+        finally:
+            if read:
+                admission.reads.leave()
+        seconds = time.perf_counter() - started
+        metrics.observe_request(request.method, route, response.status_code, seconds)
+        structured_logging.end_request(request.method, route, response.status_code, seconds, root.trace_id)
+        if root.trace_id is not None:
+            response.headers['X-Trace-Id'] = root.trace_id
+        return response
+    return endpoint
+
+
+class TimedApp:
+    """Record request metrics for a mounted ASGI app, up to its response headers"""
+
+    def __init__(self, app, route):
+        self.app = app
+        self.route = route
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        tracing.clear()
+        structured_logging.begin_request()
+        root = tracing.start_request(scope['method'], self.route, Headers(scope=scope))
+
+        async def timed_send(message):
+            if message['type'] == 'http.response.start':
+                seconds = time.perf_counter() - started
+                metrics.observe_request(scope['method'], self.route, message['status'], seconds)
+                structured_logging.end_request(scope['method'], self.route, message['status'], seconds,
+                                               root.trace_id)
+                root.set('http.status_code', message['status'])
+            await send(message)
+        admission.reads.enter()
+        try:
+            with root:
+                await self.app(scope, receive, timed_send)
+        finally:
+            admission.reads.leave()
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    async_io.configure_threads()
+    yield
+    close_async_mongodb()
+    upload.shutdown()
+
+
+def create_asgi_app():
+    """Run the startup sequence and return the ASGI app"""
+    flask_app = WSGIMiddleware(upload.create_app(), workers=WSGI_WORKERS)
+    routes = [
+        Route('/api/icons', timed_route('/api/icons', list_icons), methods=['GET']),
+        Route('/api/categories', timed_route('/api/categories', list_categories), methods=['GET']),
+        Route('/api/upload/icons', timed_route('/api/upload/icons', limited('ingest', upload_icons)),
+              methods=['POST']),
+        Route('/api/diagrams', timed_route('/api/diagrams', diagrams), methods=['GET', 'POST']),
+        # Flask routes that /api/diagrams/{diagram_id} would otherwise shadow
+        Route('/api/diagrams/export', flask_app),
+        Route('/api/diagrams/import', flask_app),
+        Route('/api/diagrams/{diagram_id}', timed_route('/api/diagrams/<diagram_id>', diagram),
+              methods=['GET', 'PUT', 'DELETE']),
+        Mount('/cloudicons', app=TimedApp(StaticFiles(directory=upload.LOCAL_STORAGE_DIR, check_dir=False),
+                                          '/cloudicons/<path:filename>')),
+        Mount('', app=flask_app),
+    ]
+    middleware = [
+        # Same origins as flask_cors in upload.py; it replaces the headers Flask sets
+        Middleware(CORSMiddleware, allow_origins=upload.CORS_ORIGINS, allow_methods=['*'], allow_headers=['*']),
+    ]
+    return Starlette(routes=routes, middleware=middleware, lifespan=lifespan)
@@ -0,0 +1,111 @@
+"""
+Bounded I/O lanes for the ASGI app.
+
+The async handlers (see async_api.py) never block the event loop: blocking
+work (filesystem, the GCS replication queue, the JSON diagram store) is
+offloaded to worker threads, and MongoDB is awaited through motor. Each kind
+of I/O goes through a Lane that caps how many operations run at once, so a
+burst of requests queues on the lane instead of piling up threads or
+exhausting the MongoDB pool:
+
+    rows = await filesystem.offload(load_diagrams)
+    doc = await mongodb.run(db.diagrams.find_one, {"diagramId": diagram_id})
+
+Limits are set with ASGI_FILESYSTEM_CONCURRENCY, ASGI_OBJECT_STORE_CONCURRENCY
+and ASGI_MONGODB_CONCURRENCY. Offloaded calls (and Starlette's own file and
+form handling) share anyio's pool of ASGI_THREADS worker threads.
+"""
+
+import os
+import time
+import asyncio
+import logging
+import functools
+
+import anyio.to_thread
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+# Worker threads for offloaded calls
+THREADS = int(os.environ.get('ASGI_THREADS', 40))
+
+
+class Lane:
+    """Caps concurrent operations of one kind of I/O"""
+
+    def __init__(self, name, limit):
+        self.name = name
+        self.limit = limit
+        self.active = 0
+        self.waiting = 0
+        self.completed = 0
+        self.wait_seconds = 0.0
+        self._semaphore = None
+        self._loop = None
+
+    def _get_semaphore(self):
+        # Semaphores belong to one event loop; a new loop (e.g. in tests) gets a new one
+        loop = asyncio.get_running_loop()
+        if self._semaphore is None or self._loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.limit)
+            self._loop = loop
+        return self._semaphore
+
+    async def run(self, func, *args, **kwargs):
+        """Await func(*args, **kwargs) once the lane has room for it.
+        The call is only made then: motor starts an operation as soon as it is called."""
+        return await self._run(getattr(func, '__name__', 'call'), func, *args, **kwargs)
+
+    async def offload(self, func, *args, **kwargs):
+        """Run a blocking call in a worker thread once the lane has room for it"""
+        return await self._run(getattr(func, '__name__', 'call'), anyio.to_thread.run_sync,
+                               functools.partial(func, *args, **kwargs))
+
+    async def _run(self, name, func, *args, **kwargs):
+        semaphore = self._get_semaphore()
+        # A span per call in traced requests, with the time spent waiting for the lane
+        with tracing.span(f"lane.{self.name}", call=name) as span:
+            started = time.perf_counter()
+            self.waiting += 1
+            try:
+                await semaphore.acquire()
+            finally:
+                self.waiting -= 1
+            waited = time.perf_counter() - started
+            self.wait_seconds += waited
+            span.set('waitMs', round(waited * 1000, 3))
+            self.active += 1
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                self.active -= 1
+                self.completed += 1
+                semaphore.release()
+
+    def status(self):
+        return {
+            "limit": self.limit,
+            "active": self.active,
+            "waiting": self.waiting,
+            "completed": self.completed,
+            "waitSeconds": round(self.wait_seconds, 3),
+        }
+
+
+filesystem = Lane('filesystem', int(os.environ.get('ASGI_FILESYSTEM_CONCURRENCY', 16)))
+# Enqueuing GCS operations blocks while the replication queue is full, i.e. while GCS is slow
+object_store = Lane('object-store', int(os.environ.get('ASGI_OBJECT_STORE_CONCURRENCY', 8)))
+mongodb = Lane('mongodb', int(os.environ.get('ASGI_MONGODB_CONCURRENCY', 32)))
+
+LANES = (filesystem, object_store, mongodb)
+
+
+def configure_threads():
+    """Size anyio's default thread limiter (call from the running event loop)"""
+    anyio.to_thread.current_default_thread_limiter().total_tokens = THREADS
+
+
+def status():
+    return {lane.name: lane.status() for lane in LANES}
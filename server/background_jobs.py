@@ -0,0 +1,395 @@
+"""
+Background jobs for long-running maintenance operations.
+
+Operations such as wiping every icon can take far longer than a request
+should. They run in a background thread instead, and the request returns a
+job id that can be polled for progress:
+
+    job = jobs.start('delete-all-icons', run_delete_all)
+    return json_response(job.to_dict()), 202
+
+    GET /api/jobs/<job_id>  ->  {"state": "running", "progress": {...}}
+
+Once configure() is given a directory shared by the server processes, each
+job is also written to <directory>/<job id>.json (on every state change and
+at most every BACKGROUND_JOBS_SAVE_INTERVAL seconds while it makes progress),
+so any worker can report a job another one runs. A job whose process exited
+before it finished is reported as failed. Jobs started with exclusive=True
+hold a lock on <directory>/<kind>.lock while they run, so a second job of the
+kind is refused with JobRunning in every process. The most recent MAX_JOBS
+are retained.
+"""
+
+import os
+import re
+import json
+import time
+import fcntl
+import uuid
+import socket
+import logging
+import threading
+import traceback
+from collections import OrderedDict
+
+logger = logging.getLogger(__name__)
+
+MAX_JOBS = int(os.environ.get('BACKGROUND_JOBS_RETAINED', 50))
+SAVE_INTERVAL = float(os.environ.get('BACKGROUND_JOBS_SAVE_INTERVAL', 0.5))
+
+PENDING = 'pending'
+RUNNING = 'running'
+SUCCEEDED = 'succeeded'
+FAILED = 'failed'
+
+JOB_ID = re.compile(r'^[0-9a-f]{32}$')
+
+
+class JobRunning(Exception):
+    """Raised when an exclusive job is started while another of its kind is running"""
+
+    def __init__(self, kind, job=None):
+        super().__init__(f"A {kind} job is already running")
+        self.kind = kind
+        self.job = job
+
+
+def worker_name():
+    """host:pid of this process, recorded on the jobs it runs"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def worker_exited(worker):
+    """Whether the process named by worker_name() is known to have exited (only checkable on this host)"""
+    host, _, pid = (worker or '').rpartition(':')
+    if host != socket.gethostname():
+        return False
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return True
+    except (PermissionError, ValueError):
+        return False
+    return False
+
+
+class Job:
+    """State and progress of one background operation"""
+
+    def __init__(self, kind):
+        self.id = uuid.uuid4().hex
+        self.kind = kind
+        self.state = PENDING
+        self.progress = {}
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.worker = worker_name()
+        self._lock = threading.Lock()
+        # Set by a registry that keeps jobs in files
+        self._store = None
+        self._save_lock = threading.Lock()
+        self._saved_at = 0
+
+    @classmethod
+    def from_dict(cls, data):
+        """A job as another process saved it"""
+        job = cls(data["kind"])
+        job.id = data["jobId"]
+        job.state = data["state"]
+        job.progress = data.get("progress") or {}
+        job.result = data.get("result")
+        job.error = data.get("error")
+        job.created_at = data.get("createdAt") or 0
+        job.started_at = data.get("startedAt")
+        job.finished_at = data.get("finishedAt")
+        job.worker = data.get("worker")
+        if not job.done and worker_exited(job.worker):
+            job.state = FAILED
+            job.error = f"Worker {job.worker} exited before the job finished"
+        return job
+
+    def add(self, section, **counts):
+        """Increment counters in a progress section, e.g. add('gcs', deleted=100)"""
+        with self._lock:
+            values = self.progress.setdefault(section, {})
+            for key, value in counts.items():
+                values[key] = values.get(key, 0) + value
+        self._progressed()
+
+    def set(self, section, **values):
+        """Set values in a progress section, e.g. set('gcs', listed=True)"""
+        with self._lock:
+            self.progress.setdefault(section, {}).update(values)
+        self._progressed()
+
+    def _progressed(self):
+        if self._store is not None and time.time() - self._saved_at >= SAVE_INTERVAL:
+            self.save()
+
+    def save(self):
+        """Write the job's current state for other processes to read"""
+        if self._store is None:
+            return
+        # One save at a time, so an earlier state never replaces a later one
+        with self._save_lock:
+            self._saved_at = time.time()
+            try:
+                self._store(self.to_dict())
+            except Exception as e:
+                logger.error(f"Error saving job {self.kind} {self.id}: {e}")
+
+    @property
+    def done(self):
+        return self.state in (SUCCEEDED, FAILED)
+
+    def to_dict(self):
+        with self._lock:
+            progress = {section: dict(values) for section, values in self.progress.items()}
+        end = self.finished_at or time.time()
+        return {
+            "jobId": self.id,
+            "kind": self.kind,
+            "state": self.state,
+            "progress": progress,
+            "result": self.result,
+            "error": self.error,
+            "createdAt": self.created_at,
+            "startedAt": self.started_at,
+            "finishedAt": self.finished_at,
+            "elapsedSeconds": round(end - self.started_at, 3) if self.started_at else 0,
+            "worker": self.worker,
+        }
+
+
+class JobRegistry:
+    """Starts jobs in background threads and keeps the most recent ones"""
+
+    def __init__(self, max_jobs=MAX_JOBS, directory=None):
+        self.max_jobs = max_jobs
+        self.directory = None
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+        if directory is not None:
+            self.configure(directory)
+
+    def configure(self, directory):
+        """Keep jobs in directory, shared by every server process"""
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+
+    # Files
+
+    def _path(self, job_id):
+        return os.path.join(self.directory, f"{job_id}.json")
+
+    def _store(self, data):
+        path = self._path(data["jobId"])
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(data, f, default=str)
+        os.replace(temp_path, path)
+
+    def _load(self, job_id):
+        try:
+            with open(self._path(job_id), 'r') as f:
+                return Job.from_dict(json.load(f))
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Error reading job {job_id}: {e}")
+            return None
+
+    def _stored(self):
+        if self.directory is None:
+            return []
+        jobs = []
+        for name in os.listdir(self.directory):
+            job_id, extension = os.path.splitext(name)
+            if extension == '.json' and JOB_ID.match(job_id):
+                job = self._load(job_id)
+                if job is not None:
+                    jobs.append(job)
+        return jobs
+
+    def _prune_stored(self):
+        """Delete the files of the oldest finished jobs beyond the limit"""
+        stored = sorted(self._stored(), key=lambda job: job.created_at)
+        excess = len(stored) - self.max_jobs
+        for job in stored:
+            if excess <= 0:
+                break
+            if job.done:
+                try:
+                    os.remove(self._path(job.id))
+                except FileNotFoundError:
+                    pass
+                excess -= 1
+
+    # Lookup
+
+    def get(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is None and self.directory is not None and JOB_ID.match(job_id or ''):
+            # Started by another worker (or by this one and since forgotten)
+            job = self._load(job_id)
+        return job
+
+    def list(self, kind=None):
+        with self._lock:
+            jobs = {job.id: job for job in self._jobs.values()}
+        for job in self._stored():
+            # This process's own jobs are more current than their files
+            jobs.setdefault(job.id, job)
+        jobs = sorted(jobs.values(), key=lambda job: job.created_at, reverse=True)[:self.max_jobs]
+        return [job for job in jobs if kind is None or job.kind == kind]
+
+    def running(self, kind):
+        """Return the unfinished job of the given kind, if any"""
+        for job in self.list(kind):
+            if not job.done:
+                return job
+        return None
+
+    def _register(self, job):
+        with self._lock:
+            self._jobs[job.id] = job
+            # Forget the oldest finished jobs beyond the limit
+            for old_id in list(self._jobs):
+                if len(self._jobs) <= self.max_jobs:
+                    break
+                if self._jobs[old_id].done:
+                    del self._jobs[old_id]
+        if self.directory is not None:
+            job._store = self._store
+            job.save()
+            try:
+                self._prune_stored()
+            except OSError as e:
+                logger.error(f"Error pruning stored jobs: {e}")
+
+    def _exclusive(self, kind):
+        """Lock that a job of this kind holds while it runs; raises JobRunning if another one holds it"""
+        if self.directory is None:
+            running = self.running(kind)
+            if running is not None:
+                raise JobRunning(kind, running)
+            return None
+        lock_file = open(os.path.join(self.directory, f"{kind}.lock"), 'a')
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            lock_file.close()
+            raise JobRunning(kind, self.running(kind))
+        return lock_file
+
+    def run(self, job, target, lock_file=None):
+        """Run target(job) in the current thread, recording its outcome"""
+        job.state = RUNNING
+        job.started_at = time.time()
+        job.save()
+        try:
+            job.result = target(job)
+            job.state = SUCCEEDED
+            logger.info(f"Job {job.kind} {job.id} finished in {time.time() - job.started_at:.2f}s")
+        except Exception as e:
+            job.error = str(e)
+            job.state = FAILED
+            logger.error(f"Job {job.kind} {job.id} failed: {e}")
+            logger.error(traceback.format_exc())
+        finally:
+            job.finished_at = time.time()
+            job.save()
+            if lock_file is not None:
+                lock_file.close()
+        return job
+
+    def start(self, kind, target, exclusive=False):
+        """Create a job and run target(job) in a background thread.
+        With exclusive=True, raises JobRunning while a job of this kind runs in any process."""
+        lock_file = self._exclusive(kind) if exclusive else None
+        try:
+            job = Job(kind)
+            self._register(job)
+            threading.Thread(target=self.run, args=(job, target, lock_file), name=f"job-{kind}",
+                             daemon=True).start()
+        except Exception:
+            if lock_file is not None:
+                lock_file.close()
+            raise
+        return job
+
+    def schedule(self, kind, target, interval, lock_path=None):
+        """Start a job of this kind every `interval` seconds unless one is still running.
+
+        With lock_path, processes sharing the lock file (e.g. server workers)
+        run the job once per interval between them: a run is skipped while
+        another process holds the lock or ran it less than an interval ago.
+        Skipped runs are logged, not recorded as jobs.
+        """
+        def claim():
+            """The schedule lock file, locked, if this process runs the job now; otherwise None"""
+            lock_file = open(lock_path, 'a+')
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                lock_file.close()
+                logger.info(f"Skipping scheduled {kind} job: running in another process")
+                return None
+            lock_file.seek(0)
+            last_run = float(lock_file.read() or 0)
+            if time.time() - last_run < interval * 0.9:
+                lock_file.close()
+                logger.info(f"Skipping scheduled {kind} job: ran recently in another process")
+                return None
+            return lock_file
+
+        def locked(lock_file):
+            def run(job):
+                try:
+                    return target(job)
+                finally:
+                    lock_file.seek(0)
+                    lock_file.truncate()
+                    lock_file.write(str(time.time()))
+                    lock_file.close()
+            return run
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                lock_file = None
+                try:
+                    if lock_path:
+                        lock_file = claim()
+                        if lock_file is None:
+                            continue
+                    self.start(kind, locked(lock_file) if lock_file is not None else target, exclusive=True)
+                except JobRunning:
+                    if lock_file is not None:
+                        lock_file.close()
+                except Exception as e:
+                    if lock_file is not None:
+                        lock_file.close()
+                    logger.error(f"Error starting scheduled {kind} job: {e}")
+
+        threading.Thread(target=loop, name=f"schedule-{kind}", daemon=True).start()
+        logger.info(f"Scheduled {kind} job every {interval}s")
+
+    def run_now(self, kind, target, exclusive=False):
+        """Create a job and run it synchronously (see start for exclusive)"""
+        lock_file = self._exclusive(kind) if exclusive else None
+        try:
+            job = Job(kind)
+            self._register(job)
+        except Exception:
+            if lock_file is not None:
+                lock_file.close()
+            raise
+        return self.run(job, target, lock_file)
+
+
+jobs = JobRegistry()
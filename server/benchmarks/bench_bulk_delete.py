@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Benchmark deleting every icon from local storage and GCS.
+
+Creates --count icon files locally and --count objects in a fake GCS bucket
+(fake_gcs.FakeClient, with --latency seconds per round trip), then deletes
+them with bulk_delete.delete_all. The one-call-at-a-time loop the server used
+before is timed on --baseline-sample objects and extrapolated.
+
+Usage:
+    python benchmarks/bench_bulk_delete.py --count 50000 --latency 0.02
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import bulk_delete
+from background_jobs import Job
+from fake_gcs import FakeClient
+
+BUCKET = "bench-icons"
+
+
+def populate(local_root, gcs_root, count, categories=20):
+    for i in range(count):
+        category = f"category-{i % categories}"
+        for root in (local_root, os.path.join(gcs_root, BUCKET, "cloudicons")):
+            directory = os.path.join(root, "azure", category)
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, f"icon-{i}.svg"), 'w') as f:
+                f.write('<svg/>')
+
+
+def sequential_baseline(local_root, client, sample):
+    """Time the previous implementation (one os.remove / blob.delete per icon)"""
+    paths = []
+    for path in bulk_delete.iter_local_files(local_root):
+        paths.append(path)
+        if len(paths) >= sample:
+            break
+    start = time.perf_counter()
+    for path in paths:
+        os.remove(path)
+    local_seconds = time.perf_counter() - start
+
+    bucket = client.bucket(BUCKET)
+    blobs = []
+    for blob in bucket.list_blobs(prefix="cloudicons/"):
+        blobs.append(blob)
+        if len(blobs) >= sample:
+            break
+    start = time.perf_counter()
+    for blob in blobs:
+        blob.delete()
+    gcs_seconds = time.perf_counter() - start
+    return len(paths), local_seconds, len(blobs), gcs_seconds
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=50000)
+    parser.add_argument("--latency", type=float, default=0.02, help="Simulated GCS round trip in seconds")
+    parser.add_argument("--baseline-sample", type=int, default=200)
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        local_root = os.path.join(temp_dir, "cloudicons")
+        gcs_root = os.path.join(temp_dir, "gcs")
+        populate(local_root, gcs_root, args.count)
+
+        def client_factory():
+            return FakeClient(gcs_root, latency=args.latency)
+
+        sampled_local, local_seconds, sampled_gcs, gcs_seconds = sequential_baseline(
+            local_root, client_factory(), args.baseline_sample)
+        remaining = args.count - max(sampled_local, sampled_gcs)
+        estimate = (local_seconds / max(sampled_local, 1) + gcs_seconds / max(sampled_gcs, 1)) * args.count
+        print(f"[sequential] {args.baseline_sample} icons in {local_seconds + gcs_seconds:.2f}s, "
+              f"estimated {estimate:.1f}s for {args.count}")
+
+        job = Job('delete-all-icons')
+        start = time.perf_counter()
+        result = bulk_delete.delete_all(job, local_root=local_root, gcs_client_factory=client_factory,
+                                        bucket_name=BUCKET)
+        seconds = time.perf_counter() - start
+        print(f"[bulk] {result['deletedCount']} objects ({remaining} icons in each store) in {seconds:.2f}s, "
+              f"{result['errorCount']} errors, progress {job.to_dict()['progress']}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({
+                "count": args.count,
+                "latency": args.latency,
+                "sequentialEstimateSeconds": round(estimate, 3),
+                "bulkSeconds": round(seconds, 3),
+                "result": result,
+            }, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
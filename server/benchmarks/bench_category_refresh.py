@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Benchmark the incremental icon category refresh.
+
+Creates --categories folders of --icons-per-category SVG files, with matching
+MongoDB records, and times a full refresh, a refresh with no changes, and a
+refresh after moving one icon to another folder. Uses mongomock unless
+--mongo-uri is given (mongomock evaluates $in slowly, so keep the full run
+small without a real server).
+
+Usage:
+    python benchmarks/bench_category_refresh.py --categories 20 --icons-per-category 50
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import category_refresh
+from category_refresh import refresh_categories
+
+
+def populate(root, db, categories, per_category):
+    docs = []
+    for c in range(categories):
+        directory = os.path.join(root, "azure", f"Category{c}")
+        os.makedirs(directory)
+        for i in range(per_category):
+            filename = f"{c * per_category + i:05d}-icon-service-Icon-{i}.svg"
+            with open(os.path.join(directory, filename), 'w') as f:
+                f.write('<svg/>')
+            docs.append({"provider": "azure", "filename": filename, "category": "Unsorted"})
+    db.icons.insert_many(docs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--categories", type=int, default=20)
+    parser.add_argument("--icons-per-category", type=int, default=50)
+    parser.add_argument("--mongo-uri", help="Benchmark against this MongoDB server instead of mongomock")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        client = MongoClient(args.mongo_uri)
+        db = client["category_refresh_bench"]
+        db.icons.drop()
+    else:
+        import mongomock
+        client = mongomock.MongoClient()
+        db = client["category_refresh_bench"]
+    db.icons.create_index([("provider", 1), ("filename", 1)], unique=True)
+
+    # The generated folders are brand new; treat them as settled
+    category_refresh.MTIME_SETTLE_NS = 0
+
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = os.path.join(temp_dir, "cloudicons")
+        checkpoint = os.path.join(temp_dir, "checkpoint.json")
+        populate(root, db, args.categories, args.icons_per_category)
+
+        def run(label, **kwargs):
+            result = refresh_categories(db, root, checkpoint, **kwargs)
+            print(f"[{label}] {result['milliseconds']:.1f} ms, {result['changedDirectories']} changed directories, "
+                  f"{result['examined']} records examined, {result['updatedCount']} updated")
+            results.append({"phase": label, **result})
+
+        run("full", full=True)
+        run("no changes")
+        source = os.path.join(root, "azure", "Category0")
+        moved = sorted(os.listdir(source))[0]
+        time.sleep(0.01)
+        os.rename(os.path.join(source, moved), os.path.join(root, "azure", "Category1", moved))
+        run("one icon moved")
+
+    if args.mongo_uri:
+        client.drop_database("category_refresh_bench")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"icons": args.categories * args.icons_per_category, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
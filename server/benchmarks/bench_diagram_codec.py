@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark the diagram storage codec on large synthetic diagrams.
+
+For diagrams of --nodes nodes, compares the stored size and the encode/decode
+latency of the previous storage format (pretty-printed JSON, indent=2) with
+compact JSON and the zlib and zstd codecs from diagram_codec.py.
+
+Usage:
+    python benchmarks/bench_diagram_codec.py --nodes 5000
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import diagram_codec
+from diagram_codec import encode_diagram, decode_diagram
+from bench_diagram_versions import make_diagram
+
+
+def timed(fn, repeat):
+    """Return (result, median milliseconds) of calling fn repeat times"""
+    timings = []
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return result, statistics.median(timings)
+
+
+def bench_json(label, diagram, repeat, **dump_args):
+    text, encode_ms = timed(lambda: json.dumps(diagram, **dump_args), repeat)
+    _, decode_ms = timed(lambda: json.loads(text), repeat)
+    return {"format": label, "bytes": len(text.encode('utf-8')),
+            "encodeMs": round(encode_ms, 2), "decodeMs": round(decode_ms, 2)}
+
+
+def bench_codec(codec, diagram, repeat):
+    # Text form, as written to data/diagrams.json (base64 body)
+    def encode():
+        return json.dumps(encode_diagram(diagram, text=True, codec=codec, threshold=0),
+                          separators=(',', ':'))
+    text, encode_ms = timed(encode, repeat)
+    decoded, decode_ms = timed(lambda: decode_diagram(json.loads(text)), repeat)
+    assert decoded == diagram
+    # Binary form, as stored in MongoDB (BSON binary body)
+    stored = encode_diagram(diagram, codec=codec, threshold=0)
+    return {"format": codec, "bytes": len(text), "binaryBytes": len(stored["_body"]["data"]),
+            "encodeMs": round(encode_ms, 2), "decodeMs": round(decode_ms, 2)}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--nodes", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    diagram = make_diagram(args.nodes)
+    results = [
+        bench_json("json indent=2", diagram, args.repeat, indent=2),
+        bench_json("json compact", diagram, args.repeat, separators=(',', ':')),
+        bench_codec("zlib", diagram, args.repeat),
+    ]
+    if diagram_codec.zstandard is not None:
+        results.append(bench_codec("zstd", diagram, args.repeat))
+    else:
+        print("zstandard not installed, skipping zstd")
+
+    baseline = results[0]["bytes"]
+    print(f"Diagram with {args.nodes} nodes and {len(diagram['edges'])} edges")
+    print(f"{'format':<16}{'bytes':>12}{'ratio':>8}{'encode ms':>12}{'decode ms':>12}")
+    for r in results:
+        print(f"{r['format']:<16}{r['bytes']:>12}{r['bytes'] / baseline:>8.1%}"
+              f"{r['encodeMs']:>12}{r['decodeMs']:>12}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"nodes": args.nodes, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+"""
+Benchmark streaming NDJSON import/export of diagrams.
+
+Generates --count diagrams as an NDJSON file, imports it into a local JSON
+store (and into MongoDB when --mongo-uri is given), exports it back and
+reports throughput together with the growth of the process's peak RSS during
+each phase (a constant-memory phase leaves it roughly unchanged).
+
+Usage:
+    python benchmarks/bench_diagram_transfer.py --count 100000
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import resource
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from diagram_transfer import import_local, import_mongodb, export_local, export_mongodb, to_ndjson
+from mongodb_schema import ensure_indexes
+
+
+def write_ndjson(path, count, nodes):
+    with open(path, 'w') as f:
+        for i in range(count):
+            f.write(to_ndjson({
+                "diagramId": f"diagram-{i}",
+                "name": f"Diagram {i}",
+                "nodes": [{"id": f"n{j}", "position": {"x": j * 10, "y": 0},
+                           "data": {"label": f"Node {j}"}} for j in range(nodes)],
+                "edges": [{"id": f"e{j}", "source": f"n{j}", "target": f"n{j + 1}"}
+                          for j in range(nodes - 1)],
+            }))
+
+
+def peak_rss_mib():
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure(label, fn, count):
+    peak_before = peak_rss_mib()
+    start = time.perf_counter()
+    result = fn()
+    seconds = time.perf_counter() - start
+    growth = peak_rss_mib() - peak_before
+    print(f"[{label}] {count} diagrams in {seconds:.2f}s ({count / seconds:,.0f}/s), "
+          f"peak RSS growth {growth:.1f} MiB")
+    return {"phase": label, "seconds": round(seconds, 3), "perSecond": round(count / seconds),
+            "peakRssGrowthMiB": round(growth, 2), "result": result}
+
+
+def drain(lines):
+    count = 0
+    for _ in lines:
+        count += 1
+    return count
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=100000)
+    parser.add_argument("--nodes", type=int, default=5)
+    parser.add_argument("--mongo-uri", help="Also benchmark MongoDB import/export against this server")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    results = []
+    with tempfile.TemporaryDirectory() as temp_dir:
+        source = os.path.join(temp_dir, "source.ndjson")
+        write_ndjson(source, args.count, args.nodes)
+        store = os.path.join(temp_dir, "diagrams.json")
+
+        with open(source, 'rb') as f:
+            results.append(measure("local import", lambda: import_local(store, f).to_dict(), args.count))
+        with open(source, 'rb') as f:
+            results.append(measure("local re-import (upsert)", lambda: import_local(store, f).to_dict(), args.count))
+        results.append(measure("local export", lambda: drain(export_local(store)), args.count))
+
+        if args.mongo_uri:
+            from pymongo import MongoClient
+            client = MongoClient(args.mongo_uri)
+            db = client["diagram_transfer_bench"]
+            db.diagrams.drop()
+            ensure_indexes(db)
+            with open(source, 'rb') as f:
+                results.append(measure("mongodb import", lambda: import_mongodb(db.diagrams, f).to_dict(), args.count))
+            results.append(measure("mongodb export", lambda: drain(export_mongodb(db.diagrams)), args.count))
+            client.drop_database("diagram_transfer_bench")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"count": args.count, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Benchmark diagram version materialization latency.
+
+Builds a diagram history of --versions saves (small node edits on a diagram of
+--nodes nodes, with occasional node additions and removals), records it in the
+local JSON version store (and in MongoDB when --mongo-uri is given), then
+materializes random versions and reports latency percentiles and storage size.
+
+Usage:
+    python benchmarks/bench_diagram_versions.py --versions 1000 --nodes 500
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import random
+import argparse
+import tempfile
+import statistics
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from diagram_versions import JsonVersionStore, MongoVersionStore, SNAPSHOT_INTERVAL
+from mongodb_schema import ensure_indexes
+
+
+def make_diagram(node_count):
+    """Create a synthetic React Flow style diagram"""
+    nodes = [{
+        "id": f"node-{i}",
+        "type": "azureResource",
+        "position": {"x": (i % 40) * 120, "y": (i // 40) * 120},
+        "data": {"label": f"Resource {i}", "icon": f"/cloudicons/azure/Compute/icon-{i % 50}.svg"}
+    } for i in range(node_count)]
+    edges = [{
+        "id": f"edge-{i}",
+        "source": f"node-{i}",
+        "target": f"node-{i + 1}"
+    } for i in range(node_count - 1)]
+    return {"diagramId": "bench", "name": "Benchmark diagram", "nodes": nodes, "edges": edges}
+
+
+def evolve(diagram, rng, step):
+    """Return the next version of diagram with a handful of edits"""
+    diagram = copy.deepcopy(diagram)
+    for node in rng.sample(diagram["nodes"], min(3, len(diagram["nodes"]))):
+        node["position"]["x"] += rng.randint(-20, 20)
+        node["position"]["y"] += rng.randint(-20, 20)
+    if step % 7 == 0:
+        diagram["nodes"].append({
+            "id": f"added-{step}",
+            "type": "azureResource",
+            "position": {"x": 0, "y": 0},
+            "data": {"label": f"Added {step}"}
+        })
+    if step % 11 == 0 and diagram["nodes"]:
+        diagram["nodes"].pop(rng.randrange(len(diagram["nodes"])))
+    diagram["updatedAt"] = time.time()
+    return diagram
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def run(store, label, history, samples, rng):
+    """Record history in store and time materialization of random versions"""
+    start = time.perf_counter()
+    previous = None
+    for diagram in history:
+        store.record("bench", previous, diagram)
+        previous = diagram
+    record_seconds = time.perf_counter() - start
+
+    timings = []
+    for _ in range(samples):
+        version = rng.randint(1, len(history))
+        start = time.perf_counter()
+        doc = store.get_version("bench", version)
+        timings.append((time.perf_counter() - start) * 1000)
+        assert doc == history[version - 1], f"version {version} mismatch"
+
+    result = {
+        "store": label,
+        "versions": len(history),
+        "recordTotalSeconds": round(record_seconds, 3),
+        "materializeMs": {
+            "mean": round(statistics.mean(timings), 3),
+            "p50": round(percentile(timings, 50), 3),
+            "p95": round(percentile(timings, 95), 3),
+            "max": round(max(timings), 3),
+        },
+    }
+    print(f"[{label}] recorded {len(history)} versions in {record_seconds:.2f}s; "
+          f"materialize p50={result['materializeMs']['p50']}ms "
+          f"p95={result['materializeMs']['p95']}ms max={result['materializeMs']['max']}ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--versions", type=int, default=1000)
+    parser.add_argument("--nodes", type=int, default=500)
+    parser.add_argument("--samples", type=int, default=200)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--mongo-uri", help="Also benchmark MongoVersionStore against this server")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    history = [make_diagram(args.nodes)]
+    for step in range(1, args.versions):
+        history.append(evolve(history[-1], rng, step))
+
+    full_size = sum(len(json.dumps(d, separators=(',', ':'))) for d in history)
+    results = {"snapshotInterval": SNAPSHOT_INTERVAL, "fullCopiesBytes": full_size, "runs": []}
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        store = JsonVersionStore(temp_dir)
+        results["runs"].append(run(store, "json", history, args.samples, rng))
+        stored = sum(os.path.getsize(os.path.join(temp_dir, f)) for f in os.listdir(temp_dir))
+        results["runs"][-1]["storedBytes"] = stored
+        print(f"[json] stored {stored} bytes vs {full_size} bytes as full copies "
+              f"({stored / full_size:.1%})")
+
+    if args.mongo_uri:
+        from pymongo import MongoClient
+        client = MongoClient(args.mongo_uri)
+        db = client["diagram_versions_bench"]
+        db.diagram_versions.drop()
+        ensure_indexes(db)
+        results["runs"].append(run(MongoVersionStore(db), "mongodb", history, args.samples, rng))
+        client.drop_database("diagram_versions_bench")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
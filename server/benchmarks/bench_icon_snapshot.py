@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+"""
+Benchmark the shared icon snapshot behind GET /api/icons.
+
+Creates --icons SVG files in --categories folders and compares listing a
+provider by walking the folders (what every worker did per request) with
+listing it from the memory-mapped snapshot. Also times a full rebuild,
+publishing a single-icon change (appended to the snapshot log), which every
+worker then sees, and folding the logged changes into a new snapshot file.
+
+Usage:
+    python benchmarks/bench_icon_snapshot.py --icons 20000 --categories 40
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from catalog_snapshot import IconSnapshot, listing_display_name
+
+
+def walk_listing(provider_dir):
+    icons = []
+    for root, _, files in os.walk(provider_dir):
+        rel_path = os.path.relpath(root, provider_dir)
+        category = rel_path if rel_path != '.' else 'General'
+        for file in files:
+            if file.lower().endswith('.svg'):
+                icons.append((category, file, listing_display_name(file)))
+    return icons
+
+
+def timed(function, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        result = function()
+    return (time.perf_counter() - started) / repeat * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--icons", type=int, default=20000)
+    parser.add_argument("--categories", type=int, default=40)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        root = os.path.join(temp_dir, "cloudicons")
+        for i in range(args.icons):
+            directory = os.path.join(root, "azure", f"Category{i % args.categories}")
+            os.makedirs(directory, exist_ok=True)
+            with open(os.path.join(directory, f"{i:06d}-icon-service-Icon-{i}.svg"), 'w') as f:
+                f.write('<svg/>')
+
+        snapshot = IconSnapshot(os.path.join(temp_dir, "data", "icon_catalog.snap"), root)
+        results = {}
+        results["rebuildMs"], _ = timed(snapshot.rebuild, 1)
+        results["walkListingMs"], walked = timed(lambda: walk_listing(os.path.join(root, "azure")), args.repeat)
+        results["snapshotListingMs"], listed = timed(lambda: list(snapshot.current().icons("azure")), args.repeat)
+        results["snapshotCategoriesMs"], _ = timed(lambda: snapshot.current().categories("azure"), args.repeat)
+
+        def publish_one():
+            snapshot.upsert("azure", "Category0", "zz-new.svg", local=True)
+            return snapshot.flush()
+        results["publishOneMs"], _ = timed(publish_one, args.repeat)
+        results["loggedListingMs"], _ = timed(lambda: list(snapshot.current().icons("azure")), args.repeat)
+        results["compactMs"], _ = timed(snapshot.compact, 1)
+        results["snapshotBytes"] = snapshot.status()["bytes"]
+        assert len(walked) == len(listed)
+
+    for key, value in results.items():
+        print(f"{key:>22}: {value:,.2f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"icons": args.icons, "categories": args.categories, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+"""
+Benchmark the cost of logging on the request thread.
+
+Compares the old setup, a synchronous basicConfig-style text handler with a
+line per icon and per health probe, with structured_logging: a QueueHandler
+(formatting and writes on the listener thread), per-request summaries with
+counted events, and sampled summaries for /api/health. Both write to a file;
+--sink-latency adds a delay to every write, like a busy terminal or log pipe.
+
+    record        one logger.info(f"...") call
+    icon_loop     --icons per-file events: a log line each vs count()
+    health        GET /api/health through the Flask test client
+    list          GET /api/icons (--icons icons) through the Flask test client
+
+Usage:
+    python benchmarks/bench_logging.py --calls 20000 --requests 2000 --icons 2000
+    python benchmarks/bench_logging.py --sink-latency 0.0005
+"""
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import structured_logging
+from synthetic import write_icon_tree
+
+logger = logging.getLogger('bench')
+
+
+def per_call_us(function, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - started) / calls * 1e6
+
+
+class SlowFile:
+    """A log file whose writes take latency seconds"""
+
+    def __init__(self, path, latency):
+        self.file = open(path, 'a')
+        self.latency = latency
+
+    def write(self, text):
+        if self.latency:
+            time.sleep(self.latency)
+        return self.file.write(text)
+
+    def flush(self):
+        self.file.flush()
+
+
+def use_sync_handler(sink):
+    """The previous setup: basicConfig's handler, writing on the calling thread, without summaries"""
+    structured_logging.stop()
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    handler = logging.StreamHandler(sink)
+    handler.setFormatter(logging.Formatter(structured_logging.TEXT_FORMAT))
+    root.addHandler(handler)
+    root.setLevel(logging.INFO)
+    structured_logging.request_logger.disabled = True
+
+
+def use_queue_handler(sink):
+    structured_logging.stop()
+    structured_logging.configure('INFO', sink)
+    structured_logging.request_logger.disabled = False
+
+
+def drain():
+    """Let the listener write the backlog so it does not compete with the next measurement"""
+    while structured_logging.status()["queued"]:
+        time.sleep(0.01)
+
+
+def icon_loop(icons, structured):
+    structured_logging.begin_request()
+    for i in range(icons):
+        if structured:
+            structured_logging.count('icons.inserted')
+        else:
+            logger.info(f"Added icon metadata to MongoDB with ID: {i:024x}, Category: Compute")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=20000)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--icons", type=int, default=2000)
+    parser.add_argument("--sink-latency", type=float, default=0.0, help="Seconds per log write")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.environ['DATA_DIR'] = os.path.join(temp_dir, "data")
+        os.environ['MONGO_URI'] = "mongodb://127.0.0.1:1/"
+        os.environ['TRACE_SAMPLE_RATE'] = '0'
+        os.environ['TRACE_FILE'] = ''
+        import upload
+        upload.init_mongodb = lambda: None
+        icons_dir = os.path.join(temp_dir, "cloudicons")
+        upload.LOCAL_STORAGE_DIR = icons_dir
+        upload.icon_catalog.local_root = icons_dir
+        upload.icon_snapshot.local_root = icons_dir
+        write_icon_tree(icons_dir, args.icons, svg_bytes=200)
+        upload.icon_snapshot.rebuild()
+        client = upload.create_app().test_client()
+        upload.startup.wait('gcs', 30)
+
+        log_path = os.path.join(temp_dir, "server.log")
+        sink = SlowFile(log_path, args.sink_latency)
+        for mode in ("sync", "queue"):
+            if mode == "sync":
+                use_sync_handler(sink)
+            else:
+                use_queue_handler(sink)
+            structured = mode == "queue"
+            results[f"record_{mode}_us"] = per_call_us(lambda: logger.info("Getting icons for provider: azure"),
+                                                       args.calls)
+            drain()
+            results[f"icon_loop_{mode}_ms"] = per_call_us(lambda: icon_loop(args.icons, structured), 5) / 1000
+
+            def health():
+                if not structured:
+                    logger.info(f"Health check endpoint called at {time.time()}")
+                client.get('/api/health').close()
+            results[f"health_{mode}_us"] = per_call_us(health, args.requests)
+            drain()
+
+            def icons():
+                if not structured:
+                    logger.info("Getting icons for provider: azure")
+                client.get('/api/icons').close()
+            results[f"list_{mode}_us"] = per_call_us(icons, max(1, args.requests // 20))
+            drain()
+        structured_logging.stop()
+        sink.flush()
+        results["log_bytes"] = os.path.getsize(log_path)
+        upload.shutdown()
+
+    for key, value in results.items():
+        print(f"{key:>22}: {value:,.2f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"calls": args.calls, "requests": args.requests, "icons": args.icons,
+                       "sinkLatency": args.sink_latency, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
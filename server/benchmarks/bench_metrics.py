@@ -0,0 +1,81 @@
+#!/usr/bin/env python3
+"""
+Benchmark the cost of the metrics recorded for /api/metrics.
+
+Times one histogram observation, a timed() block and a cache counter
+increment, rendering a scrape with --series label combinations, and a
+GET /api/health through the Flask test client with recording on and off.
+
+Usage:
+    python benchmarks/bench_metrics.py --calls 200000 --series 200
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics
+
+
+def per_call_ns(function, calls):
+    started = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - started) / calls * 1e9
+
+
+def empty_block():
+    with metrics.timed('filesystem', 'bench'):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200000)
+    parser.add_argument("--series", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    results["observeNs"] = per_call_ns(lambda: metrics.observe_request('GET', '/api/icons', 200, 0.004), args.calls)
+    results["timedBlockNs"] = per_call_ns(empty_block, args.calls)
+    results["cacheCountNs"] = per_call_ns(lambda: metrics.cache_result('icon_snapshot', True), args.calls)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for i in range(args.series):
+            metrics.observe_request('GET', f'/api/route-{i}', 200, 0.01)
+        metrics.registry.share(os.path.join(temp_dir, "metrics"), interval=0)
+        started = time.perf_counter()
+        text = metrics.registry.render()
+        results["renderMs"] = (time.perf_counter() - started) * 1000
+        results["renderBytes"] = len(text)
+
+        os.environ.setdefault('DATA_DIR', os.path.join(temp_dir, "data"))
+        os.environ.setdefault('MONGO_URI', "mongodb://127.0.0.1:1/")
+        import upload
+        upload.app.logger.disabled = True
+        client = upload.app.test_client()
+        for enabled in (False, True):
+            metrics.ENABLED = enabled
+            client.get('/api/health')
+            started = time.perf_counter()
+            for _ in range(args.requests):
+                client.get('/api/health')
+            key = "requestUs" if enabled else "requestUnrecordedUs"
+            results[key] = (time.perf_counter() - started) / args.requests * 1e6
+
+    for key, value in results.items():
+        print(f"{key:>22}: {value:,.2f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"calls": args.calls, "series": args.series, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,181 @@
+#!/usr/bin/env python3
+"""
+Load benchmark: Werkzeug development server vs gunicorn (gthread) vs the
+ASGI app (async_api.py) on gunicorn with uvicorn workers.
+
+Starts each server on a free port with local state in a temp directory
+(diagrams in the JSON fallback, MongoDB unreachable so its circuit breaker
+sends requests to local storage, GCS disabled), warms it up, then drives it
+with --concurrency keep-alive client threads for --duration seconds per
+endpoint and reports throughput and latency percentiles. With --mongo-uri
+the servers use that MongoDB instead (seeded with the same diagrams), which
+is where the async handlers differ most.
+
+Usage:
+    python benchmarks/bench_serving.py --concurrency 16 --duration 10 --workers 4
+    python benchmarks/bench_serving.py --servers gunicorn,asgi --concurrency 64 --mongo-uri mongodb://localhost:27017/
+"""
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import tempfile
+import threading
+import subprocess
+import http.client
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+MONGO_DB_NAME = "bench_serving"
+
+ENDPOINTS = ["/api/health", "/api/diagrams?summary=true", "/api/diagrams/diagram-0", "/api/icons?provider=azure"]
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def seed_diagrams(data_dir, count, mongo_uri=None):
+    os.makedirs(data_dir, exist_ok=True)
+    diagrams = [{
+        "diagramId": f"diagram-{i}",
+        "name": f"Diagram {i}",
+        "createdAt": time.time(),
+        "updatedAt": time.time(),
+        "nodes": [{"id": f"n{j}", "type": "azure-vm", "position": {"x": j, "y": j}} for j in range(20)],
+        "edges": [],
+    } for i in range(count)]
+    with open(os.path.join(data_dir, "diagrams.json"), 'w') as f:
+        json.dump({"diagrams": diagrams}, f)
+    if mongo_uri:
+        from pymongo import MongoClient
+        collection = MongoClient(mongo_uri)[MONGO_DB_NAME].diagrams
+        collection.drop()
+        collection.insert_many(diagrams)
+
+
+def start_server(kind, port, data_dir, workers, threads, mongo_uri=None):
+    env = dict(os.environ,
+               PORT=str(port),
+               DATA_DIR=data_dir,
+               MONGO_URI=mongo_uri or "mongodb://127.0.0.1:1/",
+               MONGO_DB_NAME=MONGO_DB_NAME,
+               MONGO_SERVER_SELECTION_TIMEOUT_MS="100" if mongo_uri is None else "5000",
+               MONGO_BREAKER_RESET_SECONDS="3600",
+               FLASK_DEBUG="true")
+    env.pop("GCS_FAKE_DIR", None)
+    if kind == "dev":
+        command = [sys.executable, "upload.py"]
+    else:
+        env.update(WEB_CONCURRENCY=str(workers), GUNICORN_THREADS=str(threads))
+        command = [sys.executable, "-m", "gunicorn", "-c", "gunicorn.conf.py", "wsgi:app"]
+        if kind == "asgi":
+            command[-1:] = ["-k", "uvicorn.workers.UvicornWorker", "asgi:app"]
+    process = subprocess.Popen(command, cwd=SERVER_DIR, env=env,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            connection = http.client.HTTPConnection("127.0.0.1", port, timeout=2)
+            connection.request("GET", "/api/ready")
+            if connection.getresponse().status == 200:
+                return process
+        except OSError:
+            pass
+        time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError(f"{kind} server did not become ready")
+
+
+def drive(port, path, concurrency, duration):
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.perf_counter() + duration
+
+    def client():
+        connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+        local = []
+        while time.perf_counter() < stop_at:
+            started = time.perf_counter()
+            try:
+                connection.request("GET", path)
+                response = connection.getresponse()
+                response.read()
+                if response.status != 200:
+                    errors[0] += 1
+            except (OSError, http.client.HTTPException):
+                errors[0] += 1
+                connection.close()
+                connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+                continue
+            local.append(time.perf_counter() - started)
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    latencies.sort()
+
+    def percentile(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2) if latencies else None
+
+    return {
+        "requests": len(latencies),
+        "errors": errors[0],
+        "requestsPerSecond": round(len(latencies) / duration, 1),
+        "p50Ms": percentile(0.5),
+        "p99Ms": percentile(0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--diagrams", type=int, default=200)
+    parser.add_argument("--servers", default="dev,gunicorn,asgi", help="Comma-separated: dev, gunicorn, asgi")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help="Comma-separated paths to drive")
+    parser.add_argument("--mongo-uri", help="MongoDB to serve diagrams from (default: unreachable, JSON fallback)")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    endpoints = args.endpoints.split(",")
+    results = []
+    for kind in args.servers.split(","):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            data_dir = os.path.join(temp_dir, "data")
+            seed_diagrams(data_dir, args.diagrams, args.mongo_uri)
+            port = free_port()
+            process = start_server(kind, port, data_dir, args.workers, args.threads, args.mongo_uri)
+            try:
+                # Warm up (and let every worker trip its MongoDB breaker) before measuring
+                for path in endpoints:
+                    drive(port, path, args.concurrency, 1)
+                for path in endpoints:
+                    result = {"server": kind, "endpoint": path, **drive(port, path, args.concurrency, args.duration)}
+                    print(f"[{kind:>8}] {path:<28} {result['requestsPerSecond']:>8} req/s  "
+                          f"p50 {result['p50Ms']} ms  p99 {result['p99Ms']} ms  errors {result['errors']}")
+                    results.append(result)
+            finally:
+                process.terminate()
+                process.wait(30)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"concurrency": args.concurrency, "workers": args.workers, "threads": args.threads,
+                       "mongodb": bool(args.mongo_uri), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+Benchmark request coalescing under a burst of identical requests.
+
+    snapshot     --threads concurrent IconSnapshot.ensure() calls with no
+                 snapshot on disk: scans of local storage and wall time
+    diagram      --threads concurrent GET /api/diagrams/<id> (JSON storage,
+                 --diagrams diagrams in diagrams.json): reads of the file
+
+Each is run with coalescing and with the single-flight groups bypassed.
+
+Usage:
+    python benchmarks/bench_singleflight.py --threads 16 --icons 3000 --diagrams 2000
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import threading
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCH_DIR))
+sys.path.insert(0, BENCH_DIR)
+
+import singleflight
+from synthetic import write_icon_tree, make_diagram
+
+
+def burst(threads, function):
+    """Seconds for threads concurrent calls of function"""
+    barrier = threading.Barrier(threads)
+
+    def run():
+        barrier.wait()
+        function()
+    workers = [threading.Thread(target=run) for _ in range(threads)]
+    started = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    return time.perf_counter() - started
+
+
+def bypass(group):
+    """Make the group call its function directly, as before coalescing"""
+    group.do = lambda key, function, *args, **kwargs: function(*args, **kwargs)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--icons", type=int, default=3000)
+    parser.add_argument("--diagrams", type=int, default=2000)
+    parser.add_argument("--nodes", type=int, default=20, help="Nodes per diagram")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    results = {}
+    with tempfile.TemporaryDirectory() as temp_dir:
+        os.environ['DATA_DIR'] = os.path.join(temp_dir, "data")
+        os.environ['MONGO_URI'] = "mongodb://127.0.0.1:1/"
+        os.environ['TRACE_SAMPLE_RATE'] = '0'
+        os.environ['TRACE_FILE'] = ''
+        import upload
+        import catalog_snapshot
+        upload.init_mongodb = lambda: None
+        icons_dir = os.path.join(temp_dir, "cloudicons")
+        upload.LOCAL_STORAGE_DIR = icons_dir
+        upload.icon_catalog.local_root = icons_dir
+        upload.icon_snapshot.local_root = icons_dir
+        write_icon_tree(icons_dir, args.icons, svg_bytes=200)
+        app = upload.create_app()
+        upload.startup.wait('gcs', 30)
+        diagrams = [make_diagram(args.nodes, seed=i) for i in range(args.diagrams)]
+        upload.save_diagrams({"diagrams": diagrams})
+        diagram_id = diagrams[0]["diagramId"]
+
+        scans = [0]
+        rebuild = upload.icon_snapshot.rebuild
+
+        def counted_rebuild(*a, **kw):
+            scans[0] += 1
+            return rebuild(*a, **kw)
+        upload.icon_snapshot.rebuild = counted_rebuild
+
+        reads = [0]
+        load_diagrams = upload.load_diagrams
+
+        def counted_load():
+            reads[0] += 1
+            return load_diagrams()
+        upload.load_diagrams = counted_load
+
+        def get_diagram():
+            app.test_client().get(f'/api/diagrams/{diagram_id}').close()
+
+        for mode in ("coalesced", "direct"):
+            if mode == "direct":
+                bypass(catalog_snapshot.snapshot_builds)
+                bypass(upload.diagram_fetches)
+            upload.icon_snapshot.rebuild(records=[])
+            scans[0] = 0
+            # ensure(0) treats any existing snapshot as outdated
+            results[f"snapshot_{mode}_s"] = burst(args.threads, lambda: upload.icon_snapshot.ensure(0))
+            results[f"snapshot_{mode}_scans"] = scans[0]
+            reads[0] = 0
+            results[f"diagram_{mode}_s"] = burst(args.threads, get_diagram)
+            results[f"diagram_{mode}_reads"] = reads[0]
+        upload.shutdown()
+
+    for key, value in results.items():
+        print(f"{key:>24}: {value:,.3f}")
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"threads": args.threads, "icons": args.icons, "diagrams": args.diagrams,
+                       "coalescing": singleflight.stats(), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
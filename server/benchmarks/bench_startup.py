@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Benchmark server cold start: time to first request and time to ready.
+
+Each run starts a fresh Python process that imports upload.py, calls
+create_app() and serves GET /api/health through the Flask test client, then
+polls /api/ready until every backend has initialized. GCS is the local fake
+(fake_gcs.py) with --gcs-latency seconds per call; MongoDB points at an
+address that refuses connections, so its pool never connects. Time to ready
+approximates the old serial startup, which did the same backend work before
+serving.
+
+Usage:
+    python benchmarks/bench_startup.py --runs 5 --gcs-latency 0.5
+"""
+
+import os
+import sys
+import json
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+SERVER_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+CHILD = '''
+import sys, time, json
+started = time.perf_counter()
+sys.path.insert(0, {server_dir!r})
+import upload
+imported = time.perf_counter()
+app = upload.create_app()
+client = app.test_client()
+client.get('/api/health')
+first_request = time.perf_counter()
+while client.get('/api/ready').status_code != 200:
+    time.sleep(0.005)
+ready = time.perf_counter()
+print(json.dumps({{
+    "importSeconds": imported - started,
+    "firstRequestSeconds": first_request - started,
+    "readySeconds": ready - started,
+    "backends": upload.startup.status()["backends"],
+}}))
+'''
+
+
+def run_once(gcs_latency):
+    with tempfile.TemporaryDirectory() as temp_dir:
+        env = dict(os.environ,
+                   GCS_FAKE_DIR=os.path.join(temp_dir, "gcs"),
+                   DATA_DIR=os.path.join(temp_dir, "data"),
+                   GCS_FAKE_LATENCY=str(gcs_latency),
+                   MONGO_URI="mongodb://127.0.0.1:1/",
+                   MONGO_SERVER_SELECTION_TIMEOUT_MS="1000")
+        output = subprocess.run([sys.executable, "-c", CHILD.format(server_dir=SERVER_DIR)],
+                                env=env, cwd=temp_dir, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--gcs-latency", type=float, default=0.5, help="Seconds per fake GCS call")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    runs = [run_once(args.gcs_latency) for _ in range(args.runs)]
+    summary = {}
+    for key in ("importSeconds", "firstRequestSeconds", "readySeconds"):
+        values = [run[key] for run in runs]
+        summary[key] = {"median": round(statistics.median(values), 4), "max": round(max(values), 4)}
+        print(f"{key:>20}: median {summary[key]['median'] * 1000:.0f} ms, max {summary[key]['max'] * 1000:.0f} ms")
+    print(f"{'backends':>20}: {runs[-1]['backends']}")
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"gcsLatency": args.gcs_latency, "summary": summary, "runs": runs}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
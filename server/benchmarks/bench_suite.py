@@ -0,0 +1,381 @@
+#!/usr/bin/env python3
+"""
+Repeatable end-to-end benchmarks of the API against local stand-ins.
+
+Runs the Flask (or ASGI) app in-process on a fresh temporary data directory,
+with the fake GCS bucket from fake_gcs.py (--gcs-latency seconds per call)
+and mongomock, no MongoDB, or a local mongod (--mongo mongodb://...). Data
+comes from synthetic.py, so the same arguments give the same workload:
+
+    upload      POST /api/upload/icons with one ZIP of --icons icons
+    replication time until the fake bucket holds every uploaded icon
+    list        GET /api/icons, --repeat times
+    search      find icons by name in the listing (there is no server-side
+                search) and fetch the first matches' files
+    diagrams    create, get, update and delete --diagrams diagrams of --nodes
+                nodes, and list them (summary and full)
+    delete_all  DELETE /api/icons/all?wait=true
+
+Timings are taken around test-client calls, so they include the server's
+work but no network. Results (p50/p95/max per operation and throughput) are
+printed and written with --json; --baseline compares the run with an earlier
+results file and exits with status 1 if an operation's p50 regressed by more
+than --tolerance.
+
+Usage:
+    python benchmarks/bench_suite.py --icons 10000 --diagrams 200 --json results.json
+    python benchmarks/bench_suite.py --app asgi --baseline results.json
+    python benchmarks/bench_suite.py --compare old.json new.json
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import random
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+SERVER_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, SERVER_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+from synthetic import WORDS, icon_zip_bytes, make_diagram, write_icon_tree
+
+BENCHMARKS = ["upload", "list", "search", "diagrams", "delete_all"]
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+class Results:
+    def __init__(self):
+        self.results = {}
+
+    def add(self, name, samples_ms, items=None):
+        """Record the latencies of one operation (items: units of work, for throughput)"""
+        total = sum(samples_ms)
+        result = {
+            "samples": len(samples_ms),
+            "totalMs": round(total, 3),
+            "p50Ms": round(percentile(samples_ms, 50), 3),
+            "p95Ms": round(percentile(samples_ms, 95), 3),
+            "maxMs": round(max(samples_ms), 3),
+        }
+        items = items if items is not None else len(samples_ms)
+        if total > 0:
+            result["perSecond"] = round(items / (total / 1000), 1)
+        self.results[name] = result
+        print(f"{name:>22}: p50 {result['p50Ms']:>10,.2f} ms  p95 {result['p95Ms']:>10,.2f} ms  "
+              f"max {result['maxMs']:>10,.2f} ms  {result.get('perSecond', 0):>10,.1f}/s  ({len(samples_ms)} samples)")
+
+    def timed(self, name, fn, items=None):
+        """Run fn once and record its duration"""
+        started = time.perf_counter()
+        result = fn()
+        self.add(name, [(time.perf_counter() - started) * 1000], items)
+        return result
+
+
+class Client:
+    """The same calls on the Flask test client and Starlette's TestClient"""
+
+    def __init__(self, app_kind):
+        import upload
+        self.kind = app_kind
+        if app_kind == 'asgi':
+            from starlette.testclient import TestClient
+            import async_api
+            self._client = TestClient(async_api.create_asgi_app())
+            self._client.__enter__()
+        else:
+            self._client = upload.create_app().test_client()
+
+    def request(self, method, path, **kwargs):
+        """(status, parsed JSON or body bytes)"""
+        response = self._client.open(path, method=method, **kwargs) if self.kind == 'flask' \
+            else self._client.request(method, path, **kwargs)
+        body = response.get_data() if self.kind == 'flask' else response.content
+        if self.kind == 'flask':
+            response.close()
+        content_type = response.headers.get('Content-Type', '')
+        return response.status_code, json.loads(body) if content_type.startswith('application/json') else body
+
+    def upload_zip(self, data, provider='azure'):
+        if self.kind == 'flask':
+            return self.request('POST', '/api/upload/icons',
+                                data={"provider": provider, "iconsZip": (io.BytesIO(data), "icons.zip")})
+        return self.request('POST', '/api/upload/icons', data={"provider": provider},
+                            files={"iconsZip": ("icons.zip", data, "application/zip")})
+
+    def send_json(self, method, path, payload):
+        return self.request(method, path, json=payload)
+
+    def close(self):
+        if self.kind == 'asgi':
+            self._client.__exit__(None, None, None)
+
+
+def check(status, body, expected=200):
+    if status != expected:
+        raise RuntimeError(f"Unexpected status {status} (expected {expected}): {str(body)[:300]}")
+    return body
+
+
+def prepare_environment(temp_dir, args):
+    """Point the server at temporary local state; must run before upload.py is imported"""
+    os.environ['DATA_DIR'] = os.path.join(temp_dir, "data")
+    os.environ['GCS_FAKE_DIR'] = os.path.join(temp_dir, "gcs")
+    os.environ['GCS_FAKE_LATENCY'] = str(args.gcs_latency)
+    os.environ['TRACE_FILE'] = ''
+    os.environ.setdefault('TRACE_SAMPLE_RATE', '0')
+    os.environ.setdefault('FLASK_DEBUG', 'false')
+    if args.mongo.startswith('mongodb'):
+        os.environ['MONGO_URI'] = args.mongo
+        os.environ['MONGO_DB_NAME'] = args.mongo_db
+        from pymongo import MongoClient
+        with MongoClient(args.mongo, serverSelectionTimeoutMS=5000) as client:
+            client.drop_database(args.mongo_db)
+    else:
+        os.environ['MONGO_URI'] = "mongodb://127.0.0.1:1/"
+
+
+def start_server(temp_dir, args):
+    """Import the server with local storage under temp_dir and the chosen MongoDB stand-in"""
+    import upload
+    logging.getLogger().setLevel(args.log_level)
+
+    icons_dir = os.path.join(temp_dir, "cloudicons")
+    os.makedirs(icons_dir)
+    upload.LOCAL_STORAGE_DIR = icons_dir
+    upload.icon_catalog.local_root = icons_dir
+    upload.icon_snapshot.local_root = icons_dir
+
+    if args.mongo == 'mongomock':
+        try:
+            import mongomock
+        except ImportError:
+            sys.exit("--mongo mongomock requires mongomock (pip install mongomock)")
+        mongo_client = mongomock.MongoClient()
+        db = mongo_client.db
+        upload.init_mongodb = lambda: "mongomock"
+        upload.get_db = lambda: db
+        upload.mongo_db = db
+        upload.mongodb_initialized = True
+        if args.app == 'asgi':
+            try:
+                import mongomock_motor
+            except ImportError:
+                sys.exit("--app asgi with --mongo mongomock requires mongomock-motor")
+            import async_api
+            # Both clients see the same data, as they would with a real server
+            async_client = mongomock_motor.AsyncMongoMockClient(mock_mongo_client=mongo_client)
+            async_api.get_async_db = lambda: async_client.db
+    elif args.mongo == 'none':
+        upload.init_mongodb = lambda: None
+
+    client = Client(args.app)
+    for backend in ('mongodb', 'gcs'):
+        upload.startup.wait(backend, 30)
+    return upload, client
+
+
+def wait_for_replication(upload, timeout=600):
+    queue = upload.replication_queue
+    if queue is None:
+        return
+    deadline = time.monotonic() + timeout
+    while queue.status()["depth"] > 0:
+        if time.monotonic() > deadline:
+            raise RuntimeError("Replication did not finish")
+        time.sleep(0.01)
+
+
+# Benchmarks
+
+def bench_upload(upload, client, results, args):
+    data = icon_zip_bytes(args.icons, args.categories, args.seed)
+    body = check(*results.timed("upload", lambda: client.upload_zip(data), items=args.icons))
+    if len(body["uploadedFiles"]) != args.icons:
+        raise RuntimeError(f"Uploaded {len(body['uploadedFiles'])} of {args.icons} icons")
+    if upload.replication_queue is not None:
+        results.timed("replication", lambda: wait_for_replication(upload), items=args.icons)
+
+
+def seed_icons(upload, args):
+    """Put icons in local storage without the upload endpoint (when upload is not benchmarked)"""
+    write_icon_tree(upload.LOCAL_STORAGE_DIR, args.icons, categories=args.categories, seed=args.seed)
+    upload.icon_snapshot.rebuild()
+
+
+def bench_list(upload, client, results, args):
+    samples = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        body = check(*client.request('GET', '/api/icons?provider=azure'))
+        samples.append((time.perf_counter() - started) * 1000)
+    if body["totalCount"] != args.icons:
+        raise RuntimeError(f"Listed {body['totalCount']} of {args.icons} icons")
+    results.add("list", samples)
+
+
+def bench_search(upload, client, results, args):
+    rng = random.Random(args.seed)
+    samples = []
+    for _ in range(args.repeat):
+        term = rng.choice(WORDS).lower()
+        started = time.perf_counter()
+        icons = check(*client.request('GET', '/api/icons?provider=azure'))["icons"]
+        matches = [icon for icon in icons if term in icon["displayName"].lower()]
+        for icon in matches[:5]:
+            check(*client.request('GET', icon["path"]))
+        samples.append((time.perf_counter() - started) * 1000)
+    results.add("search", samples)
+
+
+def bench_diagrams(upload, client, results, args):
+    diagrams = [make_diagram(args.nodes, args.seed + i, diagram_id=f"bench-{i}") for i in range(args.diagrams)]
+
+    def each(name, fn, expected=200):
+        samples = []
+        for diagram in diagrams:
+            started = time.perf_counter()
+            check(*fn(diagram), expected=expected)
+            samples.append((time.perf_counter() - started) * 1000)
+        results.add(name, samples)
+
+    each("diagram_create", lambda d: client.send_json('POST', '/api/diagrams', d), expected=201)
+    each("diagram_get", lambda d: client.request('GET', f"/api/diagrams/{d['diagramId']}"))
+
+    def update(diagram):
+        nodes = [dict(node, position={"x": node["position"]["x"] + 10, "y": node["position"]["y"]})
+                 for node in diagram["nodes"]]
+        return client.send_json('PUT', f"/api/diagrams/{diagram['diagramId']}", {"nodes": nodes})
+    each("diagram_update", update)
+
+    samples = []
+    for _ in range(args.repeat):
+        started = time.perf_counter()
+        body = check(*client.request('GET', '/api/diagrams?summary=true'))
+        samples.append((time.perf_counter() - started) * 1000)
+    if len(body["diagrams"]) != args.diagrams:
+        raise RuntimeError(f"Listed {len(body['diagrams'])} of {args.diagrams} diagrams")
+    results.add("diagram_list_summary", samples)
+    check(*results.timed("diagram_list_full", lambda: client.request('GET', '/api/diagrams'), items=args.diagrams))
+    each("diagram_delete", lambda d: client.request('DELETE', f"/api/diagrams/{d['diagramId']}"))
+
+
+def bench_delete_all(upload, client, results, args):
+    body = check(*results.timed("delete_all", lambda: client.request('DELETE', '/api/icons/all?wait=true'),
+                                items=args.icons))
+    if body["errorCount"]:
+        raise RuntimeError(f"delete-all reported {body['errorCount']} errors")
+
+
+# Reporting
+
+def compare(baseline, current, tolerance):
+    """Print p50 changes against a baseline; return the operations that regressed"""
+    regressions = []
+    print(f"\n{'operation':>22}  {'baseline p50':>14}  {'current p50':>14}  change")
+    for name, result in current["results"].items():
+        before = baseline["results"].get(name)
+        if before is None or not before["p50Ms"]:
+            continue
+        change = result["p50Ms"] / before["p50Ms"] - 1
+        flag = "  REGRESSION" if change > tolerance else ""
+        print(f"{name:>22}  {before['p50Ms']:>14,.2f}  {result['p50Ms']:>14,.2f}  {change:+7.1%}{flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], cwd=SERVER_DIR, capture_output=True,
+                              text=True, timeout=10).stdout.strip() or None
+    except Exception:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--app", choices=["flask", "asgi"], default="flask")
+    parser.add_argument("--mongo", default="mongomock",
+                        help="mongomock, none (local JSON storage) or the URI of a local mongod")
+    parser.add_argument("--mongo-db", default="bench_suite", help="Database to use (and drop) with a mongod URI")
+    parser.add_argument("--gcs-latency", type=float, default=0.0, help="Seconds per fake GCS call")
+    parser.add_argument("--icons", type=int, default=2000)
+    parser.add_argument("--categories", type=int, default=40)
+    parser.add_argument("--diagrams", type=int, default=100)
+    parser.add_argument("--nodes", type=int, default=500, help="Nodes per diagram")
+    parser.add_argument("--repeat", type=int, default=20, help="Samples of list, search and diagram listing")
+    parser.add_argument("--only", default=",".join(BENCHMARKS), help="Comma-separated: " + ", ".join(BENCHMARKS))
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--log-level", default="WARNING")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    parser.add_argument("--baseline", help="Compare with this results file")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed p50 slowdown before failing")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="Only compare two results files")
+    args = parser.parse_args()
+
+    if args.compare:
+        with open(args.compare[0]) as f:
+            baseline = json.load(f)
+        with open(args.compare[1]) as f:
+            current = json.load(f)
+        sys.exit(1 if compare(baseline, current, args.tolerance) else 0)
+
+    selected = [name.strip() for name in args.only.split(',') if name.strip()]
+    unknown = set(selected) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f"unknown benchmarks: {', '.join(sorted(unknown))}")
+
+    started_at = time.time()
+    results = Results()
+    with tempfile.TemporaryDirectory() as temp_dir:
+        prepare_environment(temp_dir, args)
+        upload, client = start_server(temp_dir, args)
+        try:
+            if "upload" in selected:
+                bench_upload(upload, client, results, args)
+            elif {"list", "search", "delete_all"} & set(selected):
+                seed_icons(upload, args)
+            for name in BENCHMARKS[1:]:
+                if name in selected:
+                    globals()[f"bench_{name}"](upload, client, results, args)
+        finally:
+            client.close()
+            upload.shutdown()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "startedAt": started_at,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "args": {k: v for k, v in vars(args).items() if k not in ("json", "baseline", "compare")},
+        },
+        "results": results.results,
+    }
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if compare(baseline, report, args.tolerance):
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
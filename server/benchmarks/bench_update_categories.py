@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark the icon category migration (update_mongodb_categories.py).
+
+Without --mongo-uri, measures classification throughput alone, in-process
+and with --workers processes, on --count synthetic icon documents. With
+--mongo-uri, seeds --count icon documents into a scratch database and times
+a dry run and a full migration against that server.
+
+Usage:
+    python benchmarks/bench_update_categories.py --count 1000000 --workers 4
+    python benchmarks/bench_update_categories.py --count 1000000 --workers 4 --mongo-uri mongodb://localhost:27017
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+import update_mongodb_categories as migration
+
+SERVICES = ["Virtual-Machine", "Blob-Storage", "Load-Balancer", "Cosmos-DB", "Key-Vault",
+            "Widget", "Event-Hub", "Service-Bus", "Monitor", "Static-Web-App"]
+
+
+def make_docs(count):
+    for i in range(count):
+        yield {
+            "_id": i,
+            "provider": "azure",
+            "filename": f"{i:07d}-icon-service-{SERVICES[i % len(SERVICES)]}.svg",
+            "category": "Unsorted" if i % 2 else "General",
+            "displayName": "",
+            "updatedAt": time.time(),
+        }
+
+
+def bench_classification(count, workers):
+    results = []
+    for label, worker_count in (("inline", 0), (f"{workers} workers", workers)):
+        start = time.perf_counter()
+        changed = sum(len(changes) for _, changes in migration.classified_batches(
+            migration.iter_batches(make_docs(count), migration.BATCH_SIZE), worker_count))
+        seconds = time.perf_counter() - start
+        print(f"[classify {label}] {count} icons in {seconds:.2f}s ({count / seconds:,.0f}/s), {changed} changes")
+        results.append({"phase": f"classify {label}", "seconds": round(seconds, 3),
+                        "perSecond": round(count / seconds)})
+    return results
+
+
+def bench_migration(uri, count, workers):
+    from pymongo import MongoClient
+    client = MongoClient(uri)
+    db = client["category_migration_bench"]
+    db.icons.drop()
+    batch = []
+    for doc in make_docs(count):
+        batch.append(doc)
+        if len(batch) >= 10000:
+            db.icons.insert_many(batch, ordered=False)
+            batch = []
+    if batch:
+        db.icons.insert_many(batch, ordered=False)
+
+    results = []
+    for label, dry_run in (("dry run", True), ("migration", False), ("re-run (no changes)", False)):
+        report = migration.update_mongodb_icons(db, dry_run=dry_run, workers=workers)
+        print(f"[{label}] {report['read']} icons in {report['seconds']}s "
+              f"({report['documentsPerSecond']:,}/s), {report['modified']} modified")
+        results.append({"phase": label, **report})
+    client.drop_database("category_migration_bench")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--count", type=int, default=200000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--mongo-uri", help="Run the full migration against this MongoDB server")
+    parser.add_argument("--json", help="Write results to this JSON file")
+    args = parser.parse_args()
+
+    if args.mongo_uri:
+        results = bench_migration(args.mongo_uri, args.count, args.workers)
+    else:
+        results = bench_classification(args.count, args.workers)
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({"count": args.count, "workers": args.workers, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+#!/usr/bin/env python3
+"""
+Synthetic icon packs and diagrams for benchmarks.
+
+Icons are named like the Azure icon set (00042-icon-service-Virtual-Networks.svg)
+and spread over category folders; diagrams look like the React Flow documents
+the frontend saves, with nodes pointing at generated icons. Everything is
+derived from --seed, so the same arguments always produce the same data.
+
+Usage:
+    python benchmarks/synthetic.py icons --count 100000 --categories 60 --out icons.zip
+    python benchmarks/synthetic.py icons --count 5000 --out public/cloudicons --tree
+    python benchmarks/synthetic.py diagrams --count 1000 --nodes 2000 --out diagrams.ndjson
+"""
+
+import os
+import io
+import json
+import random
+import zipfile
+import argparse
+
+WORDS = [
+    "Virtual", "Machine", "Network", "Storage", "Account", "App", "Service", "Function", "Gateway",
+    "Load", "Balancer", "Key", "Vault", "SQL", "Database", "Cosmos", "Monitor", "Log", "Analytics",
+    "Front", "Door", "DNS", "Zone", "Firewall", "Container", "Registry", "Kubernetes", "Event", "Hub",
+    "Grid", "Bus", "Queue", "Cache", "Redis", "Search", "Cognitive", "Bot", "Data", "Factory", "Lake",
+    "Synapse", "Backup", "Recovery", "Policy", "Identity", "Managed", "Disk", "Snapshot", "Image",
+    "Private", "Endpoint", "Link", "Peering", "Route", "Table", "Security", "Group", "Bastion", "VPN",
+]
+
+CATEGORY_WORDS = [
+    "Compute", "Networking", "Storage", "Databases", "Security", "Identity", "Analytics", "AI",
+    "Integration", "Management", "Monitor", "Containers", "Web", "DevOps", "IoT", "Migration",
+    "Mixed Reality", "Blockchain", "Hybrid", "General",
+]
+
+NODE_TYPES = ["azureResource", "group", "note", "azureResource", "azureResource"]
+
+
+def category_names(count):
+    """count distinct category folder names"""
+    names = []
+    for i in range(count):
+        base = CATEGORY_WORDS[i % len(CATEGORY_WORDS)]
+        names.append(base if i < len(CATEGORY_WORDS) else f"{base} {i // len(CATEGORY_WORDS) + 1}")
+    return names
+
+
+def icon_svg(rng, size):
+    """An SVG document of about size bytes"""
+    parts = ['<svg xmlns="http://www.w3.org/2000/svg" viewBox="0 0 18 18">']
+    length = len(parts[0]) + 6
+    while length < size:
+        path = (f'<path fill="#{rng.randrange(0x1000000):06x}" d="M{rng.uniform(0, 18):.2f} '
+                f'{rng.uniform(0, 18):.2f}L{rng.uniform(0, 18):.2f} {rng.uniform(0, 18):.2f}Z"/>')
+        parts.append(path)
+        length += len(path)
+    parts.append('</svg>')
+    return ''.join(parts).encode('utf-8')
+
+
+def iter_icons(count, categories=40, seed=0, svg_bytes=1500):
+    """Yield (category, filename, svg) for count icons"""
+    rng = random.Random(seed)
+    names = category_names(categories)
+    for i in range(count):
+        words = '-'.join(rng.sample(WORDS, rng.randint(1, 3)))
+        yield names[i % len(names)], f"{i:05d}-icon-service-{words}.svg", icon_svg(rng, svg_bytes)
+
+
+def write_icon_zip(target, count, categories=40, seed=0, svg_bytes=1500):
+    """Write an icon pack ZIP (Category/filename.svg) to a path or file object"""
+    with zipfile.ZipFile(target, 'w', zipfile.ZIP_DEFLATED) as zip_file:
+        for category, filename, svg in iter_icons(count, categories, seed, svg_bytes):
+            zip_file.writestr(f"{category}/{filename}", svg)
+
+
+def icon_zip_bytes(count, categories=40, seed=0, svg_bytes=1500):
+    buffer = io.BytesIO()
+    write_icon_zip(buffer, count, categories, seed, svg_bytes)
+    return buffer.getvalue()
+
+
+def write_icon_tree(root, count, provider="azure", categories=40, seed=0, svg_bytes=1500):
+    """Write icons as root/<provider>/<category>/<filename>, the local storage layout"""
+    for category, filename, svg in iter_icons(count, categories, seed, svg_bytes):
+        directory = os.path.join(root, provider, category)
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, filename), 'wb') as f:
+            f.write(svg)
+
+
+def make_diagram(nodes, seed=0, diagram_id=None, icons=1000, categories=40):
+    """A React Flow style diagram with nodes grouped on a grid and about 1.3 edges per node"""
+    rng = random.Random(seed)
+    names = category_names(categories)
+    node_list = []
+    for i in range(nodes):
+        node_type = rng.choice(NODE_TYPES)
+        icon = rng.randrange(icons)
+        node = {
+            "id": f"node-{i}",
+            "type": node_type,
+            "position": {"x": (i % 50) * 140 + rng.randint(-10, 10), "y": (i // 50) * 140 + rng.randint(-10, 10)},
+            "data": {
+                "label": ' '.join(rng.sample(WORDS, 2)) + f" {i}",
+                "icon": f"/cloudicons/azure/{names[icon % len(names)]}/{icon:05d}-icon-service.svg",
+            },
+        }
+        if node_type == "group":
+            node["style"] = {"width": 400, "height": 300}
+        elif node_type == "note":
+            node["data"]["text"] = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(5, 30)))
+        node_list.append(node)
+    edges = []
+    for i in range(1, nodes):
+        for _ in range(1 if rng.random() < 0.7 else 2):
+            source = rng.randrange(i)
+            edges.append({"id": f"edge-{len(edges)}", "source": f"node-{source}", "target": f"node-{i}",
+                          "type": "smoothstep", "animated": rng.random() < 0.1})
+    return {
+        "diagramId": diagram_id or f"diagram-{seed}",
+        "name": f"Synthetic diagram {seed}",
+        "nodes": node_list,
+        "edges": edges,
+        "viewport": {"x": 0, "y": 0, "zoom": 1},
+    }
+
+
+def write_diagrams_ndjson(path, count, nodes, seed=0):
+    """Write diagrams in the /api/diagrams/import format"""
+    with open(path, 'w') as f:
+        for i in range(count):
+            f.write(json.dumps(make_diagram(nodes, seed + i), separators=(',', ':')) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("kind", choices=["icons", "diagrams"])
+    parser.add_argument("--count", type=int, default=1000)
+    parser.add_argument("--categories", type=int, default=40)
+    parser.add_argument("--svg-bytes", type=int, default=1500)
+    parser.add_argument("--nodes", type=int, default=500, help="Nodes per diagram")
+    parser.add_argument("--tree", action="store_true", help="Write icons as a directory tree instead of a ZIP")
+    parser.add_argument("--provider", default="azure")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", required=True)
+    args = parser.parse_args()
+
+    if args.kind == "icons" and args.tree:
+        write_icon_tree(args.out, args.count, args.provider, args.categories, args.seed, args.svg_bytes)
+    elif args.kind == "icons":
+        write_icon_zip(args.out, args.count, args.categories, args.seed, args.svg_bytes)
+    else:
+        write_diagrams_ndjson(args.out, args.count, args.nodes, args.seed)
+    print(f"Wrote {args.count} {args.kind} to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
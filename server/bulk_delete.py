@@ -0,0 +1,245 @@
+"""
+Bulk deletion of icons from local storage, GCS and MongoDB.
+
+- MongoDB: a single delete_many.
+- Local storage: files are collected with os.scandir and removed by a thread
+  pool in chunks (os.remove releases the GIL, so removals overlap).
+- GCS: object names are listed page by page and deleted with batch requests
+  of up to GCS_BATCH_SIZE (max 100) calls, several batches in flight at once.
+  Each worker thread uses its own storage client because the client keeps the
+  active batch as client-wide state.
+
+Progress is reported through a background_jobs.Job.
+
+delete_icons() removes selected icons whose locations are already known from
+the icon catalog, with the stores handled in parallel.
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from google.api_core import exceptions
+
+import mongo_listing
+from metrics import timed, timed_iter, record_backend
+from admission import yield_to_reads
+
+logger = logging.getLogger(__name__)
+
+GCS_BATCH_SIZE = min(100, int(os.environ.get('GCS_BATCH_SIZE', 100)))
+GCS_DELETE_WORKERS = int(os.environ.get('GCS_DELETE_WORKERS', 16))
+LOCAL_DELETE_WORKERS = int(os.environ.get('LOCAL_DELETE_WORKERS', 8))
+LOCAL_CHUNK_SIZE = 500
+# Icons per local removal task when deleting selected icons
+SELECTED_CHUNK_SIZE = 50
+
+# Shared pool for request-time deletes, so a request does not pay for thread start-up
+_executor = ThreadPoolExecutor(max_workers=LOCAL_DELETE_WORKERS, thread_name_prefix='icon-delete')
+
+
+def _chunks(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _submit_bounded(executor, fn, chunks, limit):
+    """Submit fn(chunk) for every chunk, keeping at most `limit` in flight"""
+    pending = set()
+    for chunk in chunks:
+        yield_to_reads()
+        if len(pending) >= limit:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+        pending.add(executor.submit(fn, chunk))
+    for future in pending:
+        future.result()
+
+
+def delete_mongodb_icons(db, job):
+    """Delete every icon document"""
+    result = db.icons.delete_many({})
+    job.add('mongodb', deleted=result.deleted_count)
+    logger.info(f"Deleted {result.deleted_count} icons from MongoDB")
+    return result.deleted_count
+
+
+def iter_local_files(root):
+    """Yield the paths of icon files under root/<provider>/<category>/"""
+    if not os.path.isdir(root):
+        return
+    with os.scandir(root) as providers:
+        for provider in providers:
+            if not provider.is_dir():
+                continue
+            with os.scandir(provider.path) as categories:
+                for category in categories:
+                    if not category.is_dir():
+                        continue
+                    with os.scandir(category.path) as files:
+                        for entry in files:
+                            if entry.is_file():
+                                yield entry.path
+
+
+def _remove_files(paths):
+    """Remove files, returning (deleted, errors); missing files are ignored"""
+    deleted = errors = 0
+    started = time.perf_counter()
+    for path in paths:
+        try:
+            os.remove(path)
+            deleted += 1
+        except FileNotFoundError:
+            pass
+        except Exception as e:
+            errors += 1
+            logger.error(f"Error deleting local file {path}: {str(e)}")
+    record_backend('filesystem', 'remove_files', time.perf_counter() - started, errors > 0)
+    return deleted, errors
+
+
+def delete_local_icons(root, job, workers=LOCAL_DELETE_WORKERS):
+    """Remove every icon file under root in parallel, keeping the directories"""
+    def remove_chunk(paths):
+        deleted, errors = _remove_files(paths)
+        job.add('local', deleted=deleted, errors=errors)
+
+    job.set('local', deleted=0, errors=0)
+    paths = timed_iter(iter_local_files(root), 'filesystem', 'scan')
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='local-delete') as executor:
+        _submit_bounded(executor, remove_chunk, _chunks(paths, LOCAL_CHUNK_SIZE), workers * 2)
+    logger.info(f"Deleted {job.progress['local']['deleted']} icons from local storage")
+    return job.progress['local']['deleted']
+
+
+def delete_gcs_prefix(client_factory, bucket_name, prefix, job,
+                      workers=GCS_DELETE_WORKERS, batch_size=GCS_BATCH_SIZE):
+    """Delete every object under prefix using parallel batch requests.
+
+    client_factory() must return a new storage client; one is created per
+    worker thread.
+    """
+    local = threading.local()
+
+    def thread_bucket():
+        if not hasattr(local, 'client'):
+            local.client = client_factory()
+            local.bucket = local.client.bucket(bucket_name)
+        return local.client, local.bucket
+
+    def delete_batch(names):
+        client, bucket = thread_bucket()
+        try:
+            with timed('gcs', 'batch_delete'), client.batch():
+                for name in names:
+                    bucket.delete_blob(name)
+            job.add('gcs', deleted=len(names))
+            return
+        except Exception as e:
+            # A batch raises if any call failed (including 404s); the rest
+            # succeeded, so retry the batch one object at a time
+            logger.warning(f"GCS batch delete failed, retrying {len(names)} objects individually: {e}")
+        deleted = errors = 0
+        for name in names:
+            try:
+                with timed('gcs', 'delete'):
+                    bucket.delete_blob(name)
+                deleted += 1
+            except exceptions.NotFound:
+                deleted += 1
+            except Exception as e:
+                errors += 1
+                logger.error(f"Error deleting blob {name}: {str(e)}")
+        job.add('gcs', deleted=deleted, errors=errors)
+
+    def names():
+        client, _ = thread_bucket()
+        listing = client.list_blobs(bucket_name, prefix=prefix, fields="items(name),nextPageToken")
+        for blob in timed_iter(listing, 'gcs', 'list'):
+            job.add('gcs', listed=1)
+            yield blob.name
+
+    job.set('gcs', listed=0, deleted=0, errors=0)
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='gcs-delete') as executor:
+        _submit_bounded(executor, delete_batch, _chunks(names(), batch_size), workers * 2)
+    logger.info(f"Deleted {job.progress['gcs']['deleted']} objects from GCS under {prefix}")
+    return job.progress['gcs']['deleted']
+
+
+def delete_all(job, db=None, local_root=None, gcs_client_factory=None, bucket_name=None, prefix="cloudicons/"):
+    """Delete icons from every configured store, local and GCS concurrently"""
+    if db is not None:
+        try:
+            delete_mongodb_icons(db, job)
+        except Exception as e:
+            job.add('mongodb', errors=1)
+            logger.error(f"Error deleting from MongoDB: {str(e)}")
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        futures = {}
+        if local_root is not None:
+            futures['local'] = executor.submit(delete_local_icons, local_root, job)
+        if gcs_client_factory is not None:
+            futures['gcs'] = executor.submit(delete_gcs_prefix, gcs_client_factory, bucket_name, prefix, job)
+        for section, future in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                job.add(section, errors=1)
+                logger.error(f"Error deleting from {section}: {str(e)}")
+
+    progress = job.to_dict()["progress"]
+    return {
+        "deletedCount": sum(values.get('deleted', 0) for values in progress.values()),
+        "errorCount": sum(values.get('errors', 0) for values in progress.values()),
+    }
+
+
+def delete_icons(entries, db=None, gcs_objects=(), gcs_delete=None):
+    """Delete selected icons from MongoDB, local storage and GCS in parallel.
+
+    entries are icon_catalog.IconEntry objects; gcs_delete(name) is called for
+    each of gcs_objects (e.g. to queue a replicated delete).
+    """
+    counts = {"mongodb": 0, "local": 0, "gcs": 0, "errors": 0}
+    futures = []
+
+    mongo_ids = [entry.mongo_id for entry in entries if entry.mongo_id is not None]
+    if db is not None and mongo_ids:
+        # Also takes the icons off the stored category counts
+        futures.append(('mongodb', _executor.submit(mongo_listing.delete_records, db, mongo_ids)))
+
+    paths = [entry.local_path for entry in entries if entry.local_path]
+    for chunk in _chunks(paths, SELECTED_CHUNK_SIZE):
+        futures.append(('local', _executor.submit(_remove_files, chunk)))
+
+    if gcs_delete is not None and gcs_objects:
+        def delete_objects():
+            for name in gcs_objects:
+                gcs_delete(name)
+            return len(gcs_objects)
+        futures.append(('gcs', _executor.submit(delete_objects)))
+
+    for store, future in futures:
+        try:
+            result = future.result()
+        except Exception as e:
+            counts["errors"] += 1
+            logger.error(f"Error deleting icons from {store}: {str(e)}")
+            continue
+        if store == 'local':
+            counts["local"] += result[0]
+            counts["errors"] += result[1]
+        else:
+            counts[store] += result
+    return counts
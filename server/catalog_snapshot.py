@@ -0,0 +1,664 @@
+"""
+Shared icon listing snapshot, memory-mapped by every server process.
+
+With several worker processes, each would otherwise walk the icon folders
+(and probe GCS) to answer /api/icons, hold its own copy of the result and
+only notice another worker's uploads when it rebuilt. Instead the listing
+lives in one compact binary file that every process maps read-only; the
+pages are shared through the page cache.
+
+Writers never modify the file in place. Changes to single icons (upload,
+delete, replication) are appended, under an exclusive lock on `<path>.lock`,
+to a log next to it, `<path>.log`: one JSON line per publish,
+
+    {"g": 42, "ops": [["azure", "Compute", "vm.svg", set flags, cleared flags], ...]}
+
+numbered with consecutive generations, so publishing costs one small write
+however large the snapshot is. Readers stat the file on each use, map it
+again when it has been replaced (a mapping in use stays valid after the
+replace), and apply the log lines they have not seen yet, in memory, on top
+of it. Once the log holds ICON_SNAPSHOT_COMPACT_OPS changes it is folded into
+a new file in the background: encoded without the lock, then published with
+os.replace() before the log is replaced by its unfolded tail, so readers see
+every change either in the file or in the log. Changes to every icon (a
+rescan, a GCS listing) are published the same way as a new file.
+
+File layout (little-endian):
+
+    header      magic, format version, epoch, generation, creation time,
+                counts and the offset of each section
+    strings     (count + 1) u32 offsets into the string data, then UTF-8 data
+    records     per icon: provider, category, filename and display name
+                string ids, flags (LOCAL, GCS); sorted by
+                (provider, category, filename)
+    categories  per (provider, category): string id, first record, count
+    providers   per provider: string id, first record, record count,
+                first category, category count
+
+`generation` increases with every publish; the file records the generation
+it was published at and each log line the one it takes the snapshot to.
+`epoch` (modulo 2^16) increases when the snapshot is replaced by a rescan
+rather than changed, so followers such as the icon catalog know to start over.
+"""
+
+import os
+import json
+import mmap
+import time
+import fcntl
+import struct
+import logging
+import threading
+
+from icon_catalog import DEFAULT_CATEGORY, local_category
+from metrics import timed, cache_result
+from singleflight import Group
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b'ICONSNAP'
+FORMAT_VERSION = 1
+
+LOCAL = 1
+GCS = 2
+
+_HEADER = struct.Struct('<8sHHQdIIIIIIIII')
+_RECORD = struct.Struct('<IIIIB3x')
+_CATEGORY = struct.Struct('<III')
+_PROVIDER = struct.Struct('<IIIII')
+
+# Delay before publishing background changes, so bursts share one publish
+PUBLISH_DELAY = float(os.environ.get('ICON_SNAPSHOT_PUBLISH_DELAY', 0.05))
+# Logged changes after which the log is folded into a new snapshot file
+COMPACT_OPS = int(os.environ.get('ICON_SNAPSHOT_COMPACT_OPS', 2000))
+
+
+def listing_display_name(filename):
+    """Display name shown by the icon listing, e.g. 00001-icon-service-Virtual-Machine.svg -> Virtual Machine"""
+    display_name = filename.replace('.svg', '')
+    if display_name[:1].isdigit():
+        name_parts = display_name.split('-')
+        if len(name_parts) >= 4 and 'icon' in name_parts and 'service' in name_parts:
+            service_index = name_parts.index('service')
+            if service_index < len(name_parts) - 1:
+                display_name = ' '.join(name_parts[service_index + 1:]).title()
+    return display_name
+
+
+class CatalogSnapshot:
+    """Read-only view of one published snapshot file"""
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            self.identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, self.epoch, self.generation, self.created_at, self._string_count, self.record_count,
+         self.category_count, self.provider_count, self._offsets_at, self._data_at, self._records_at,
+         self._categories_at, self._providers_at) = _HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != FORMAT_VERSION:
+            raise ValueError(f"{path} is not an icon snapshot of format {FORMAT_VERSION}")
+        self._strings = {}
+
+    def _decode(self, index):
+        start, end = struct.unpack_from('<II', self._map, self._offsets_at + 4 * index)
+        return self._map[self._data_at + start:self._data_at + end].decode('utf-8')
+
+    def string(self, index):
+        """A provider or category name; these repeat on every record, so each is decoded once"""
+        value = self._strings.get(index)
+        if value is None:
+            value = self._strings[index] = self._decode(index)
+        return value
+
+    def _provider(self, name):
+        for i in range(self.provider_count):
+            entry = _PROVIDER.unpack_from(self._map, self._providers_at + i * _PROVIDER.size)
+            if self.string(entry[0]) == name:
+                return entry
+        return None
+
+    def providers(self):
+        return [self.string(_PROVIDER.unpack_from(self._map, self._providers_at + i * _PROVIDER.size)[0])
+                for i in range(self.provider_count)]
+
+    def categories(self, provider):
+        """[(category, icon count)] for a provider, sorted by category"""
+        entry = self._provider(provider)
+        if entry is None:
+            return []
+        _, _, _, first, count = entry
+        result = []
+        for i in range(first, first + count):
+            name, _, records = _CATEGORY.unpack_from(self._map, self._categories_at + i * _CATEGORY.size)
+            result.append((self.string(name), records))
+        return result
+
+    def icons(self, provider):
+        """Yield (category, filename, display name, flags) for a provider's icons"""
+        entry = self._provider(provider)
+        if entry is None:
+            return
+        _, first, count, _, _ = entry
+        record_at = self._records_at + first * _RECORD.size
+        records = self._map[record_at:record_at + count * _RECORD.size]
+        offsets = struct.unpack_from(f'<{self._string_count + 1}I', self._map, self._offsets_at)
+        data = self._data_at
+        for _, category, filename, display_name, flags in _RECORD.iter_unpack(records):
+            yield (self.string(category),
+                   self._map[data + offsets[filename]:data + offsets[filename + 1]].decode('utf-8'),
+                   self._map[data + offsets[display_name]:data + offsets[display_name + 1]].decode('utf-8'),
+                   flags)
+
+    def records(self):
+        """{(provider, category, filename): flags} for every icon"""
+        result = {}
+        for provider in self.providers():
+            for category, filename, _, flags in self.icons(provider):
+                result[(provider, category, filename)] = flags
+        return result
+
+    def flags(self, provider, category, filename):
+        """Flags of one icon, or None if it is not listed (a binary search of the provider's records)"""
+        entry = self._provider(provider)
+        if entry is None:
+            return None
+        _, low, count, _, _ = entry
+        high = low + count
+        target = (category, filename)
+        while low < high:
+            middle = (low + high) // 2
+            _, category_id, filename_id, _, flags = _RECORD.unpack_from(
+                self._map, self._records_at + middle * _RECORD.size)
+            found = (self.string(category_id), self._decode(filename_id))
+            if found < target:
+                low = middle + 1
+            elif found > target:
+                high = middle
+            else:
+                return flags
+        return None
+
+
+def apply_op(records, op):
+    """Apply one logged change to {(provider, category, filename): flags}"""
+    provider, category, filename, set_flags, clear_flags = op
+    key = (provider, category, filename)
+    flags = (records.get(key, 0) | set_flags) & ~clear_flags
+    if flags & LOCAL:
+        records[key] = flags
+    else:
+        # Only local files are listed
+        records.pop(key, None)
+
+
+class SnapshotView:
+    """A published snapshot file with the logged changes since applied on top"""
+
+    def __init__(self, base, generation=None, changes=None, record_count=None, log_offset=0, log_inode=None):
+        self.base = base
+        self.generation = base.generation if generation is None else generation
+        # {(provider, category, filename): flags}, 0 for icons removed since the file was published
+        self.changes = changes if changes is not None else {}
+        self.record_count = base.record_count if record_count is None else record_count
+        # Where the log lines applied so far end, in the log file with this inode
+        self.log_offset = log_offset
+        self.log_inode = log_inode
+        self.created_at = base.created_at
+        self.epoch = base.epoch
+        self.identity = (base.identity, self.generation)
+        self._by_provider = None
+        self._categories = {}
+
+    def extend(self, entries, log_offset, log_inode):
+        """A view with the ops of further log lines applied"""
+        changes = dict(self.changes)
+        record_count = self.record_count
+        generation = self.generation
+        for entry in entries:
+            for provider, category, filename, set_flags, clear_flags in entry["ops"]:
+                key = (provider, category, filename)
+                old = changes[key] if key in changes else self.base.flags(*key) or 0
+                flags = (old | set_flags) & ~clear_flags
+                if not flags & LOCAL:
+                    flags = 0
+                record_count += bool(flags) - bool(old)
+                changes[key] = flags
+            generation = entry["g"]
+        return SnapshotView(self.base, generation, changes, record_count, log_offset, log_inode)
+
+    def changed_since(self, earlier):
+        """{key: flags (0 if no longer listed)} for the icons that changed since an earlier view
+        of the same file, or None if the file has been replaced since"""
+        if earlier.base.identity != self.base.identity:
+            return None
+        changed = {}
+        for key in set(earlier.changes) | set(self.changes):
+            flags = self.changes.get(key)
+            if flags != earlier.changes.get(key):
+                changed[key] = flags if flags is not None else self.base.flags(*key) or 0
+        return changed
+
+    def _provider_changes(self, provider):
+        """[((category, filename), flags)] changed for a provider, sorted like the file's records"""
+        by_provider = self._by_provider
+        if by_provider is None:
+            by_provider = {}
+            for (name, category, filename), flags in self.changes.items():
+                by_provider.setdefault(name, []).append(((category, filename), flags))
+            for changed in by_provider.values():
+                changed.sort()
+            self._by_provider = by_provider
+        return by_provider.get(provider, [])
+
+    def providers(self):
+        names = set(self.base.providers()) | {provider for provider, _, _ in self.changes}
+        return sorted(name for name in names if self.categories(name))
+
+    def categories(self, provider):
+        """[(category, icon count)] for a provider, sorted by category"""
+        result = self._categories.get(provider)
+        if result is not None:
+            return result
+        counts = dict(self.base.categories(provider))
+        for (category, filename), flags in self._provider_changes(provider):
+            listed = self.base.flags(provider, category, filename) is not None
+            if listed != bool(flags):
+                counts[category] = counts.get(category, 0) + (1 if flags else -1)
+        result = self._categories[provider] = sorted(item for item in counts.items() if item[1] > 0)
+        return result
+
+    def icons(self, provider):
+        """Yield (category, filename, display name, flags) for a provider's icons"""
+        changed = self._provider_changes(provider)
+        if not changed:
+            yield from self.base.icons(provider)
+            return
+        position = 0
+        for icon in self.base.icons(provider):
+            key = (icon[0], icon[1])
+            while position < len(changed) and changed[position][0] < key:
+                (category, filename), flags = changed[position]
+                position += 1
+                if flags:
+                    yield category, filename, listing_display_name(filename), flags
+            if position < len(changed) and changed[position][0] == key:
+                flags = changed[position][1]
+                position += 1
+                if flags:
+                    yield icon[0], icon[1], icon[2], flags
+                continue
+            yield icon
+        for (category, filename), flags in changed[position:]:
+            if flags:
+                yield category, filename, listing_display_name(filename), flags
+
+    def records(self):
+        """{(provider, category, filename): flags} for every icon"""
+        records = self.base.records()
+        for key, flags in self.changes.items():
+            if flags:
+                records[key] = flags
+            else:
+                records.pop(key, None)
+        return records
+
+
+def encode_snapshot(records, generation, epoch=0):
+    """Serialize {(provider, category, filename): flags} into snapshot bytes"""
+    strings = {}
+    data = bytearray()
+    offsets = [0]
+
+    def string_id(value):
+        index = strings.get(value)
+        if index is None:
+            index = strings[value] = len(offsets) - 1
+            data.extend(value.encode('utf-8'))
+            offsets.append(len(data))
+        return index
+
+    record_bytes = bytearray()
+    category_bytes = bytearray()
+    provider_bytes = bytearray()
+    categories = []  # (string id, first record) per (provider, category)
+    providers = []   # (string id, first record, first category) per provider
+
+    def close_category(end):
+        name, first = categories[-1]
+        category_bytes.extend(_CATEGORY.pack(name, first, end - first))
+
+    def close_provider(end):
+        name, first, first_category = providers[-1]
+        provider_bytes.extend(_PROVIDER.pack(name, first, end - first, first_category,
+                                             len(categories) - first_category))
+
+    current_provider = current_category = None
+    for position, ((provider, category, filename), flags) in enumerate(sorted(records.items())):
+        if provider != current_provider or category != current_category:
+            if current_category is not None:
+                close_category(position)
+            if provider != current_provider:
+                if current_provider is not None:
+                    close_provider(position)
+                providers.append((string_id(provider), position, len(categories)))
+                current_provider = provider
+            categories.append((string_id(category), position))
+            current_category = category
+        record_bytes += _RECORD.pack(string_id(provider), string_id(category), string_id(filename),
+                                     string_id(listing_display_name(filename)), flags)
+    if current_provider is not None:
+        close_category(len(records))
+        close_provider(len(records))
+
+    offsets_at = _HEADER.size
+    data_at = offsets_at + 4 * len(offsets)
+    records_at = data_at + len(data) + (-len(data) % 4)
+    categories_at = records_at + len(record_bytes)
+    providers_at = categories_at + len(category_bytes)
+    header = _HEADER.pack(MAGIC, FORMAT_VERSION, epoch & 0xFFFF, generation, time.time(), len(offsets) - 1, len(records),
+                          len(categories), len(providers), offsets_at, data_at, records_at, categories_at, providers_at)
+    return b''.join([header, struct.pack(f'<{len(offsets)}I', *offsets), bytes(data),
+                     b'\0' * (-len(data) % 4), bytes(record_bytes), bytes(category_bytes), bytes(provider_bytes)])
+
+
+def scan_local(local_root):
+    """{(provider, category, filename): LOCAL} for every SVG under local_root/<provider>/"""
+    records = {}
+    if not os.path.isdir(local_root):
+        return records
+    for provider in os.listdir(local_root):
+        provider_dir = os.path.join(local_root, provider)
+        if not os.path.isdir(provider_dir):
+            continue
+        for root, _, files in os.walk(provider_dir):
+            category = local_category(provider_dir, root)
+            for file in files:
+                if file.lower().endswith('.svg'):
+                    records[(provider, category, file)] = LOCAL
+    return records
+
+
+# Scans of local storage requested by concurrent listings while there is no snapshot
+snapshot_builds = Group('icon_snapshot')
+
+
+class IconSnapshot:
+    """Publishes changes to the shared snapshot and maps the latest version"""
+
+    def __init__(self, path, local_root, compact_ops=COMPACT_OPS):
+        self.path = path
+        self.log_path = path + '.log'
+        self.local_root = local_root
+        self.compact_ops = compact_ops
+        self._view = None
+        self._read_lock = threading.Lock()
+        self._pending = []
+        self._lock = threading.Lock()
+        self._publish_lock = threading.Lock()
+        self._flush_scheduled = False
+        self._compacting = False
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    # Reading
+
+    def current(self):
+        """The latest published snapshot with its logged changes, or None if none has been published"""
+        view = None
+        # A compaction replacing the file between the stats means the log read may not match it
+        for _ in range(3):
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return None
+            identity = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+            with self._read_lock:
+                view = self._view
+                if not cache_result('icon_snapshot', view is not None and view.base.identity == identity):
+                    with timed('filesystem', 'snapshot_map'):
+                        view = SnapshotView(CatalogSnapshot(self.path))
+                view = self._view = self._read_log(view)
+            try:
+                stat = os.stat(self.path)
+            except FileNotFoundError:
+                return None
+            if view.base.identity == (stat.st_ino, stat.st_mtime_ns, stat.st_size):
+                return view
+        return view
+
+    def _read_log(self, view):
+        """view with the log lines appended since it was read applied"""
+        try:
+            f = open(self.log_path, 'rb')
+        except FileNotFoundError:
+            return view
+        with f:
+            stat = os.fstat(f.fileno())
+            if stat.st_ino != view.log_inode:
+                # A new log: its lines continue from the generation of the current file
+                view = SnapshotView(view.base, log_inode=stat.st_ino)
+            if stat.st_size <= view.log_offset:
+                return view
+            f.seek(view.log_offset)
+            data = f.read()
+        entries = []
+        generation = view.generation
+        consumed = 0
+        # Only whole lines; a writer may be midway through one
+        while True:
+            end = data.find(b'\n', consumed) + 1
+            if not end:
+                break
+            line = data[consumed:end]
+            try:
+                entry = json.loads(line)
+            except ValueError as e:
+                logger.error(f"Skipping unreadable line in {self.log_path}: {e}")
+                consumed = end
+                continue
+            if entry["g"] > generation + 1:
+                # Lines of a newer file than the one mapped; the next stat picks it up
+                break
+            if entry["g"] == generation + 1:
+                entries.append(entry)
+                generation = entry["g"]
+            # Lines at or below the generation are already in the file
+            consumed = end
+        if not entries:
+            return SnapshotView(view.base, view.generation, view.changes, view.record_count,
+                                view.log_offset + consumed, view.log_inode)
+        return view.extend(entries, view.log_offset + consumed, view.log_inode)
+
+    # Writing
+
+    def upsert(self, provider, category, filename, local=None, gcs=None):
+        """Queue setting the LOCAL / GCS flags of an icon (None leaves a flag unchanged)"""
+        set_flags = (LOCAL if local else 0) | (GCS if gcs else 0)
+        clear_flags = (LOCAL if local is False else 0) | (GCS if gcs is False else 0)
+        self._queue((provider, category or DEFAULT_CATEGORY, filename, set_flags, clear_flags))
+
+    def remove(self, provider, category, filename):
+        self._queue((provider, category, filename, 0, LOCAL | GCS))
+
+    def set_gcs(self, keys):
+        """Queue marking exactly the icons in keys as present in GCS (after a bucket listing)"""
+        keys = set(keys)
+
+        def apply(records):
+            for key, flags in records.items():
+                records[key] = flags | GCS if key in keys else flags & ~GCS
+        self._queue(apply)
+
+    def rebuild(self, records=None):
+        """Replace the snapshot with a scan of local storage (or the given records),
+        keeping the GCS flags of icons that are still listed"""
+        def apply(current):
+            if records is None:
+                with timed('filesystem', 'scan'):
+                    fresh = scan_local(self.local_root)
+            else:
+                fresh = dict(records)
+            for key in fresh:
+                fresh[key] |= current.get(key, 0) & GCS
+            current.clear()
+            current.update(fresh)
+        apply.rescan = True
+        self._queue(apply)
+        return self.flush()
+
+    def _queue(self, change):
+        """Queue a change: an op tuple for one icon, or a function applied to every record"""
+        with self._lock:
+            self._pending.append(change)
+            if self._flush_scheduled:
+                return
+            self._flush_scheduled = True
+        timer = threading.Timer(PUBLISH_DELAY, self.flush)
+        timer.daemon = True
+        timer.start()
+
+    def flush(self):
+        """Publish queued changes now; returns the new generation (None if nothing was queued)"""
+        with self._publish_lock:
+            with self._lock:
+                changes, self._pending = self._pending, []
+                self._flush_scheduled = False
+            if not changes:
+                return None
+            started = time.perf_counter()
+            with open(self.path + '.lock', 'w') as lock_file:
+                # Apply to the latest version, whichever process published it
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                view = self.current()
+                if view is not None and not any(callable(change) for change in changes):
+                    view = self._append(view, changes)
+                    kind = "logged"
+                else:
+                    records = view.records() if view is not None else {}
+                    for change in changes:
+                        if callable(change):
+                            change(records)
+                        else:
+                            apply_op(records, change)
+                    epoch = view.epoch if view is not None else 0
+                    if any(getattr(change, 'rescan', False) for change in changes):
+                        epoch += 1
+                    view = self._publish(records, (view.generation if view is not None else 0) + 1, epoch)
+                    kind = "published"
+            logger.info(f"{kind.capitalize()} icon snapshot generation {view.generation}: "
+                        f"{view.record_count} icons, {len(changes)} changes "
+                        f"in {(time.perf_counter() - started) * 1000:.1f} ms")
+            if len(view.changes) >= self.compact_ops:
+                self._compact_in_background()
+            return view.generation
+
+    def _append(self, view, ops):
+        """Append ops to the log as the next generation (holding the lock); returns the new view"""
+        line = json.dumps({"g": view.generation + 1, "ops": ops}, separators=(',', ':')).encode('utf-8') + b'\n'
+        with timed('filesystem', 'snapshot_append'):
+            with open(self.log_path, 'ab') as f:
+                stat = os.fstat(f.fileno())
+                if stat.st_ino != view.log_inode:
+                    # A new log (the first change since the file was published)
+                    offset = 0
+                else:
+                    offset = view.log_offset
+                if stat.st_size > offset:
+                    # The end of a line left by a writer that died midway
+                    f.truncate(offset)
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+        return self.current()
+
+    def _write(self, path, data):
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        return temp_path
+
+    def _publish(self, records, generation, epoch):
+        """Publish records as a new file and start an empty log (holding the lock); returns the new view"""
+        with timed('filesystem', 'snapshot_publish'):
+            os.replace(self._write(self.path, encode_snapshot(records, generation, epoch)), self.path)
+            # Lines left in the old log are at or below the new generation, so readers skip them
+            os.replace(self._write(self.log_path, b''), self.log_path)
+        return self.current()
+
+    def _compact_in_background(self):
+        with self._lock:
+            if self._compacting:
+                return
+            self._compacting = True
+        threading.Thread(target=self.compact, name="icon-snapshot-compact", daemon=True).start()
+
+    def compact(self):
+        """Fold the logged changes into a new snapshot file; returns its generation (None if not needed)"""
+        try:
+            view = self.current()
+            if view is None or not view.changes:
+                return None
+            started = time.perf_counter()
+            # Encoded without the lock, so appends carry on meanwhile
+            temp_path = self._write(self.path, encode_snapshot(view.records(), view.generation, view.epoch))
+            try:
+                with open(self.path + '.lock', 'w') as lock_file:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                    latest = self.current()
+                    if latest is None or latest.base is not view.base or latest.log_inode != view.log_inode:
+                        # Published or compacted since, by this or another process
+                        return None
+                    with open(self.log_path, 'rb') as f:
+                        f.seek(view.log_offset)
+                        tail = f.read(latest.log_offset - view.log_offset)
+                    with timed('filesystem', 'snapshot_publish'):
+                        # The file first: a reader of the old log then skips the folded lines,
+                        # and one still on the old file sees a gap in the new log and remaps
+                        os.replace(temp_path, self.path)
+                        temp_path = None
+                        os.replace(self._write(self.log_path, tail), self.log_path)
+            finally:
+                if temp_path is not None:
+                    os.remove(temp_path)
+            logger.info(f"Compacted icon snapshot at generation {view.generation}: {len(view.changes)} "
+                        f"logged changes folded in {(time.perf_counter() - started) * 1000:.1f} ms")
+            return view.generation
+        finally:
+            with self._lock:
+                self._compacting = False
+
+    def ensure(self, max_age=None):
+        """Build the snapshot from local storage if there is none (or it is older than max_age seconds);
+        concurrent callers share one scan"""
+        if self._outdated(self.current(), max_age):
+            snapshot_builds.do(self.path, self._rebuild_outdated, max_age)
+        return self.current()
+
+    def _outdated(self, snapshot, max_age):
+        return snapshot is None or (max_age is not None and time.time() - snapshot.created_at >= max_age)
+
+    def _rebuild_outdated(self, max_age):
+        # A build that finished just before this one started may have made it unnecessary
+        if self._outdated(self.current(), max_age):
+            self.rebuild()
+
+    def status(self):
+        snapshot = self.current()
+        if snapshot is None:
+            return {"published": False}
+        providers = snapshot.providers()
+        return {
+            "published": True,
+            "generation": snapshot.generation,
+            "epoch": snapshot.epoch,
+            "createdAt": snapshot.created_at,
+            "icons": snapshot.record_count,
+            "providers": len(providers),
+            "categories": sum(len(snapshot.categories(provider)) for provider in providers),
+            "bytes": snapshot.base.identity[2],
+            "fileGeneration": snapshot.base.generation,
+            "loggedChanges": len(snapshot.changes),
+            "logBytes": snapshot.log_offset,
+        }
@@ -0,0 +1,92 @@
+"""
+Precomputed /api/categories responses.
+
+Category counts are already maintained incrementally: uploads, deletes,
+replication and category refreshes apply their change to the icon snapshot
+(see catalog_snapshot.py), and uploads and deletes adjust MongoDB's
+category_counts (see mongo_listing.py). This keeps, per provider, the encoded response built
+from those counts and the category metadata in
+<icon root>/<provider>/categories.json:
+
+    {"categories": [{"name": "Compute", "displayName": "Compute Services",
+                     "description": "Virtual machines, containers, ..."}]}
+
+and rebuilds it only when the counts' version or the metadata file changes,
+so serving it is a couple of stats and a dict lookup. Categories with icons
+are listed, sorted by name; metadata of categories without icons is left out.
+"""
+
+import os
+import json
+import logging
+import threading
+
+from metrics import cache_result
+from serialization import dumps
+
+logger = logging.getLogger(__name__)
+
+METADATA_FILE = "categories.json"
+
+
+class CategoryIndex:
+    def __init__(self, local_root):
+        self.local_root = local_root
+        # provider -> (key, encoded response)
+        self._bodies = {}
+        # provider -> (mtime_ns, {name: metadata})
+        self._metadata = {}
+        self._lock = threading.Lock()
+
+    def metadata(self, provider):
+        """The mtime of the provider's categories.json (None without one) and its entries by name"""
+        path = os.path.join(self.local_root, provider, METADATA_FILE)
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return None, {}
+        cached = self._metadata.get(provider)
+        if cached is not None and cached[0] == mtime:
+            return cached
+        entries = {}
+        try:
+            with open(path, 'r') as f:
+                for entry in json.load(f).get("categories", []):
+                    if entry.get("name"):
+                        entries[entry["name"]] = entry
+        except (OSError, ValueError, AttributeError) as e:
+            logger.error(f"Error reading {path}: {e}")
+        self._metadata[provider] = (mtime, entries)
+        return mtime, entries
+
+    def get(self, provider, source, version, counts):
+        """The encoded response for a provider. counts() returns [(category, icon count)]
+        for the given source and version and is only called when the response is rebuilt."""
+        mtime, metadata = self.metadata(provider)
+        key = (source, version, mtime)
+        with self._lock:
+            cached = self._bodies.get(provider)
+        if cache_result('categories', cached is not None and cached[0] == key):
+            return cached[1]
+        body = dumps(self.build(provider, counts(), metadata))
+        with self._lock:
+            self._bodies[provider] = (key, body)
+        return body
+
+    def build(self, provider, counts, metadata):
+        categories = []
+        for name, count in counts:
+            entry = {"name": name, "displayName": name, "description": None}
+            entry.update(metadata.get(name, {}))
+            entry["count"] = count
+            categories.append(entry)
+        return {
+            "provider": provider,
+            "categories": categories,
+            "totalCount": sum(count for _, count in counts),
+        }
+
+    def clear(self):
+        with self._lock:
+            self._bodies.clear()
+        self._metadata.clear()
@@ -0,0 +1,178 @@
+"""
+Incremental refresh of icon categories in MongoDB from the local folder layout.
+
+An icon's category is the folder it sits in, so categories can only change
+when a directory's entries change, which updates the directory's mtime. A
+checkpoint records, for every directory under the icon root, its mtime and
+its subdirectories:
+
+- an unchanged directory costs one stat: its subdirectories are taken from
+  the checkpoint and its files are not listed
+- only the files of changed directories are compared with MongoDB, through a
+  projected query on (provider, filename)
+- only documents whose category or display name actually differ are
+  updated, with batched bulk_write
+
+A routine refresh with no changes is a stat per directory and no database
+work. Directories modified within the last MTIME_SETTLE_NS are not
+checkpointed, since further changes within the same mtime tick would not be
+seen, and are rescanned next time.
+"""
+
+import os
+import json
+import time
+import logging
+import tempfile
+
+from pymongo import UpdateOne
+
+from icon_catalog import DEFAULT_CATEGORY, display_name_for
+from metrics import timed, cache_result
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_VERSION = 1
+BATCH_SIZE = 1000
+MTIME_SETTLE_NS = 2 * 10 ** 9
+
+
+def load_checkpoint(path):
+    """Load a checkpoint written by save_checkpoint, or an empty one"""
+    try:
+        with open(path, 'r') as f:
+            checkpoint = json.load(f)
+        if checkpoint.get("version") == CHECKPOINT_VERSION:
+            return checkpoint
+        logger.info(f"Ignoring category checkpoint with version {checkpoint.get('version')}")
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Could not read category checkpoint {path}: {e}")
+    return {"version": CHECKPOINT_VERSION, "database": None, "dirs": {}}
+
+
+def save_checkpoint(path, checkpoint):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    # A temp file of its own, so checkpoints saved by other workers don't move it away
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(checkpoint, f, separators=(',', ':'))
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def category_for(rel_dir):
+    """Provider and category of the files in a directory relative to the icon root"""
+    provider, _, category = rel_dir.partition('/')
+    return provider, category or DEFAULT_CATEGORY
+
+
+def scan_changed(root, previous_dirs):
+    """Walk the icon root, listing only directories changed since the checkpoint.
+
+    Returns (dirs, changed) where dirs is the new checkpoint state and changed
+    maps relative directory -> list of SVG filenames in it.
+    """
+    dirs = {}
+    changed = {}
+    now_ns = time.time_ns()
+    stack = ['']
+    while stack:
+        rel = stack.pop()
+        path = os.path.join(root, *rel.split('/')) if rel else root
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            continue
+
+        previous = previous_dirs.get(rel)
+        if previous is not None and previous["mtime"] == mtime:
+            subdirs = previous["subdirs"]
+        else:
+            subdirs = []
+            files = []
+            with os.scandir(path) as entries:
+                for entry in entries:
+                    if entry.is_dir():
+                        subdirs.append(entry.name)
+                    elif rel and entry.name.lower().endswith('.svg'):
+                        files.append(entry.name)
+            if rel:
+                changed[rel] = files
+
+        settled = now_ns - mtime >= MTIME_SETTLE_NS
+        dirs[rel] = {"mtime": mtime if settled else -1, "subdirs": subdirs}
+        stack.extend(f"{rel}/{name}" if rel else name for name in subdirs)
+    return dirs, changed
+
+
+def _batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def refresh_categories(db, root, checkpoint_path, full=False, dry_run=False):
+    """Bring MongoDB icon categories in line with the folders the files are in"""
+    started = time.perf_counter()
+    checkpoint = load_checkpoint(checkpoint_path)
+    if full or checkpoint.get("database") != db.name:
+        checkpoint["dirs"] = {}
+
+    with timed('filesystem', 'scan'):
+        dirs, changed = scan_changed(root, checkpoint["dirs"])
+    # Directories listed again vs. taken from the checkpoint
+    cache_result('category_checkpoint', False, len(changed))
+    cache_result('category_checkpoint', True, len(dirs) - len(changed))
+
+    # Desired category and display name per (provider, filename)
+    desired = {}
+    for rel, files in changed.items():
+        provider, category = category_for(rel)
+        for filename in files:
+            desired[(provider, filename)] = (category, display_name_for(filename))
+
+    by_provider = {}
+    for provider, filename in desired:
+        by_provider.setdefault(provider, []).append(filename)
+
+    operations = []
+    examined = 0
+    projection = {"provider": 1, "filename": 1, "category": 1, "displayName": 1}
+    for provider, filenames in by_provider.items():
+        for batch in _batches(filenames, BATCH_SIZE):
+            for doc in db.icons.find({"provider": provider, "filename": {"$in": batch}}, projection):
+                examined += 1
+                category, display_name = desired[(provider, doc["filename"])]
+                if doc.get("category") != category or doc.get("displayName") != display_name:
+                    operations.append(UpdateOne(
+                        {"_id": doc["_id"]},
+                        {"$set": {"category": category, "displayName": display_name, "updatedAt": time.time()}}
+                    ))
+
+    updated = 0
+    if not dry_run:
+        for batch in _batches(operations, BATCH_SIZE):
+            updated += db.icons.bulk_write(batch, ordered=False).modified_count
+        checkpoint["dirs"] = dirs
+        checkpoint["database"] = db.name
+        save_checkpoint(checkpoint_path, checkpoint)
+
+    seconds = time.perf_counter() - started
+    logger.info(f"Category refresh: {len(dirs)} directories, {len(changed)} changed, "
+                f"{examined} records examined, {len(operations)} changes"
+                f"{' (dry run)' if dry_run else ''} in {seconds * 1000:.1f} ms")
+    return {
+        "directories": len(dirs),
+        "changedDirectories": len(changed),
+        "examined": examined,
+        "changes": len(operations),
+        "updatedCount": updated,
+        "dryRun": dry_run,
+        "full": full,
+        "milliseconds": round(seconds * 1000, 2),
+    }
@@ -0,0 +1,97 @@
+"""
+Circuit breaker for a backend that has a local fallback.
+
+When MongoDB Atlas is unreachable, every request that tries it first waits
+out the full server-selection timeout before falling back to local storage.
+The breaker counts consecutive availability failures; once `threshold` is
+reached it opens and `allow()` returns False, so callers go straight to
+their fallback. While open, a background thread runs `probe()` every
+`reset_interval` seconds and closes the breaker on the first success.
+
+    if breaker.allow():
+        try:
+            ...  # MongoDB
+        except Exception as e:
+            breaker.record_failure(e)
+    ...  # fallback
+
+Only errors accepted by `is_failure` count; a duplicate key or validation
+error says nothing about availability.
+"""
+
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+
+
+class CircuitBreaker:
+    """Routes callers to their fallback while a backend is failing"""
+
+    def __init__(self, name, probe, threshold=3, reset_interval=30, is_failure=None):
+        self.name = name
+        self.probe = probe
+        self.threshold = threshold
+        self.reset_interval = reset_interval
+        self.is_failure = is_failure or (lambda error: True)
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self.trips = 0
+        self.last_error = None
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Whether the backend should be tried"""
+        return self.state == CLOSED
+
+    def record_success(self):
+        if self.failures:
+            with self._lock:
+                self.failures = 0
+
+    def record_failure(self, error):
+        """Count an error from the backend, opening the circuit at the threshold"""
+        if not self.is_failure(error):
+            return
+        with self._lock:
+            self.last_error = str(error)
+            if self.state == OPEN:
+                return
+            self.failures += 1
+            if self.failures < self.threshold:
+                return
+            self.state = OPEN
+            self.opened_at = time.time()
+            self.trips += 1
+        logger.warning(f"{self.name} circuit opened after {self.failures} failures "
+                       f"({error}); using fallback until it recovers")
+        threading.Thread(target=self._probe_until_closed, name=f"{self.name}-probe", daemon=True).start()
+
+    def _probe_until_closed(self):
+        while self.state == OPEN:
+            time.sleep(self.reset_interval)
+            try:
+                self.probe()
+            except Exception as e:
+                self.last_error = str(e)
+                logger.info(f"{self.name} still unavailable: {e}")
+                continue
+            with self._lock:
+                self.state = CLOSED
+                self.failures = 0
+            logger.info(f"{self.name} circuit closed after {time.time() - self.opened_at:.1f}s")
+
+    def status(self):
+        return {
+            "state": self.state,
+            "failures": self.failures,
+            "threshold": self.threshold,
+            "trips": self.trips,
+            "openedAt": self.opened_at if self.state == OPEN else None,
+            "lastError": self.last_error,
+        }
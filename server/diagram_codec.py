@@ -0,0 +1,146 @@
+"""
+Storage codec for diagram documents.
+
+Diagrams whose body (everything except the metadata fields) serializes to more
+than DIAGRAM_COMPRESS_THRESHOLD bytes are stored with the body compressed into
+a single `_body` field. Metadata fields (diagramId, name, timestamps...) stay
+top-level, so they remain queryable in MongoDB and readable without
+decompressing anything.
+
+    {"diagramId": "...", "name": "...", "createdAt": ..., "updatedAt": ...,
+     "_body": {"codec": "zstd", "size": 123456, "data": <bytes or base64>}}
+
+Configuration (environment variables):
+- DIAGRAM_CODEC: "zlib" (default), "zstd" or "none". zstd requires the
+  `zstandard` package on every server that reads diagrams: one without it
+  cannot decode what the others wrote, so it is never chosen implicitly.
+- DIAGRAM_COMPRESS_THRESHOLD: minimum body size in bytes (default 16384).
+
+Documents written before compression was enabled have no `_body` field and are
+returned unchanged by decode_diagram().
+"""
+
+import os
+import json
+import zlib
+import base64
+import logging
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+logger = logging.getLogger(__name__)
+
+BODY_FIELD = '_body'
+
+# Fields kept uncompressed at the top level of stored diagrams
+# (revision is what conditional updates match on)
+METADATA_FIELDS = (
+    '_id', 'diagramId', 'name', 'title', 'description', 'provider',
+    'tags', 'createdAt', 'updatedAt', 'revision',
+)
+
+COMPRESS_THRESHOLD = int(os.environ.get('DIAGRAM_COMPRESS_THRESHOLD', 16 * 1024))
+ZLIB_LEVEL = int(os.environ.get('DIAGRAM_ZLIB_LEVEL', 6))
+ZSTD_LEVEL = int(os.environ.get('DIAGRAM_ZSTD_LEVEL', 3))
+
+
+def _default_codec():
+    codec = os.environ.get('DIAGRAM_CODEC', 'zlib').lower()
+    if codec == 'zstd' and zstandard is None:
+        logger.warning("DIAGRAM_CODEC is zstd but the zstandard package is not installed, using zlib")
+        return 'zlib'
+    if codec not in ('zstd', 'zlib', 'none'):
+        logger.warning(f"Unknown DIAGRAM_CODEC {codec}, using zlib")
+        return 'zlib'
+    return codec
+
+
+CODEC = _default_codec()
+
+
+def compress(data, codec=None):
+    """Compress bytes with the given (or configured) codec"""
+    codec = codec or CODEC
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress(data)
+    if codec == 'zlib':
+        return zlib.compress(data, ZLIB_LEVEL)
+    raise ValueError(f"Cannot compress with codec {codec}")
+
+
+def decompress(data, codec):
+    """Decompress bytes written by compress()"""
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("Diagram is zstd-compressed but the zstandard package is not installed")
+        return zstandard.ZstdDecompressor().decompress(data)
+    if codec == 'zlib':
+        return zlib.decompress(data)
+    raise ValueError(f"Unknown diagram codec {codec}")
+
+
+def is_encoded(doc):
+    """Return True if the stored document has a compressed body"""
+    return isinstance(doc, dict) and BODY_FIELD in doc
+
+
+def settable(update):
+    """Whether an update's fields can be applied with $set to an uncompressed stored diagram
+    (dotted or $-prefixed keys would address nested fields or operators instead)"""
+    return all(isinstance(key, str) and key and '.' not in key and not key.startswith('$')
+               and key not in ('_id', BODY_FIELD) for key in update)
+
+
+def summary(doc):
+    """Return only the metadata fields of a diagram, without decoding the body"""
+    return {k: v for k, v in doc.items() if k in METADATA_FIELDS and k != '_id'}
+
+
+def summary_projection():
+    """MongoDB projection selecting only the metadata fields"""
+    projection = {field: 1 for field in METADATA_FIELDS}
+    projection['_id'] = 0
+    return projection
+
+
+def encode_diagram(doc, text=False, codec=None, threshold=None):
+    """Return the storage form of a diagram.
+
+    With text=True the compressed body is base64 encoded so the document can be
+    written to a JSON file; otherwise it is raw bytes (stored as BSON binary).
+    """
+    codec = codec or CODEC
+    threshold = COMPRESS_THRESHOLD if threshold is None else threshold
+    if codec == 'none' or is_encoded(doc):
+        return doc
+
+    body = {k: v for k, v in doc.items() if k not in METADATA_FIELDS}
+    raw = json.dumps(body, separators=(',', ':'), default=str).encode('utf-8')
+    if len(raw) < threshold:
+        return doc
+
+    data = compress(raw, codec)
+    encoded = {k: v for k, v in doc.items() if k in METADATA_FIELDS}
+    encoded[BODY_FIELD] = {
+        "codec": codec,
+        "size": len(raw),
+        "data": base64.b64encode(data).decode('ascii') if text else data,
+    }
+    return encoded
+
+
+def decode_diagram(doc):
+    """Return the full diagram for a stored document, decompressing if needed"""
+    if not is_encoded(doc):
+        return doc
+    body_info = doc[BODY_FIELD]
+    data = body_info["data"]
+    if isinstance(data, str):
+        data = base64.b64decode(data)
+    body = json.loads(decompress(bytes(data), body_info["codec"]))
+    decoded = {k: v for k, v in doc.items() if k != BODY_FIELD}
+    decoded.update(body)
+    return decoded
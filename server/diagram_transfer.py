@@ -0,0 +1,248 @@
+"""
+Streaming NDJSON import and export of diagrams.
+
+Export yields one JSON document per line straight from a MongoDB cursor or from
+the local diagrams.json file, which is read incrementally, so memory use does
+not grow with the number of diagrams. Import consumes an NDJSON stream and
+upserts diagrams by diagramId in batches: bulk_write in MongoDB, or a single
+streaming merge of the local file, made under the store's lock (store_lock)
+so diagrams saved by other threads and processes during the merge are kept.
+
+Imports are bulk restores and do not record diagram versions.
+"""
+
+import os
+import json
+import fcntl
+import time
+import uuid
+import logging
+import tempfile
+from contextlib import contextmanager
+
+from pymongo import ReplaceOne
+
+from diagram_codec import encode_diagram, decode_diagram
+from admission import yield_to_reads
+
+logger = logging.getLogger(__name__)
+
+EXPORT_BATCH_SIZE = int(os.environ.get('DIAGRAM_EXPORT_BATCH_SIZE', 500))
+IMPORT_BATCH_SIZE = int(os.environ.get('DIAGRAM_IMPORT_BATCH_SIZE', 500))
+
+# Number of invalid line messages included in an import report
+MAX_REPORTED_ERRORS = 20
+
+READ_CHUNK_SIZE = 64 * 1024
+
+
+@contextmanager
+def store_lock(path):
+    """Exclusive lock on the local JSON store at path, across threads and processes"""
+    with open(path + '.lock', 'w') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        yield
+
+
+def to_ndjson(diagram):
+    """Serialize one diagram as an NDJSON line"""
+    return json.dumps(diagram, separators=(',', ':'), default=str) + '\n'
+
+
+def iter_json_array(f, chunk_size=READ_CHUNK_SIZE):
+    """Yield the items of the first JSON array in a file without loading it all.
+
+    Intended for the {"diagrams": [...]} file written by save_diagrams().
+    """
+    decoder = json.JSONDecoder()
+    buffer = ''
+    while '[' not in buffer:
+        chunk = f.read(chunk_size)
+        if not chunk:
+            return
+        buffer += chunk
+    position = buffer.index('[') + 1
+
+    eof = False
+    while True:
+        while position < len(buffer) and buffer[position] in ' \t\r\n,':
+            position += 1
+
+        if position < len(buffer) and buffer[position] == ']':
+            return
+        try:
+            if position >= len(buffer):
+                raise ValueError("need more data")
+            item, position = decoder.raw_decode(buffer, position)
+        except ValueError:
+            if eof:
+                raise ValueError("Truncated JSON array in diagram store")
+            # Drop consumed input; grow reads geometrically so very large
+            # items are not re-parsed too often
+            buffer = buffer[position:]
+            position = 0
+            chunk = f.read(max(chunk_size, len(buffer)))
+            eof = not chunk
+            buffer += chunk
+            continue
+        yield item
+
+
+def iter_local_diagrams(path):
+    """Yield stored (possibly encoded) diagrams from the local JSON store"""
+    if not os.path.exists(path):
+        return
+    with open(path, 'r') as f:
+        for diagram in iter_json_array(f):
+            yield diagram
+
+
+def export_local(path):
+    """Yield NDJSON lines for every diagram in the local JSON store"""
+    for diagram in iter_local_diagrams(path):
+        yield to_ndjson(decode_diagram(diagram))
+
+
+def export_mongodb(collection):
+    """Yield NDJSON lines for every diagram in a MongoDB collection"""
+    cursor = collection.find({}, {'_id': 0}).batch_size(EXPORT_BATCH_SIZE)
+    try:
+        for diagram in cursor:
+            yield to_ndjson(decode_diagram(diagram))
+    finally:
+        cursor.close()
+
+
+class ImportReport:
+    """Counts kept while importing an NDJSON stream"""
+
+    def __init__(self):
+        self.received = 0
+        self.inserted = 0
+        self.updated = 0
+        self.invalid = 0
+        self.errors = []
+        self.started = time.time()
+
+    def error(self, line_number, message):
+        self.invalid += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f"line {line_number}: {message}")
+
+    def to_dict(self):
+        return {
+            "received": self.received,
+            "imported": self.inserted + self.updated,
+            "inserted": self.inserted,
+            "updated": self.updated,
+            "invalid": self.invalid,
+            "errors": self.errors,
+            "seconds": round(time.time() - self.started, 3),
+        }
+
+
+def iter_ndjson(lines, report):
+    """Parse NDJSON lines into diagrams ready to store, recording invalid lines"""
+    for line_number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            line = line.decode('utf-8', errors='replace')
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            diagram = json.loads(line)
+        except ValueError as e:
+            report.error(line_number, f"invalid JSON ({e})")
+            continue
+        if not isinstance(diagram, dict):
+            report.error(line_number, "not a JSON object")
+            continue
+
+        report.received += 1
+        diagram.pop('_id', None)
+        diagram.pop('_body', None)
+        if not diagram.get('diagramId'):
+            diagram['diagramId'] = str(uuid.uuid4())
+        now = time.time()
+        diagram.setdefault('createdAt', now)
+        diagram.setdefault('updatedAt', now)
+        yield diagram
+
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def import_mongodb(collection, lines, batch_size=IMPORT_BATCH_SIZE):
+    """Upsert NDJSON diagrams into MongoDB by diagramId with batched bulk writes"""
+    report = ImportReport()
+    for batch in _batches(iter_ndjson(lines, report), batch_size):
+        yield_to_reads()
+        operations = [
+            ReplaceOne({"diagramId": d['diagramId']}, encode_diagram(d), upsert=True)
+            for d in batch
+        ]
+        result = collection.bulk_write(operations, ordered=False)
+        report.inserted += result.upserted_count
+        report.updated += result.matched_count
+    logger.info(f"Imported {report.inserted + report.updated} diagrams into MongoDB "
+                f"({report.inserted} new, {report.updated} replaced, {report.invalid} invalid)")
+    return report
+
+
+def import_local(path, lines):
+    """Upsert NDJSON diagrams into the local JSON store by diagramId.
+
+    Incoming diagrams are spooled to a temporary file while their ids are
+    collected, then the store is rewritten in one streaming pass under its
+    lock: existing diagrams that are not being replaced first, followed by the
+    imported ones. Only the set of ids is held in memory.
+    """
+    report = ImportReport()
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+
+    # Line offset of the last occurrence of each imported id (last one wins)
+    imported = {}
+    with tempfile.TemporaryFile('w+', dir=directory) as spool:
+        for index, diagram in enumerate(iter_ndjson(lines, report)):
+            imported[diagram['diagramId']] = index
+            spool.write(to_ndjson(encode_diagram(diagram, text=True)))
+        spool.seek(0)
+
+        keep = set(imported.values())
+        with store_lock(path):
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix='diagrams.', suffix='.import.tmp')
+            try:
+                with os.fdopen(fd, 'w') as out:
+                    out.write('{"diagrams":[')
+                    first = True
+                    for diagram in iter_local_diagrams(path):
+                        if diagram.get('diagramId') in imported:
+                            report.updated += 1
+                            continue
+                        out.write(('' if first else ',') + json.dumps(diagram, separators=(',', ':'), default=str))
+                        first = False
+
+                    for index, line in enumerate(spool):
+                        if index not in keep:
+                            continue
+                        out.write(('' if first else ',') + line.rstrip('\n'))
+                        first = False
+                    out.write(']}')
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+
+    report.inserted = len(imported) - report.updated
+    logger.info(f"Imported {len(imported)} diagrams into local storage "
+                f"({report.inserted} new, {report.updated} replaced, {report.invalid} invalid)")
+    return report
@@ -0,0 +1,422 @@
+"""
+Diagram version history for Azure Diagram Maker.
+
+Every save of a diagram is recorded as a version. Most versions are stored as a
+compact structural delta against the previous version; every
+SNAPSHOT_INTERVAL versions (and whenever a delta would not be smaller than the
+document itself) a full snapshot is stored instead. Any version can then be
+materialized by loading the nearest snapshot and replaying at most
+SNAPSHOT_INTERVAL - 1 deltas.
+
+Two stores are provided, mirroring the diagram storage backends:
+- MongoVersionStore keeps records in the `diagram_versions` collection
+- JsonVersionStore keeps one append-only JSON lines file per diagram
+
+Delta format (a list of operations, applied in order):
+- ["s", path, value]  set the value at path
+- ["d", path]         delete the key/item at path
+- ["o", path, ids]    reorder a list of objects keyed by "id" to match ids,
+                      dropping missing items; new items are filled by "s" ops
+
+A path is a list of dict keys (str), list indexes (int) or {"id": x} for the
+item with that id in a keyed list (e.g. React Flow nodes and edges).
+"""
+
+import os
+import re
+import json
+import time
+import copy
+import fcntl
+import struct
+import hashlib
+import logging
+
+from pymongo.errors import DuplicateKeyError
+
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+# Store a full snapshot every N versions (version 1 is always a snapshot)
+SNAPSHOT_INTERVAL = int(os.environ.get('DIAGRAM_SNAPSHOT_INTERVAL', 20))
+
+# Size of one line offset in a JsonVersionStore index file
+OFFSET_SIZE = 8
+
+# Fields that are bookkeeping for the store and never part of a version
+EXCLUDED_FIELDS = ('_id',)
+
+# Attempts at taking the next version number in MongoDB when concurrent saves race for it
+RECORD_ATTEMPTS = 5
+
+
+def _is_keyed_list(value):
+    """Return True if value is a list of dicts that all carry a unique 'id'"""
+    if not isinstance(value, list) or not value:
+        return False
+    ids = set()
+    for item in value:
+        if not isinstance(item, dict) or 'id' not in item:
+            return False
+        item_id = item['id']
+        if not isinstance(item_id, (str, int)) or item_id in ids:
+            return False
+        ids.add(item_id)
+    return True
+
+
+def _diff(old, new, path, ops):
+    """Append the operations that turn old into new at path"""
+    if type(old) is not type(new):
+        ops.append(["s", path, new])
+        return
+
+    if isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                ops.append(["d", path + [key]])
+        for key, value in new.items():
+            if key not in old:
+                ops.append(["s", path + [key], value])
+            elif old[key] != value:
+                _diff(old[key], value, path + [key], ops)
+        return
+
+    if isinstance(new, list):
+        if _is_keyed_list(old) and _is_keyed_list(new):
+            old_by_id = {item['id']: item for item in old}
+            new_ids = [item['id'] for item in new]
+            if [item['id'] for item in old] != new_ids:
+                ops.append(["o", path, new_ids])
+            for item in new:
+                item_path = path + [{"id": item['id']}]
+                previous = old_by_id.get(item['id'])
+                if previous is None:
+                    ops.append(["s", item_path, item])
+                elif previous != item:
+                    _diff(previous, item, item_path, ops)
+        elif len(old) == len(new):
+            for index, (old_item, new_item) in enumerate(zip(old, new)):
+                if old_item != new_item:
+                    _diff(old_item, new_item, path + [index], ops)
+        else:
+            ops.append(["s", path, new])
+        return
+
+    if old != new:
+        ops.append(["s", path, new])
+
+
+def compute_delta(old, new):
+    """Compute the structural delta that turns document old into new"""
+    ops = []
+    _diff(old, new, [], ops)
+    return ops
+
+
+class _Resolver:
+    """Resolves path components, caching id -> index maps for keyed lists.
+
+    Each map is kept with its list, so a list replaced by an op stays alive and
+    its id() cannot be reused by a new list while the map is cached."""
+
+    def __init__(self):
+        self._indexes = {}
+
+    def index_of(self, items, item_id):
+        cached = self._indexes.get(id(items))
+        if cached is None or cached[0] is not items:
+            index = {item['id']: i for i, item in enumerate(items)
+                     if isinstance(item, dict) and 'id' in item}
+            cached = self._indexes[id(items)] = (items, index)
+        return cached[1][item_id]
+
+    def invalidate(self, items):
+        self._indexes.pop(id(items), None)
+
+    def step(self, container, component):
+        if isinstance(component, dict):
+            return self.index_of(container, component['id'])
+        return component
+
+
+def _reorder(items, ids):
+    by_id = {item['id']: item for item in items}
+    # New ids get a placeholder carrying only the id until their "s" op
+    items[:] = [by_id.get(item_id, {"id": item_id}) for item_id in ids]
+
+
+def apply_delta(doc, ops, in_place=False):
+    """Apply a delta produced by compute_delta and return the new document"""
+    if not in_place:
+        doc = copy.deepcopy(doc)
+    resolver = _Resolver()
+
+    for op in ops:
+        kind, path = op[0], op[1]
+        if not path:
+            # The document itself: replaced, or reordered when it is a keyed list
+            if kind == "s":
+                doc = copy.deepcopy(op[2])
+                resolver = _Resolver()
+            elif kind == "o":
+                _reorder(doc, op[2])
+                resolver.invalidate(doc)
+            else:
+                raise ValueError(f"Delta operation {kind} cannot apply to the whole document")
+            continue
+
+        parent = doc
+        for component in path[:-1]:
+            parent = parent[resolver.step(parent, component)]
+        last = path[-1]
+
+        if kind == "s":
+            key = resolver.step(parent, last)
+            if isinstance(parent, dict):
+                resolver.invalidate(parent.get(key))
+            elif key < len(parent):
+                resolver.invalidate(parent[key])
+            parent[key] = copy.deepcopy(op[2])
+        elif kind == "d":
+            del parent[resolver.step(parent, last)]
+            resolver.invalidate(parent)
+        elif kind == "o":
+            items = parent[resolver.step(parent, last)]
+            _reorder(items, op[2])
+            resolver.invalidate(items)
+        else:
+            raise ValueError(f"Unknown delta operation: {kind}")
+
+    return doc
+
+
+def version_content(diagram):
+    """Return the part of a stored diagram that is tracked by versions"""
+    return {k: v for k, v in diagram.items() if k not in EXCLUDED_FIELDS}
+
+
+def snapshot_base(version):
+    """Return the version number of the periodic snapshot covering version"""
+    return ((version - 1) // SNAPSHOT_INTERVAL) * SNAPSHOT_INTERVAL + 1
+
+
+def content_hash(doc):
+    """Hash of a version's content, stored with each record so a delta is only
+    recorded against the content of the latest version"""
+    return hashlib.sha1(json.dumps(doc, sort_keys=True, separators=(',', ':'), default=str)
+                        .encode('utf-8')).hexdigest()
+
+
+def build_record(diagram_id, version, previous, current):
+    """Build the record stored for version, given the previous content"""
+    record = {
+        "diagramId": diagram_id,
+        "version": version,
+        "createdAt": time.time(),
+        "hash": content_hash(current),
+    }
+    full_size = len(json.dumps(current, separators=(',', ':'), default=str))
+    if previous is None or version == snapshot_base(version):
+        record.update({"kind": "snapshot", "data": current, "size": full_size})
+        return record
+
+    ops = compute_delta(previous, current)
+    delta_size = len(json.dumps(ops, separators=(',', ':'), default=str))
+    if delta_size >= full_size:
+        record.update({"kind": "snapshot", "data": current, "size": full_size})
+    else:
+        record.update({"kind": "delta", "ops": ops, "size": delta_size})
+    return record
+
+
+def materialize(records, version):
+    """Rebuild version from records covering (at least) snapshot..version.
+
+    The records are consumed: the snapshot data is modified in place.
+    """
+    records = [r for r in records if r['version'] <= version]
+    records.sort(key=lambda r: r['version'])
+    if not records or records[-1]['version'] != version:
+        return None
+
+    start = None
+    for i in range(len(records) - 1, -1, -1):
+        if records[i]['kind'] == "snapshot":
+            start = i
+            break
+    if start is None:
+        raise ValueError(f"No snapshot found for version {version}")
+
+    doc = records[start]['data']
+    for record in records[start + 1:]:
+        doc = apply_delta(doc, record['ops'], in_place=True)
+    return doc
+
+
+def _summary(record):
+    """Return the listing fields of a version record"""
+    return {
+        "version": record['version'],
+        "kind": record['kind'],
+        "size": record.get('size'),
+        "createdAt": record.get('createdAt'),
+    }
+
+
+class MongoVersionStore:
+    """Version records stored in the MongoDB `diagram_versions` collection.
+
+    Relies on the (diagramId, version) index declared in mongodb_schema.py.
+    """
+
+    def __init__(self, db, collection_name='diagram_versions'):
+        self.collection = db[collection_name]
+
+    def _latest(self, diagram_id):
+        return self.collection.find_one(
+            {"diagramId": diagram_id},
+            {"_id": 0, "version": 1, "hash": 1},
+            sort=[("version", -1)]
+        )
+
+    def record(self, diagram_id, previous, current):
+        """Record current as the next version of diagram_id"""
+        for _ in range(RECORD_ATTEMPTS):
+            latest = self._latest(diagram_id)
+            version = latest['version'] + 1 if latest else 1
+            base = previous
+            if latest is not None and previous is not None and latest.get('hash') != content_hash(previous):
+                # A concurrent save recorded other content since previous was read:
+                # a delta from previous would not apply to it, so store a snapshot
+                base = None
+            try:
+                if latest is None and previous is not None:
+                    # Diagram predates version tracking: keep its prior state as version 1
+                    self.collection.insert_one(build_record(diagram_id, version, None, previous))
+                    version += 1
+                self.collection.insert_one(build_record(diagram_id, version, base, current))
+                return version
+            except DuplicateKeyError:
+                # Another save took this number (unique diagramId_version index): try the next
+                continue
+        raise RuntimeError(f"Could not allocate a version number for diagram {diagram_id} "
+                           f"after {RECORD_ATTEMPTS} attempts")
+
+    def list_versions(self, diagram_id):
+        """List version summaries, newest first"""
+        cursor = self.collection.find(
+            {"diagramId": diagram_id},
+            {"_id": 0, "version": 1, "kind": 1, "size": 1, "createdAt": 1}
+        ).sort("version", -1)
+        return [_summary(r) for r in cursor]
+
+    def get_version(self, diagram_id, version):
+        """Materialize a version, or return None if it does not exist"""
+        # Adaptive snapshots may sit after the periodic one, so read the whole range
+        records = list(self.collection.find(
+            {"diagramId": diagram_id,
+             "version": {"$gte": snapshot_base(version), "$lte": version}},
+            {"_id": 0}
+        ))
+        return materialize(records, version)
+
+    def delete(self, diagram_id):
+        """Remove all versions of a diagram"""
+        return self.collection.delete_many({"diagramId": diagram_id}).deleted_count
+
+
+class JsonVersionStore:
+    """Version records stored as one append-only JSON lines file per diagram.
+
+    A sidecar `.idx` file holds the byte offset of every line (8 bytes each),
+    so materializing a version reads only the snapshot..version range.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, diagram_id):
+        name = str(diagram_id)
+        if not re.match(r'^[A-Za-z0-9_.-]{1,100}$', name) or name.startswith('.'):
+            name = hashlib.sha1(name.encode('utf-8')).hexdigest()
+        return os.path.join(self.directory, f"{name}.jsonl")
+
+    def _count(self, diagram_id):
+        index_path = self._path(diagram_id) + '.idx'
+        if not os.path.exists(index_path):
+            return 0
+        return os.path.getsize(index_path) // OFFSET_SIZE
+
+    def _offset(self, diagram_id, version):
+        with open(self._path(diagram_id) + '.idx', 'rb') as f:
+            f.seek((version - 1) * OFFSET_SIZE)
+            return struct.unpack('<Q', f.read(OFFSET_SIZE))[0]
+
+    def _hash(self, diagram_id, version):
+        """The content hash of a version, read from the start of its line (None for old records)"""
+        with open(self._path(diagram_id), 'rb') as f:
+            f.seek(self._offset(diagram_id, version))
+            # "hash" precedes the version's data in the record, so the line needn't be parsed
+            match = re.search(rb'"hash":"([0-9a-f]{40})"', f.readline(4096))
+        return match.group(1).decode('ascii') if match else None
+
+    def record(self, diagram_id, previous, current):
+        """Record current as the next version of diagram_id"""
+        path = self._path(diagram_id)
+        with timed('filesystem', 'versions_write'), \
+                open(path, 'ab') as data_file, open(path + '.idx', 'ab') as index_file:
+            # Saves from other threads and processes append one at a time, so line
+            # offsets and version numbers stay in step
+            fcntl.flock(data_file, fcntl.LOCK_EX)
+            count = self._count(diagram_id)
+            version = count + 1
+            base = previous
+            if count and previous is not None and self._hash(diagram_id, count) != content_hash(previous):
+                # A concurrent save recorded other content since previous was read
+                base = None
+            records = []
+            if version == 1 and previous is not None:
+                # Diagram predates version tracking: keep its prior state as version 1
+                records.append(build_record(diagram_id, version, None, previous))
+                version += 1
+            records.append(build_record(diagram_id, version, base, current))
+
+            offset = data_file.seek(0, os.SEEK_END)
+            for record in records:
+                line = (json.dumps(record, separators=(',', ':'), default=str) + '\n').encode('utf-8')
+                data_file.write(line)
+                index_file.write(struct.pack('<Q', offset))
+                offset += len(line)
+        return version
+
+    def list_versions(self, diagram_id):
+        """List version summaries, newest first"""
+        path = self._path(diagram_id)
+        if not os.path.exists(path):
+            return []
+        with timed('filesystem', 'versions_read'), open(path, 'rb') as f:
+            versions = [_summary(json.loads(line)) for line in f if line.strip()]
+        versions.reverse()
+        return versions
+
+    def get_version(self, diagram_id, version):
+        """Materialize a version, or return None if it does not exist"""
+        if version < 1 or version > self._count(diagram_id):
+            return None
+        base = snapshot_base(version)
+        with timed('filesystem', 'versions_read'), open(self._path(diagram_id), 'rb') as f:
+            f.seek(self._offset(diagram_id, base))
+            records = [json.loads(f.readline()) for _ in range(version - base + 1)]
+        return materialize(records, version)
+
+    def delete(self, diagram_id):
+        """Remove all versions of a diagram"""
+        count = self._count(diagram_id)
+        path = self._path(diagram_id)
+        for file_path in (path, path + '.idx'):
+            if os.path.exists(file_path):
+                os.remove(file_path)
+        return count
@@ -0,0 +1,181 @@
+"""
+Local stand-in for the Google Cloud Storage client.
+
+Implements the subset of google.cloud.storage used by the server (Client,
+Bucket, Blob) on top of a local directory, so GCS code paths can be exercised
+and benchmarked without credentials or network access. Set GCS_FAKE_DIR to
+make upload.py use it instead of the real client.
+
+Failures and latency can be injected to test retry behaviour:
+
+    client = FakeClient("/tmp/fake-gcs", latency=0.01, failure_rate=0.2)
+"""
+
+import os
+import random
+import shutil
+import threading
+import time
+
+from google.api_core import exceptions
+
+
+class FakeClient:
+    """Fake storage.Client backed by a local directory"""
+
+    def __init__(self, root, project="fake-project", latency=0.0, failure_rate=0.0):
+        self.root = root
+        self.project = project
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.calls = 0
+        self._fail_next = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        os.makedirs(root, exist_ok=True)
+
+    def fail_next(self, count=1):
+        """Make the next `count` operations raise ServiceUnavailable"""
+        with self._lock:
+            self._fail_next += count
+
+    def _call(self):
+        """Simulate a remote call: count it, sleep and maybe fail"""
+        with self._lock:
+            self.calls += 1
+            fail = self._fail_next > 0
+            if fail:
+                self._fail_next -= 1
+        # Calls inside a batch share the batch's single round trip
+        if self.latency and not getattr(self._local, 'batch_depth', 0):
+            time.sleep(self.latency)
+        if fail or (self.failure_rate and random.random() < self.failure_rate):
+            raise exceptions.ServiceUnavailable("Injected fake GCS failure")
+
+    def bucket(self, name):
+        return FakeBucket(self, name)
+
+    def list_blobs(self, bucket_or_name, prefix=None, **kwargs):
+        name = bucket_or_name.name if isinstance(bucket_or_name, FakeBucket) else bucket_or_name
+        return self.bucket(name).list_blobs(prefix=prefix)
+
+    def batch(self):
+        return _FakeBatch(self)
+
+
+class _FakeBatch:
+    """Batch context: operations apply immediately but cost one round trip in total"""
+
+    def __init__(self, client):
+        self.client = client
+
+    def __enter__(self):
+        local = self.client._local
+        local.batch_depth = getattr(local, 'batch_depth', 0) + 1
+        return self
+
+    def __exit__(self, *exc_info):
+        local = self.client._local
+        local.batch_depth -= 1
+        if self.client.latency and not local.batch_depth:
+            time.sleep(self.client.latency)
+        return False
+
+
+class FakeBucket:
+    """Fake storage.Bucket"""
+
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self.path = os.path.join(client.root, name)
+        os.makedirs(self.path, exist_ok=True)
+
+    def blob(self, name):
+        return FakeBlob(self, name)
+
+    def get_blob(self, name):
+        blob = self.blob(name)
+        return blob if blob.exists() else None
+
+    def list_blobs(self, prefix=None, **kwargs):
+        self.client._call()
+        names = []
+        for root, _, files in os.walk(self.path):
+            for file in files:
+                name = os.path.relpath(os.path.join(root, file), self.path).replace(os.sep, '/')
+                if prefix is None or name.startswith(prefix):
+                    names.append(name)
+        names.sort()
+        return iter([FakeBlob(self, name) for name in names])
+
+    def delete_blob(self, name):
+        self.blob(name).delete()
+
+    def delete_blobs(self, blobs, on_error=None):
+        for blob in blobs:
+            try:
+                (blob if isinstance(blob, FakeBlob) else self.blob(blob)).delete()
+            except exceptions.NotFound:
+                if on_error is None:
+                    raise
+                on_error(blob)
+
+
+class FakeBlob:
+    """Fake storage.Blob"""
+
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+        self.path = os.path.join(bucket.path, *name.split('/'))
+
+    @property
+    def public_url(self):
+        return f"https://storage.googleapis.com/{self.bucket.name}/{self.name}"
+
+    @property
+    def size(self):
+        return os.path.getsize(self.path) if os.path.exists(self.path) else None
+
+    @property
+    def updated(self):
+        return os.path.getmtime(self.path) if os.path.exists(self.path) else None
+
+    def exists(self):
+        self.bucket.client._call()
+        return os.path.isfile(self.path)
+
+    def upload_from_filename(self, filename, content_type=None):
+        self.bucket.client._call()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temp_path = self.path + '.uploading'
+        shutil.copyfile(filename, temp_path)
+        os.replace(temp_path, self.path)
+
+    def upload_from_string(self, data, content_type=None):
+        self.bucket.client._call()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with open(self.path, 'wb') as f:
+            f.write(data)
+
+    def download_as_bytes(self):
+        self.bucket.client._call()
+        if not os.path.isfile(self.path):
+            raise exceptions.NotFound(f"No such object: {self.bucket.name}/{self.name}")
+        with open(self.path, 'rb') as f:
+            return f.read()
+
+    def download_to_filename(self, filename):
+        data = self.download_as_bytes()
+        with open(filename, 'wb') as f:
+            f.write(data)
+
+    def delete(self):
+        self.bucket.client._call()
+        try:
+            os.remove(self.path)
+        except FileNotFoundError:
+            raise exceptions.NotFound(f"No such object: {self.bucket.name}/{self.name}")
@@ -0,0 +1,45 @@
+"""
+Gunicorn configuration for the API server.
+
+    cd server && gunicorn -c gunicorn.conf.py wsgi:app
+
+Threaded workers (gthread): requests mostly wait on MongoDB, GCS and disk, so
+a few processes with several threads each serve many concurrent requests.
+The app is not preloaded in the master, so every worker creates its own
+MongoDB and GCS clients after the fork (see wsgi.py). On SIGTERM, workers
+stop accepting connections, finish in-flight requests for up to
+graceful_timeout seconds, then release their resources in worker_exit.
+State shared by the workers on disk (the local diagram store, version
+history, job records, icon snapshot and replication queue) is written under
+file locks, so any number of workers can share one DATA_DIR.
+
+The ASGI app (asgi.py) uses the same settings with uvicorn workers:
+
+    cd server && gunicorn -c gunicorn.conf.py -k uvicorn.workers.UvicornWorker asgi:app
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 3001)}"
+workers = int(os.environ.get('WEB_CONCURRENCY', (os.cpu_count() or 1) * 2 + 1))
+worker_class = 'gthread'
+threads = int(os.environ.get('GUNICORN_THREADS', 8))
+
+# Icon ZIP uploads and ?wait=true maintenance calls can run for a while
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', 120))
+graceful_timeout = int(os.environ.get('GUNICORN_GRACEFUL_TIMEOUT', 30))
+keepalive = 5
+
+# Recycle workers now and then to bound memory growth; jitter avoids restarting them all at once
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', 10000))
+max_requests_jitter = max_requests // 10
+
+preload_app = False
+accesslog = os.environ.get('GUNICORN_ACCESS_LOG') or None
+errorlog = '-'
+
+
+def worker_exit(server, worker):
+    """Finish in-flight GCS operations and close MongoDB before the worker exits"""
+    import upload
+    upload.shutdown()
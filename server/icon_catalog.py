@@ -0,0 +1,311 @@
+"""
+In-memory catalog of where every icon is stored.
+
+For each icon (provider, category, filename) the catalog records its local
+file path, the GCS objects holding it and its MongoDB _id, so operations such
+as deletion can go straight to the right locations instead of looking the
+icon up in MongoDB and probing alternative GCS paths.
+
+The catalog is built once from a directory scan, a projected MongoDB query
+and (in the background) a GCS listing, then kept up to date by the code paths
+that add, move or remove icons. Every change bumps `version`, which callers
+can use to invalidate derived caches. Entries built while MongoDB was
+unavailable have no _id; deletion looks those up by provider and filename
+(attach_mongo_ids) so their records are not left behind.
+"""
+
+import os
+import re
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+GCS_PREFIX = 'cloudicons/'
+DEFAULT_CATEGORY = 'General'
+
+
+def local_category(provider_dir, directory):
+    """Category of a file in directory, as used by the icon listing"""
+    rel_path = os.path.relpath(directory, provider_dir)
+    return rel_path if rel_path != '.' else DEFAULT_CATEGORY
+
+
+def display_name_for(filename):
+    """Readable name for an icon file, e.g. 10021-icon-service-Virtual-Machine.svg -> Virtual Machine"""
+    display_name = filename.replace('.svg', '')
+    if display_name[:1].isdigit():
+        match = re.search(r'^\d+-icon-service-(.+)$', display_name)
+        if match:
+            return match.group(1).replace('-', ' ').title()
+        return display_name.replace('-', ' ').title()
+    return display_name
+
+
+def gcs_object_name(provider, category, filename):
+    return f"{GCS_PREFIX}{provider}/{category}/{filename}"
+
+
+def parse_gcs_object_name(name):
+    """Return (provider, category, filename) for an icon object name, or None"""
+    if not name.startswith(GCS_PREFIX):
+        return None
+    parts = name[len(GCS_PREFIX):].split('/')
+    if len(parts) < 2 or not parts[-1]:
+        return None
+    provider, filename = parts[0], parts[-1]
+    category = '/'.join(parts[1:-1]) or DEFAULT_CATEGORY
+    return provider, category, filename
+
+
+class IconEntry:
+    """Known locations of one icon"""
+
+    __slots__ = ('provider', 'category', 'filename', 'local_path', 'gcs_objects', 'mongo_id')
+
+    def __init__(self, provider, category, filename):
+        self.provider = provider
+        self.category = category
+        self.filename = filename
+        self.local_path = None
+        self.gcs_objects = set()
+        self.mongo_id = None
+
+    @property
+    def key(self):
+        return (self.provider, self.category, self.filename)
+
+    def to_dict(self):
+        return {
+            "provider": self.provider,
+            "category": self.category,
+            "filename": self.filename,
+            "localPath": self.local_path,
+            "gcsObjects": sorted(self.gcs_objects),
+            "mongoId": str(self.mongo_id) if self.mongo_id is not None else None,
+        }
+
+
+class IconCatalog:
+    """Index of icon locations keyed by (provider, category, filename)"""
+
+    def __init__(self, local_root):
+        self.local_root = local_root
+        self.version = 0
+        self.built = False
+        # True once GCS has been listed; until then GCS locations are guesses
+        self.gcs_known = False
+        self._entries = {}
+        # (provider, filename) -> set of categories
+        self._by_name = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    # Building
+
+    def _entry(self, provider, category, filename):
+        key = (provider, category, filename)
+        entry = self._entries.get(key)
+        if entry is None:
+            entry = self._entries[key] = IconEntry(provider, category, filename)
+            self._by_name.setdefault((provider, filename), set()).add(category)
+        return entry
+
+    def scan_local(self):
+        """Return entries for every SVG under local_root/<provider>/"""
+        entries = {}
+        if not os.path.isdir(self.local_root):
+            return entries
+        for provider in os.listdir(self.local_root):
+            provider_dir = os.path.join(self.local_root, provider)
+            if not os.path.isdir(provider_dir):
+                continue
+            for root, _, files in os.walk(provider_dir):
+                category = local_category(provider_dir, root)
+                for file in files:
+                    if file.lower().endswith('.svg'):
+                        entry = IconEntry(provider, category, file)
+                        entry.local_path = os.path.join(root, file)
+                        entries[entry.key] = entry
+        return entries
+
+    def build(self, db=None):
+        """(Re)build the catalog from local storage and MongoDB"""
+        entries = self.scan_local()
+        mongo_count = 0
+        if db is not None:
+            by_name = {}
+            for entry in entries.values():
+                by_name.setdefault((entry.provider, entry.filename), []).append(entry)
+            cursor = db.icons.find({}, {"provider": 1, "filename": 1, "category": 1})
+            for doc in cursor:
+                provider, filename = doc.get("provider"), doc.get("filename")
+                if not provider or not filename:
+                    continue
+                mongo_count += 1
+                matches = by_name.get((provider, filename))
+                if not matches:
+                    entry = IconEntry(provider, doc.get("category") or DEFAULT_CATEGORY, filename)
+                    entries[entry.key] = entry
+                    matches = by_name[(provider, filename)] = [entry]
+                # The document is keyed by (provider, filename); prefer the entry in its category
+                target = next((e for e in matches if e.category == doc.get("category")), matches[0])
+                target.mongo_id = doc["_id"]
+
+        with self._lock:
+            gcs_objects = {key: entry.gcs_objects for key, entry in self._entries.items()}
+            self._entries = {}
+            self._by_name = {}
+            for key, entry in entries.items():
+                entry.gcs_objects = gcs_objects.get(key, set())
+                self._entries[key] = entry
+                self._by_name.setdefault((entry.provider, entry.filename), set()).add(entry.category)
+            self.built = True
+            self.version += 1
+        logger.info(f"Built icon catalog: {len(entries)} icons ({mongo_count} MongoDB records)")
+
+    def load_gcs(self, object_names):
+        """Record the GCS objects listed under the icon prefix"""
+        count = 0
+        # List before taking the lock so lookups are not blocked by the listing
+        object_names = list(object_names)
+        with self._lock:
+            for entry in self._entries.values():
+                entry.gcs_objects = set()
+            for name in object_names:
+                parsed = parse_gcs_object_name(name)
+                if parsed is None:
+                    continue
+                provider, category, filename = parsed
+                if name.count('/') == 2:
+                    # Legacy flat path: attach to an existing entry in any category
+                    categories = self._by_name.get((provider, filename))
+                    if categories:
+                        category = next(iter(categories))
+                self._entry(provider, category, filename).gcs_objects.add(name)
+                count += 1
+            self.gcs_known = True
+            self.version += 1
+        logger.info(f"Loaded {count} GCS objects into the icon catalog")
+
+    # Maintenance
+
+    def add(self, provider, category, filename, local_path=None, mongo_id=None, gcs_object=None):
+        """Record (or update) the locations of an icon"""
+        with self._lock:
+            entry = self._entry(provider, category, filename)
+            if local_path is not None:
+                entry.local_path = local_path
+            if mongo_id is not None:
+                entry.mongo_id = mongo_id
+            if gcs_object is not None:
+                entry.gcs_objects.add(gcs_object)
+            self.version += 1
+            return entry
+
+    def remove(self, entry):
+        with self._lock:
+            if self._entries.pop(entry.key, None) is None:
+                return
+            categories = self._by_name.get((entry.provider, entry.filename))
+            if categories is not None:
+                categories.discard(entry.category)
+                if not categories:
+                    del self._by_name[(entry.provider, entry.filename)]
+            self.version += 1
+
+    def attach_mongo_ids(self, db, entries):
+        """Look up the MongoDB _id of entries that lack one (the catalog was built while
+        MongoDB was unavailable) by provider and filename, so their records get deleted too"""
+        names = {}
+        for entry in entries:
+            if entry.mongo_id is None:
+                names.setdefault(entry.provider, set()).add(entry.filename)
+        if not names:
+            return 0
+        query = {"$or": [{"provider": provider, "filename": {"$in": sorted(filenames)}}
+                         for provider, filenames in names.items()]}
+        attached = 0
+        for doc in db.icons.find(query, {"provider": 1, "filename": 1, "category": 1}):
+            matches = self.resolve(doc["provider"], doc["filename"])
+            if not matches:
+                continue
+            # As in build: the record belongs to the entry in its category, if there is one
+            target = next((e for e in matches if e.category == doc.get("category")), matches[0])
+            target.mongo_id = doc["_id"]
+            attached += 1
+        return attached
+
+    def apply_listing(self, listing, complete=False):
+        """Follow the shared icon listing (see catalog_snapshot.py), which other server processes
+        change too. listing maps (provider, category, filename) to (listed locally, in GCS); with
+        complete=True it covers every icon, and local icons missing from it are removed too."""
+        with self._lock:
+            if complete:
+                for key, entry in list(self._entries.items()):
+                    if key not in listing and entry.local_path is not None:
+                        self.remove(entry)
+            for (provider, category, filename), (local, gcs) in listing.items():
+                entry = self._entries.get((provider, category, filename))
+                if not local:
+                    # Deleted: by the time the listing drops it, every store has
+                    if entry is not None and entry.local_path is not None:
+                        self.remove(entry)
+                    continue
+                if entry is None:
+                    entry = self._entry(provider, category, filename)
+                if entry.local_path is None:
+                    entry.local_path = self.local_path(provider, category, filename)
+                if gcs:
+                    # Only ever added: an object the listing has not caught up with is still deleted
+                    entry.gcs_objects.add(gcs_object_name(provider, category, filename))
+            self.version += 1
+
+    def local_path(self, provider, category, filename):
+        path = os.path.join(self.local_root, provider, category, filename)
+        if category == DEFAULT_CATEGORY and not os.path.exists(path):
+            # Files directly in the provider folder are listed in the default category
+            path = os.path.join(self.local_root, provider, filename)
+        return path
+
+    def invalidate(self):
+        """Rebuild from the stores on next use (after changes made behind the catalog's back)"""
+        with self._lock:
+            self.built = False
+            self.gcs_known = False
+
+    def clear(self):
+        with self._lock:
+            self._entries = {}
+            self._by_name = {}
+            self.version += 1
+
+    # Lookup
+
+    def resolve(self, provider, filename, category=None):
+        """Return the entries for an icon; all categories when category is None"""
+        with self._lock:
+            if category is not None:
+                entry = self._entries.get((provider, category, filename))
+                return [entry] if entry is not None else []
+            return [self._entries[(provider, c, filename)]
+                    for c in sorted(self._by_name.get((provider, filename), ()))]
+
+    def gcs_targets(self, entry):
+        """GCS objects to delete for an entry.
+
+        Before GCS has been listed the catalog cannot know which paths exist,
+        so both the category path and the legacy flat path are returned.
+        """
+        with self._lock:
+            objects = set(entry.gcs_objects)
+            if not self.gcs_known:
+                objects.add(gcs_object_name(entry.provider, entry.category, entry.filename))
+                objects.add(f"{GCS_PREFIX}{entry.provider}/{entry.filename}")
+            return sorted(objects)
+
+    def entries(self):
+        with self._lock:
+            return list(self._entries.values())
@@ -0,0 +1,367 @@
+"""
+Prometheus metrics for the API server, served at GET /api/metrics.
+
+    from metrics import timed, cache_result
+
+    with timed('gcs', 'upload'):
+        blob.upload_from_filename(path)
+
+Series:
+
+    http_request_duration_seconds{method, route, status}     histogram
+    backend_operation_duration_seconds{backend, operation}   histogram
+    backend_operation_errors_total{backend, operation}       counter
+    cache_requests_total{cache, result}                      counter
+    admission_wait_seconds{pool}                             histogram
+    admission_rejections_total{pool, reason}                 counter
+    singleflight_calls_total{group, result}                  counter
+
+`backend` is mongodb (every command, from the driver's command listener),
+gcs or filesystem. `route` is the URL rule, e.g. /api/diagrams/<diagram_id>,
+and the request duration is the time until the response headers are sent.
+
+Recording is a bisect and two additions under a lock. Values live in the
+process that recorded them; with several worker processes each one also
+writes its values to `<directory>/<pid>-<start time>.json` every
+METRICS_WRITE_SECONDS. The process answering a scrape writes its own file
+first and sums all of them, so counters keep increasing whichever worker
+is scraped. Files of processes that have exited are folded into
+`retired.json`. METRICS_ENABLED=false turns recording off.
+"""
+
+import os
+import json
+import time
+import fcntl
+import bisect
+import logging
+import threading
+
+import tracing
+
+logger = logging.getLogger(__name__)
+
+ENABLED = os.environ.get('METRICS_ENABLED', 'true').lower() == 'true'
+WRITE_SECONDS = float(os.environ.get('METRICS_WRITE_SECONDS', 10))
+
+# Upper bounds in seconds: sub-millisecond mmap reads up to slow GCS uploads
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+RETIRED = 'retired.json'
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *label_values, amount=1):
+        if not ENABLED:
+            return
+        with self._lock:
+            self.series[label_values] = self.series.get(label_values, 0) + amount
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), value] for labels, value in self.series.items()]
+
+
+class Histogram(Counter):
+    """Per series: a count for each bucket (not cumulative, +Inf last), then the sum"""
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels, buckets=BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *label_values):
+        if not ENABLED:
+            return
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(label_values)
+            if series is None:
+                series = self.series[label_values] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(labels), list(value)] for labels, value in self.series.items()]
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_text(names, values, extra=''):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _number(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def merge(states):
+    """Sum several process states ({name: metric state}) into one"""
+    merged = {}
+    for state in states:
+        for name, metric in state.items():
+            target = merged.get(name)
+            if target is None:
+                target = merged[name] = dict(metric, series={})
+            for labels, value in metric["series"]:
+                key = tuple(labels)
+                current = target["series"].get(key)
+                if current is None:
+                    target["series"][key] = list(value) if isinstance(value, list) else value
+                elif isinstance(value, list):
+                    if len(value) == len(current):
+                        target["series"][key] = [a + b for a, b in zip(current, value)]
+                else:
+                    target["series"][key] = current + value
+    for metric in merged.values():
+        metric["series"] = [[list(labels), value] for labels, value in metric["series"].items()]
+    return merged
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+        self.directory = None
+        self.started_at = time.time()
+        self._writer = None
+
+    def counter(self, name, help, labels=()):
+        metric = Counter(name, help, tuple(labels))
+        self.metrics.append(metric)
+        return metric
+
+    def histogram(self, name, help, labels=(), buckets=BUCKETS):
+        metric = Histogram(name, help, tuple(labels), buckets)
+        self.metrics.append(metric)
+        return metric
+
+    def state(self):
+        """This process's values, as written to its metrics file"""
+        result = {}
+        for metric in self.metrics:
+            result[metric.name] = {"kind": metric.kind, "help": metric.help, "labels": list(metric.labels),
+                                   "series": metric.snapshot()}
+            if metric.kind == 'histogram':
+                result[metric.name]["buckets"] = list(metric.buckets)
+        return result
+
+    # Sharing between worker processes
+
+    def _path(self):
+        return os.path.join(self.directory, f"{os.getpid()}-{int(self.started_at * 1000)}.json")
+
+    def _write_file(self, path, state):
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(state, f, separators=(',', ':'))
+        os.replace(temp_path, path)
+
+    def write(self):
+        """Write this process's values for the other workers to read"""
+        if self.directory is not None:
+            self._write_file(self._path(), self.state())
+
+    def share(self, directory, interval=WRITE_SECONDS):
+        """Write this process's values to directory every interval seconds"""
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        if self._writer is not None or interval <= 0:
+            return
+
+        def run():
+            while True:
+                time.sleep(interval)
+                try:
+                    self.write()
+                except Exception as e:
+                    logger.error(f"Error writing metrics: {e}")
+
+        self._writer = threading.Thread(target=run, name="metrics-writer", daemon=True)
+        self._writer.start()
+
+    def _after_fork(self):
+        # A forked worker starts from zero with its own file (and writer thread)
+        self.started_at = time.time()
+        self._writer = None
+        for metric in self.metrics:
+            metric.series = {}
+            metric._lock = threading.Lock()
+
+    def _read(self, path):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def collect(self):
+        """Summed values of every server process, live or exited"""
+        if self.directory is None:
+            return self.state()
+        self.write()
+        with open(os.path.join(self.directory, '.lock'), 'w') as lock_file:
+            # One process at a time folds exited processes into retired.json
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            retired_path = os.path.join(self.directory, RETIRED)
+            retired = self._read(retired_path) or {}
+            live = []
+            exited = []
+            for name in os.listdir(self.directory):
+                if not name.endswith('.json') or name == RETIRED:
+                    continue
+                path = os.path.join(self.directory, name)
+                state = self._read(path)
+                if state is None:
+                    continue
+                if _process_exists(name.split('-', 1)[0]):
+                    live.append(state)
+                else:
+                    exited.append((path, state))
+            if exited:
+                retired = merge([retired] + [state for _, state in exited])
+                self._write_file(retired_path, retired)
+                for path, _ in exited:
+                    os.remove(path)
+        return merge([retired] + live)
+
+    def render(self):
+        """Prometheus text exposition format"""
+        lines = []
+        for name, metric in sorted(self.collect().items()):
+            labels = metric["labels"]
+            lines.append(f"# HELP {name} {metric['help']}")
+            lines.append(f"# TYPE {name} {metric['kind']}")
+            for values, value in sorted(metric["series"], key=lambda series: series[0]):
+                if metric["kind"] != 'histogram':
+                    lines.append(f"{name}{_label_text(labels, values)} {_number(value)}")
+                    continue
+                cumulative = 0
+                for bound, count in zip(list(metric["buckets"]) + ['+Inf'], value[:-1]):
+                    cumulative += count
+                    le = f'le="{bound if bound == "+Inf" else _number(float(bound))}"'
+                    lines.append(f"{name}_bucket{_label_text(labels, values, le)} {cumulative}")
+                lines.append(f"{name}_sum{_label_text(labels, values)} {_number(value[-1])}")
+                lines.append(f"{name}_count{_label_text(labels, values)} {cumulative}")
+        return '\n'.join(lines) + '\n'
+
+
+def _process_exists(pid):
+    try:
+        os.kill(int(pid), 0)
+    except ValueError:
+        return False
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+registry = Registry()
+os.register_at_fork(after_in_child=registry._after_fork)
+
+REQUEST_SECONDS = registry.histogram(
+    'http_request_duration_seconds', 'Time until the response headers, by route and status',
+    ('method', 'route', 'status'))
+BACKEND_SECONDS = registry.histogram(
+    'backend_operation_duration_seconds', 'Duration of MongoDB, GCS and filesystem operations',
+    ('backend', 'operation'))
+BACKEND_ERRORS = registry.counter(
+    'backend_operation_errors_total', 'MongoDB, GCS and filesystem operations that raised',
+    ('backend', 'operation'))
+CACHE_REQUESTS = registry.counter(
+    'cache_requests_total', 'Cache lookups by result (hit or miss)', ('cache', 'result'))
+ADMISSION_WAIT_SECONDS = registry.histogram(
+    'admission_wait_seconds', 'Time heavy requests waited for a slot (see admission.py)', ('pool',))
+COALESCED_CALLS = registry.counter(
+    'singleflight_calls_total', 'Coalesced computations, by whether the call ran it (leader) or shared '
+    'the result of one in flight (shared)', ('group', 'result'))
+ADMISSION_REJECTIONS = registry.counter(
+    'admission_rejections_total', 'Heavy requests rejected with 429, by reason (queue_full or timeout)',
+    ('pool', 'reason'))
+
+
+class timed:
+    """Record the duration of the enclosed block as one backend operation,
+    and as a span of the current trace (with attributes, e.g. file=...)"""
+    __slots__ = ('backend', 'operation', 'started', 'span')
+
+    def __init__(self, backend, operation, **attributes):
+        self.backend = backend
+        self.operation = operation
+        self.span = tracing.span(f"{backend}.{operation}", **attributes)
+
+    def __enter__(self):
+        self.span.start()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        BACKEND_SECONDS.observe(time.perf_counter() - self.started, self.backend, self.operation)
+        if exc_type is not None and issubclass(exc_type, Exception):
+            BACKEND_ERRORS.inc(self.backend, self.operation)
+        self.span.end(f"{exc_type.__name__}: {exc}" if exc_type is not None else None)
+        return False
+
+
+def timed_iter(iterable, backend, operation):
+    """Yield from iterable (e.g. a GCS listing), recording the time spent fetching
+    items, but not consuming them, as one backend operation"""
+    iterator = iter(iterable)
+    elapsed = 0.0
+    # Not made the current span: the consumer runs between items
+    span = tracing.span(f"{backend}.{operation}")
+    try:
+        while True:
+            started = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                elapsed += time.perf_counter() - started
+                return
+            except Exception as e:
+                elapsed += time.perf_counter() - started
+                BACKEND_ERRORS.inc(backend, operation)
+                span.end(f"{type(e).__name__}: {e}")
+                raise
+            elapsed += time.perf_counter() - started
+            yield item
+    finally:
+        BACKEND_SECONDS.observe(elapsed, backend, operation)
+        span.set('fetchMs', round(elapsed * 1000, 3))
+        span.end()
+
+
+def record_backend(backend, operation, seconds, failed=False, **attributes):
+    """Record an operation timed elsewhere (e.g. by the MongoDB driver)"""
+    BACKEND_SECONDS.observe(seconds, backend, operation)
+    if failed:
+        BACKEND_ERRORS.inc(backend, operation)
+    tracing.record_span(f"{backend}.{operation}", seconds, 'failed' if failed else None, **attributes)
+
+
+def cache_result(cache, hit, count=1):
+    """Count lookups in a cache; returns hit so it can wrap the test"""
+    CACHE_REQUESTS.inc(cache, 'hit' if hit else 'miss', amount=count)
+    return hit
+
+
+def observe_request(method, route, status, seconds):
+    REQUEST_SECONDS.observe(seconds, method, route, str(status))
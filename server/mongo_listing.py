@@ -0,0 +1,186 @@
+"""
+Icon listing from MongoDB, for workers that share no disk.
+
+The icons of a provider come from one projected find, sorted by category and
+display name, that the provider_category_displayName index answers on its
+own (its keys hold every projected field, so no document is fetched):
+
+    {"provider": provider}, {"_id": 0, "category": 1, "displayName": 1, "filename": 1, "storage": 1}
+
+Category counts are kept in the category_counts collection, one document
+per (provider, category), which uploads and deletes adjust with $inc as they
+add, move or remove icon records (apply_counts, delete_records). Changes to
+many icons at once (a reconciliation, a category refresh, a delete of all
+icons) recount instead, with a $group aggregation over the icons
+(repair_counts); the same recount runs in one worker every
+ICON_COUNTS_MAX_AGE seconds to repair drift from writes made outside the
+server or increments that raced a recount. Counts read from category_counts
+are cached per provider along with the catalog version, a counter in
+catalog_versions that is bumped (bump_version) whenever icons change; a
+listing reads the version, one small find_one, and reuses the counts while it
+is unchanged. Concurrent reads of a provider's counts share one query.
+
+Shaped like the snapshot listing (see catalog_snapshot.py); upload.py falls
+back to the snapshot when MongoDB is unavailable.
+"""
+
+import os
+import time
+import logging
+import threading
+
+from pymongo import ASCENDING, UpdateOne, DeleteMany
+from pymongo.errors import DuplicateKeyError
+
+from icon_catalog import DEFAULT_CATEGORY
+from catalog_snapshot import listing_display_name
+from metrics import cache_result
+from singleflight import Group
+
+logger = logging.getLogger(__name__)
+
+COUNTS_MAX_AGE = float(os.environ.get('ICON_COUNTS_MAX_AGE', 300))
+
+VERSION_ID = "icons"
+PROJECTION = {"_id": 0, "category": 1, "displayName": 1, "filename": 1, "storage": 1}
+SORT = [("category", ASCENDING), ("displayName", ASCENDING), ("filename", ASCENDING)]
+
+
+def bump_version(db):
+    """Record that icons changed so every worker recounts categories.
+    Returns motor's future when db is a motor database."""
+    return db.catalog_versions.update_one(
+        {"_id": VERSION_ID}, {"$inc": {"version": 1}, "$set": {"updatedAt": time.time()}}, upsert=True)
+
+
+def catalog_version(db):
+    doc = db.catalog_versions.find_one({"_id": VERSION_ID}, {"version": 1})
+    return doc["version"] if doc else 0
+
+
+def count_updates(deltas):
+    """category_counts updates for {(provider, category): change in icon count}"""
+    return [UpdateOne({"provider": provider, "category": category}, {"$inc": {"count": change}}, upsert=True)
+            for (provider, category), change in deltas.items() if change]
+
+
+def apply_counts(db, deltas):
+    """Adjust category_counts by {(provider, category): change in icon count}"""
+    updates = count_updates(deltas)
+    if updates:
+        db.category_counts.bulk_write(updates, ordered=False)
+
+
+def delete_records(db, ids):
+    """Delete icon records by _id and take them off category_counts; returns how many were deleted"""
+    deltas = {}
+    found = list(db.icons.find({"_id": {"$in": ids}}, {"provider": 1, "category": 1}))
+    for doc in found:
+        key = (doc.get("provider"), doc.get("category") or DEFAULT_CATEGORY)
+        deltas[key] = deltas.get(key, 0) - 1
+    deleted = db.icons.delete_many({"_id": {"$in": [doc["_id"] for doc in found]}}).deleted_count
+    apply_counts(db, deltas)
+    if deleted != len(found):
+        # Some were deleted concurrently, maybe counted off twice: recount at the next read
+        request_repair(db)
+    return deleted
+
+
+def stored_counts(db, provider):
+    """[(category, icon count)] for a provider from category_counts, sorted by category"""
+    cursor = db.category_counts.find({"provider": provider, "count": {"$gt": 0}},
+                                     {"_id": 0, "category": 1, "count": 1}).sort("category", ASCENDING)
+    return [(doc["category"], doc["count"]) for doc in cursor]
+
+
+def count_categories(db):
+    """{(provider, category): icon count} for every provider, counted from the icons"""
+    counts = {}
+    pipeline = [{"$group": {"_id": {"provider": "$provider", "category": "$category"}, "count": {"$sum": 1}}}]
+    for doc in db.icons.aggregate(pipeline):
+        provider = doc["_id"].get("provider")
+        if provider:
+            key = (provider, doc["_id"].get("category") or DEFAULT_CATEGORY)
+            counts[key] = counts.get(key, 0) + doc["count"]
+    return counts
+
+
+def repair_counts(db):
+    """Replace category_counts with a recount of the icons and bump the catalog version"""
+    counts = count_categories(db)
+    updates = [UpdateOne({"provider": provider, "category": category}, {"$set": {"count": count}}, upsert=True)
+               for (provider, category), count in counts.items()]
+    stale = [doc["_id"] for doc in db.category_counts.find({}, {"provider": 1, "category": 1})
+             if (doc.get("provider"), doc.get("category")) not in counts]
+    if stale:
+        updates.append(DeleteMany({"_id": {"$in": stale}}))
+    if updates:
+        db.category_counts.bulk_write(updates, ordered=False)
+    db.catalog_versions.update_one({"_id": VERSION_ID}, {"$set": {"repairedAt": time.time()}}, upsert=True)
+    bump_version(db)
+    logger.info(f"Recounted icon categories: {len(counts)} categories, {sum(counts.values())} icons")
+    return counts
+
+
+def request_repair(db):
+    """Make the next counts read recount (see repair_due)"""
+    db.catalog_versions.update_one({"_id": VERSION_ID}, {"$set": {"repairedAt": 0}}, upsert=True)
+
+
+def repair_due(db, max_age):
+    """Claim the periodic recount: True for one worker once the last one is max_age seconds old"""
+    now = time.time()
+    try:
+        result = db.catalog_versions.update_one(
+            {"_id": VERSION_ID, "repairedAt": {"$not": {"$gt": now - max_age}}},
+            {"$set": {"repairedAt": now}}, upsert=True)
+    except DuplicateKeyError:
+        # Recounted recently: the filter missed the existing document
+        return False
+    return result.modified_count > 0 or result.upserted_id is not None
+
+
+class CategoryCounts:
+    """Category counts per provider, kept while the catalog version is unchanged"""
+
+    def __init__(self, max_age=COUNTS_MAX_AGE):
+        self.max_age = max_age
+        self._counts = {}
+        self._lock = threading.Lock()
+        self._reads = Group('icon_counts')
+
+    def get(self, db, provider, version):
+        with self._lock:
+            cached = self._counts.get(provider)
+        if cache_result('icon_counts', cached is not None and cached[0] == version and
+                        time.monotonic() - cached[1] < self.max_age):
+            return cached[2]
+        return self._reads.do((provider, version), self._read, db, provider, version)
+
+    def _read(self, db, provider, version):
+        if repair_due(db, self.max_age):
+            repair_counts(db)
+        categories = stored_counts(db, provider)
+        with self._lock:
+            self._counts[provider] = (version, time.monotonic(), categories)
+        return categories
+
+    def clear(self):
+        with self._lock:
+            self._counts.clear()
+
+
+category_counts = CategoryCounts()
+
+
+def listing(db, provider):
+    """The catalog version, [(category, count)] and an iterator of (category, filename, display name, in GCS)"""
+    version = catalog_version(db)
+    categories = category_counts.get(db, provider, version)
+
+    def icons():
+        for doc in db.icons.find({"provider": provider}, PROJECTION).sort(SORT):
+            filename = doc["filename"]
+            yield (doc.get("category") or DEFAULT_CATEGORY, filename,
+                   doc.get("displayName") or listing_display_name(filename), doc.get("storage") == "cloud")
+    return version, categories, icons()
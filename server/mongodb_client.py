@@ -2,20 +2,32 @@
 MongoDB Atlas client for Azure Diagram Maker.
 This module provides a connection to MongoDB Atlas and methods to interact with the database.
 
+A single pooled client is shared by the whole process. It is created on
+first use rather than at import, and no ping is sent: the pool connects in
+the background. Request handlers check mongodb_available() before trying
+MongoDB and report availability errors to mongo_breaker, which sends them
+straight to their local fallback while Atlas is down (see circuit_breaker.py).
+
+The ASGI app (asgi.py) uses a motor client with the same options from
+get_async_db(); it is created on first use in the serving event loop and
+shares the circuit breaker.
+
 Note: Authentication to MongoDB Atlas is currently failing with error code 18 (AuthenticationFailed).
 The application will fall back to local JSON storage until MongoDB credentials can be fixed.
 """
 
 import os
+import asyncio
 import logging
+import threading
 import traceback
 from dotenv import load_dotenv
-from pymongo import MongoClient
+from pymongo import MongoClient, monitoring
+from pymongo.errors import ConfigurationError, ConnectionFailure, ExecutionTimeout, OperationFailure
 from pymongo.server_api import ServerApi
+from mongodb_schema import query_monitor
+from circuit_breaker import CircuitBreaker
 
-# Configure logging
-logging.basicConfig(level=logging.INFO,
-                   format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 # Load environment variables from .env file
@@ -42,47 +54,132 @@ logger.info(f"Connecting to MongoDB: {masked_uri}")
 DB_NAME = os.environ.get('MONGO_DB_NAME', 'azure_diagram_maker')
 logger.info(f"Using database: {DB_NAME}")
 
-# Global MongoDB client instance
+# Connection pool and timeouts. Server selection is kept short: with the
+# circuit breaker below, a failing Atlas costs a few requests this long
+# before requests go straight to the local fallback.
+POOL_OPTIONS = {
+    "maxPoolSize": int(os.environ.get('MONGO_MAX_POOL_SIZE', 50)),
+    "minPoolSize": int(os.environ.get('MONGO_MIN_POOL_SIZE', 0)),
+    "maxIdleTimeMS": int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 300000)),
+    "waitQueueTimeoutMS": int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 5000)),
+    "connectTimeoutMS": int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 5000)),
+    "serverSelectionTimeoutMS": int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 5000)),
+    "socketTimeoutMS": int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 30000)),
+}
+
+# Shared MongoDB client, created on first use
 mongo_client = None
 mongodb_initialized = False
 db = None
+_client_lock = threading.Lock()
+
+# motor client for the ASGI app, bound to the event loop it was created in
+async_client = None
+_async_loop = None
+
+
+def is_availability_error(error):
+    """Whether an error means MongoDB is unreachable (rather than a bad request)"""
+    if isinstance(error, (ConnectionFailure, ExecutionTimeout, ConfigurationError)):
+        return True
+    # AuthenticationFailed
+    return isinstance(error, OperationFailure) and error.code == 18
+
+
+class _SuccessListener(monitoring.CommandListener):
+    """Resets the breaker's failure count whenever a command succeeds"""
+
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        mongo_breaker.record_success()
+
+    def failed(self, event):
+        pass
+
+
+def client_options():
+    """Keyword arguments for MongoClient (and motor's client): API version, listeners, pool"""
+    return dict(server_api=ServerApi('1'), event_listeners=[query_monitor, _SuccessListener()], **POOL_OPTIONS)
+
 
 def initialize_mongodb():
-    """Initialize MongoDB client and test connection"""
+    """Create the shared MongoDB client. Connections are opened lazily by the pool."""
     global mongo_client, mongodb_initialized, db
     
-    try:
-        # Connect to MongoDB Atlas
-        mongo_client = MongoClient(MONGO_URI, server_api=ServerApi('1'))
-        
-        # Test connection
-        logger.info("Sending ping command...")
-        mongo_client.admin.command('ping')
-        
-        # Set the database
-        db = mongo_client[DB_NAME]
-        
-        # Mark as initialized
-        mongodb_initialized = True
-        logger.info("Successfully connected to MongoDB Atlas")
-        
-        return db
-    except Exception as e:
-        logger.error(f"Failed to connect to MongoDB Atlas: {str(e)}")
-        logger.error(f"Stack trace: {traceback.format_exc()}")
-        logger.warning("MongoDB initialization failed, will use local/GCS storage only")
+    with _client_lock:
+        if db is not None:
+            return db
+        try:
+            mongo_client = MongoClient(MONGO_URI, **client_options())
+            db = mongo_client[DB_NAME]
+            mongodb_initialized = True
+            logger.info(f"MongoDB client created (pool size {POOL_OPTIONS['maxPoolSize']})")
+            return db
+        except Exception as e:
+            logger.error(f"Failed to create MongoDB client: {str(e)}")
+            logger.error(f"Stack trace: {traceback.format_exc()}")
+            mongodb_initialized = False
+            db = None
+            mongo_breaker.record_failure(e)
+            return None
+
+def ping():
+    """Round trip to MongoDB; raises if it is unreachable"""
+    database = db if db is not None else initialize_mongodb()
+    if database is None:
+        raise ConnectionFailure("MongoDB client could not be created")
+    mongo_client.admin.command('ping')
+
+def get_db():
+    """Get the MongoDB database instance, creating the client on first use"""
+    if db is None and mongo_breaker.allow():
+        return initialize_mongodb()
+    return db
+
+def mongodb_available():
+    """Whether MongoDB should be tried now: the client exists and the circuit is closed"""
+    return mongo_breaker.allow() and get_db() is not None
+
+def close_mongodb():
+    """Close the shared client's connections (on shutdown)"""
+    global mongo_client, mongodb_initialized, db
+    with _client_lock:
+        if mongo_client is not None:
+            mongo_client.close()
+            logger.info("MongoDB client closed")
+        mongo_client = None
         mongodb_initialized = False
         db = None
+
+def get_async_db():
+    """Get the motor database for the running event loop, or None while the circuit is open"""
+    global async_client, _async_loop
+    # Imported here: only the ASGI app needs motor
+    from motor.motor_asyncio import AsyncIOMotorClient
+    if not mongo_breaker.allow():
         return None
+    loop = asyncio.get_running_loop()
+    if async_client is None or _async_loop is not loop:
+        try:
+            async_client = AsyncIOMotorClient(MONGO_URI, **client_options())
+            _async_loop = loop
+            logger.info(f"Async MongoDB client created (pool size {POOL_OPTIONS['maxPoolSize']})")
+        except Exception as e:
+            logger.error(f"Failed to create async MongoDB client: {str(e)}")
+            mongo_breaker.record_failure(e)
+            return None
+    return async_client[DB_NAME]
 
-def get_db():
-    """Get the MongoDB database instance"""
-    global db, mongodb_initialized
-    
-    if db is None:
-        db = initialize_mongodb()
-    
-    return db
+def close_async_mongodb():
+    """Close the motor client's connections (on ASGI shutdown)"""
+    global async_client, _async_loop
+    if async_client is not None:
+        async_client.close()
+        logger.info("Async MongoDB client closed")
+    async_client = None
+    _async_loop = None
 
 def get_collection(collection_name):
     """Get a MongoDB collection"""
@@ -91,13 +188,11 @@ def get_collection(collection_name):
         return None
     return database[collection_name]
 
-# Auto-initialize MongoDB when the module is imported
-db = initialize_mongodb()
-if db is None:
-    logger.warning("MongoDB initialization failed, will use local/GCS storage only")
-    mongodb_initialized = False
-else:
-    mongodb_initialized = True
 
-# Don't auto-initialize on import
-# This will be called explicitly from upload.py 
\ No newline at end of file
+mongo_breaker = CircuitBreaker(
+    "MongoDB",
+    probe=ping,
+    threshold=int(os.environ.get('MONGO_BREAKER_FAILURES', 3)),
+    reset_interval=float(os.environ.get('MONGO_BREAKER_RESET_SECONDS', 30)),
+    is_failure=is_availability_error
+)
@@ -0,0 +1,240 @@
+"""
+MongoDB schema for Azure Diagram Maker.
+
+This module declares the indexes the application's queries rely on, creates
+them idempotently at startup, and records the timing of every command sent to
+MongoDB so slow operations and `explain()` plans for the application's query
+shapes can be reported from an admin endpoint.
+"""
+
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+from pymongo import ASCENDING, DESCENDING, IndexModel
+from pymongo.errors import ConnectionFailure
+from pymongo.monitoring import CommandListener
+
+from metrics import record_backend
+
+logger = logging.getLogger(__name__)
+
+# Commands slower than this are kept in the slow operation log
+SLOW_QUERY_MS = float(os.environ.get('MONGO_SLOW_QUERY_MS', 100))
+SLOW_QUERY_LOG_SIZE = int(os.environ.get('MONGO_SLOW_QUERY_LOG_SIZE', 200))
+
+# Indexes required by the application, per collection
+INDEXES = {
+    "diagrams": [
+        IndexModel([("diagramId", ASCENDING)], name="diagramId_unique", unique=True),
+    ],
+    "diagram_versions": [
+        IndexModel([("diagramId", ASCENDING), ("version", DESCENDING)],
+                   name="diagramId_version_unique", unique=True),
+    ],
+    "icons": [
+        IndexModel([("provider", ASCENDING), ("filename", ASCENDING)],
+                   name="provider_filename_unique", unique=True),
+        # Covers the icon listing (see mongo_listing.py) and queries by provider and category
+        IndexModel([("provider", ASCENDING), ("category", ASCENDING), ("displayName", ASCENDING),
+                    ("filename", ASCENDING), ("storage", ASCENDING)],
+                   name="provider_category_displayName"),
+    ],
+    # Icon counts per category, maintained by uploads and deletes (see mongo_listing.py)
+    "category_counts": [
+        IndexModel([("provider", ASCENDING), ("category", ASCENDING)],
+                   name="provider_category_unique", unique=True),
+    ],
+}
+
+# Query shapes issued by the application, used for explain() reports
+QUERY_SHAPES = [
+    {"name": "diagram by id", "collection": "diagrams",
+     "filter": {"diagramId": ""}, "projection": {"_id": 0}},
+    {"name": "diagram versions range", "collection": "diagram_versions",
+     "filter": {"diagramId": "", "version": {"$gte": 1, "$lte": 1}}, "projection": {"_id": 0}},
+    {"name": "latest diagram version", "collection": "diagram_versions",
+     "filter": {"diagramId": ""}, "projection": {"_id": 0, "version": 1},
+     "sort": [("version", DESCENDING)]},
+    {"name": "icon by provider and filename", "collection": "icons",
+     "filter": {"provider": "azure", "filename": ""}},
+    {"name": "icons by provider and category", "collection": "icons",
+     "filter": {"provider": "azure", "category": "General"}},
+    {"name": "icon listing", "collection": "icons",
+     "filter": {"provider": "azure"},
+     "projection": {"_id": 0, "category": 1, "displayName": 1, "filename": 1, "storage": 1},
+     "sort": [("category", ASCENDING), ("displayName", ASCENDING), ("filename", ASCENDING)]},
+    {"name": "category counts", "collection": "category_counts",
+     "filter": {"provider": "azure", "count": {"$gt": 0}},
+     "projection": {"_id": 0, "category": 1, "count": 1},
+     "sort": [("category", ASCENDING)]},
+]
+
+# Result of the last ensure_indexes() run, per index name
+index_status = {}
+
+
+def ensure_indexes(db):
+    """Create any missing declared indexes. Safe to call repeatedly."""
+    for collection_name, models in INDEXES.items():
+        collection = db[collection_name]
+        try:
+            existing = collection.index_information()
+        except ConnectionFailure:
+            # MongoDB is unreachable: every other index would wait out the same timeout
+            raise
+        except Exception as e:
+            logger.error(f"Cannot read indexes of {collection_name}: {e}")
+            existing = {}
+
+        for model in models:
+            name = model.document['name']
+            key = f"{collection_name}.{name}"
+            if name in existing:
+                index_status[key] = "exists"
+                continue
+            try:
+                collection.create_indexes([model])
+                index_status[key] = "created"
+                logger.info(f"Created MongoDB index {key}")
+            except Exception as e:
+                # e.g. duplicate values blocking a unique index: report, don't fail startup
+                index_status[key] = f"error: {e}"
+                logger.error(f"Failed to create MongoDB index {key}: {e}")
+    return dict(index_status)
+
+
+def query_shape(value):
+    """Replace the values in a query document with 1, keeping its structure"""
+    if isinstance(value, dict):
+        return {k: query_shape(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [query_shape(v) for v in value[:1]]
+    return 1
+
+
+# Commands whose timings are recorded, and the field holding their filter
+_TIMED_COMMANDS = {
+    "find": "filter",
+    "aggregate": "pipeline",
+    "count": "query",
+    "distinct": "query",
+    "update": "updates",
+    "delete": "deletes",
+    "insert": None,
+    "findAndModify": "query",
+}
+
+
+class QueryMonitor(CommandListener):
+    """Records per-command timings and keeps a log of slow operations"""
+
+    def __init__(self, slow_ms=SLOW_QUERY_MS, log_size=SLOW_QUERY_LOG_SIZE):
+        self.slow_ms = slow_ms
+        self.slow_operations = deque(maxlen=log_size)
+        self.stats = {}
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name not in _TIMED_COMMANDS:
+            return
+        field = _TIMED_COMMANDS[event.command_name]
+        command = event.command
+        shape = query_shape(command.get(field)) if field else None
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (
+                command.get(event.command_name), shape)
+
+    def _finish(self, event, failed):
+        with self._lock:
+            pending = self._pending.pop((event.connection_id, event.request_id), None)
+        record_backend('mongodb', event.command_name, event.duration_micros / 1e6, failed,
+                       collection=pending[0] if pending is not None else None)
+        if pending is None:
+            return
+        collection, shape = pending
+        duration_ms = event.duration_micros / 1000.0
+        key = f"{event.database_name}.{collection}.{event.command_name}"
+
+        with self._lock:
+            stat = self.stats.get(key)
+            if stat is None:
+                stat = self.stats[key] = {"count": 0, "failures": 0, "totalMs": 0.0, "maxMs": 0.0}
+            stat["count"] += 1
+            stat["totalMs"] += duration_ms
+            stat["maxMs"] = max(stat["maxMs"], duration_ms)
+            if failed:
+                stat["failures"] += 1
+
+            if duration_ms >= self.slow_ms:
+                self.slow_operations.append({
+                    "collection": collection,
+                    "command": event.command_name,
+                    "shape": shape,
+                    "durationMs": round(duration_ms, 3),
+                    "failed": failed,
+                    "at": time.time(),
+                })
+
+    def succeeded(self, event):
+        self._finish(event, False)
+
+    def failed(self, event):
+        self._finish(event, True)
+
+    def report(self):
+        """Return aggregated timings and the slow operation log"""
+        with self._lock:
+            stats = [{
+                "operation": key,
+                "count": s["count"],
+                "failures": s["failures"],
+                "avgMs": round(s["totalMs"] / s["count"], 3),
+                "maxMs": round(s["maxMs"], 3),
+            } for key, s in sorted(self.stats.items())]
+            slow = list(self.slow_operations)
+        slow.reverse()
+        return {"slowQueryMs": self.slow_ms, "operations": stats, "slowOperations": slow}
+
+
+# Shared monitor, registered on every MongoClient the application creates
+query_monitor = QueryMonitor()
+
+
+def _plan_stages(plan):
+    """Flatten a winning plan into a list of stage names (with index names)"""
+    stages = []
+    while plan:
+        stage = plan.get("stage", "?")
+        if plan.get("indexName"):
+            stage = f"{stage}({plan['indexName']})"
+        stages.append(stage)
+        plan = plan.get("inputStage") or (plan.get("inputStages") or [None])[0]
+    return stages
+
+
+def explain_query_shapes(db):
+    """Return a summary of the explain() plan of every declared query shape"""
+    results = []
+    for shape in QUERY_SHAPES:
+        try:
+            cursor = db[shape["collection"]].find(shape["filter"], shape.get("projection"))
+            if shape.get("sort"):
+                cursor = cursor.sort(shape["sort"])
+            explanation = cursor.limit(1).explain()
+            planner = explanation.get("queryPlanner", {})
+            stages = _plan_stages(planner.get("winningPlan", {}))
+            results.append({
+                "name": shape["name"],
+                "collection": shape["collection"],
+                "filter": query_shape(shape["filter"]),
+                "winningPlan": stages,
+                "collectionScan": any(s.startswith("COLLSCAN") for s in stages),
+                "covered": any(s.startswith("PROJECTION_COVERED") for s in stages),
+            })
+        except Exception as e:
+            results.append({"name": shape["name"], "collection": shape["collection"], "error": str(e)})
+    return results
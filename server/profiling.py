@@ -0,0 +1,423 @@
+"""
+Profiling of live requests, for slow requests that do not reproduce locally.
+
+On demand: an admin request with `X-Profile: cprofile|sample` (or
+?profile=cprofile|sample) runs under a profiler, and the profile is saved
+under PROFILE_DIR for GET /api/admin/profiles/<id>; its id is returned in
+X-Profile-Id.
+
+    cprofile   deterministic (cProfile), saved as pstats: every call, with
+               counts, but calls get slower (often 2x or more)
+    sample     the request thread's stack every PROFILE_INTERVAL_MS by a
+               separate thread, saved as speedscope JSON (speedscope.app):
+               little overhead, but short calls may not show
+
+Only the request thread is profiled; work handed to other threads (GCS
+replication, the icon snapshot writer) is not.
+
+Continuously: with PROFILE_SAMPLE_HZ > 0, a background thread samples the
+stacks of every thread that is serving a request that many times a second,
+and counts them by route. The counts of every worker process are written to
+PROFILE_DIR/continuous/ every PROFILE_WRITE_SECONDS and summed by
+GET /api/admin/profiles/hot: the functions where each handler spends its
+time, and collapsed stacks for flame graph tools (?format=collapsed).
+"""
+
+import io
+import os
+import re
+import sys
+import json
+import time
+import pstats
+import cProfile
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+MODES = ('cprofile', 'sample')
+PROFILE_INTERVAL_MS = float(os.environ.get('PROFILE_INTERVAL_MS', 1))
+PROFILE_KEEP = int(os.environ.get('PROFILE_KEEP', 50))
+PROFILE_SAMPLE_HZ = float(os.environ.get('PROFILE_SAMPLE_HZ', 0))
+PROFILE_WRITE_SECONDS = float(os.environ.get('PROFILE_WRITE_SECONDS', 30))
+# Distinct (route, stack) pairs kept per process; further new stacks are counted as dropped
+PROFILE_MAX_STACKS = int(os.environ.get('PROFILE_MAX_STACKS', 20000))
+MAX_DEPTH = 128
+
+SERVER_DIR = os.path.dirname(os.path.abspath(__file__))
+PROFILE_ID = re.compile(r'^[0-9a-f]{16}$')
+
+
+def requested_mode(value):
+    """The profiler asked for by an X-Profile header or ?profile= value, if any"""
+    if not value:
+        return None
+    value = value.lower()
+    if value in ('1', 'true'):
+        return 'sample'
+    return value if value in MODES else None
+
+
+def frame_label(code):
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+def stack_of(frame, app_only=False):
+    """Frame labels from the outermost call to frame; app_only drops the callers
+    (server, Flask, werkzeug) above the first frame in this directory"""
+    codes = []
+    while frame is not None and len(codes) < MAX_DEPTH:
+        codes.append(frame.f_code)
+        frame = frame.f_back
+    codes.reverse()
+    if app_only:
+        for index, code in enumerate(codes):
+            if code.co_filename.startswith(SERVER_DIR) and os.path.basename(code.co_filename) != 'profiling.py':
+                codes = codes[index:]
+                break
+    return tuple(frame_label(code) for code in codes)
+
+
+class StackSampler:
+    """Samples one thread's stack from a separate thread"""
+
+    def __init__(self, thread_id, interval):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples = []
+        self.weights = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="profile-sampler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def _run(self):
+        last = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            now = time.perf_counter()
+            if frame is not None:
+                self.samples.append(stack_of(frame))
+                self.weights.append((now - last) * 1000)
+            last = now
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+
+def speedscope(name, samples, weights):
+    """A sampled profile in speedscope's file format"""
+    frames = []
+    index = {}
+    indexed_samples = []
+    for stack in samples:
+        indexed = []
+        for label in stack:
+            if label not in index:
+                index[label] = len(frames)
+                function, _, location = label.rpartition(' (')
+                file, _, line = location.rstrip(')').rpartition(':')
+                frames.append({"name": function, "file": file, "line": int(line)})
+            indexed.append(index[label])
+        indexed_samples.append(indexed)
+    return {
+        "$schema": "https://www.speedscope.app/file-format-schema.json",
+        "shared": {"frames": frames},
+        "profiles": [{
+            "type": "sampled",
+            "name": name,
+            "unit": "milliseconds",
+            "startValue": 0,
+            "endValue": round(sum(weights), 3),
+            "samples": indexed_samples,
+            "weights": [round(weight, 3) for weight in weights],
+        }],
+        "name": name,
+        "activeProfileIndex": 0,
+        "exporter": "azure-diagram-maker profiling.py",
+    }
+
+
+class RequestProfiler:
+    """Profiles the calling thread from start() to stop()"""
+
+    def __init__(self, mode):
+        self.mode = mode
+        self.profile_id = os.urandom(8).hex()
+        self._profile = None
+        self._sampler = None
+        self.started = None
+        self.seconds = None
+
+    def start(self):
+        self.started = time.perf_counter()
+        if self.mode == 'cprofile':
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        else:
+            self._sampler = StackSampler(threading.get_ident(), PROFILE_INTERVAL_MS / 1000)
+            self._sampler.start()
+        return self
+
+    def stop(self):
+        if self._profile is not None:
+            self._profile.disable()
+        else:
+            self._sampler.stop()
+        self.seconds = time.perf_counter() - self.started
+
+    def save(self, directory, **details):
+        """Write the profile and its details (method, path, status...) to directory"""
+        os.makedirs(directory, exist_ok=True)
+        name = f"{details.get('method', '')} {details.get('path', '')}".strip()
+        if self._profile is not None:
+            file = f"{self.profile_id}.pstats"
+            self._profile.dump_stats(os.path.join(directory, file))
+            top = _top_functions(pstats.Stats(self._profile))
+        else:
+            file = f"{self.profile_id}.speedscope.json"
+            with open(os.path.join(directory, file), 'w') as f:
+                json.dump(speedscope(name, self._sampler.samples, self._sampler.weights), f,
+                          separators=(',', ':'))
+            top = _top_sampled(self._sampler.samples)
+        record = dict(details, profileId=self.profile_id, mode=self.mode, file=file,
+                      durationMs=round(self.seconds * 1000, 1), createdAt=time.time(), top=top)
+        with open(os.path.join(directory, f"{self.profile_id}.json"), 'w') as f:
+            json.dump(record, f)
+        _prune(directory)
+        logger.info(f"Saved {self.mode} profile {self.profile_id} of {name} ({record['durationMs']} ms)")
+        return record
+
+
+def _top_functions(stats, limit=10):
+    """The functions with the most cumulative time in pstats.Stats"""
+    rows = []
+    for (file, line, function), (_, calls, own, cumulative, _) in stats.stats.items():
+        rows.append({"function": f"{function} ({os.path.basename(file)}:{line})", "calls": calls,
+                     "ownMs": round(own * 1000, 3), "cumulativeMs": round(cumulative * 1000, 3)})
+    rows.sort(key=lambda row: row["cumulativeMs"], reverse=True)
+    return rows[:limit]
+
+
+def _top_sampled(samples, limit=10):
+    """The frames at the top of the most samples"""
+    counts = {}
+    for stack in samples:
+        if stack:
+            counts[stack[-1]] = counts.get(stack[-1], 0) + 1
+    top = sorted(counts.items(), key=lambda item: item[1], reverse=True)[:limit]
+    return [{"function": label, "samples": count} for label, count in top]
+
+
+def _prune(directory):
+    records = sorted(list_profiles(directory), key=lambda record: record["createdAt"], reverse=True)
+    for record in records[PROFILE_KEEP:]:
+        for name in (record["file"], f"{record['profileId']}.json"):
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+
+
+def list_profiles(directory):
+    """Details of the saved profiles, newest first"""
+    records = []
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return records
+    for name in names:
+        if PROFILE_ID.match(name[:-5]) and name.endswith('.json'):
+            try:
+                with open(os.path.join(directory, name)) as f:
+                    records.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+    records.sort(key=lambda record: record["createdAt"], reverse=True)
+    return records
+
+
+def find_profile(directory, profile_id):
+    """(details, path of the profile file), or None"""
+    if not PROFILE_ID.match(profile_id):
+        return None
+    try:
+        with open(os.path.join(directory, f"{profile_id}.json")) as f:
+            record = json.load(f)
+    except (OSError, ValueError):
+        return None
+    path = os.path.join(directory, record["file"])
+    return (record, path) if os.path.exists(path) else None
+
+
+def pstats_text(path, sort='cumulative', limit=60):
+    """pstats' text report of a saved cProfile profile"""
+    output = io.StringIO()
+    pstats.Stats(path, stream=output).strip_dirs().sort_stats(sort).print_stats(limit)
+    return output.getvalue()
+
+
+# Continuous sampling
+
+class ContinuousSampler:
+    """Counts the stacks of threads serving requests, by route"""
+
+    def __init__(self):
+        self.hz = 0
+        self.directory = None
+        self.active = {}
+        self.stacks = {}
+        self.samples = 0
+        self.dropped = 0
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def start(self, directory, hz=PROFILE_SAMPLE_HZ, write_seconds=PROFILE_WRITE_SECONDS):
+        self.directory = directory
+        if hz <= 0 or self._thread is not None:
+            return
+        self.hz = hz
+        os.makedirs(directory, exist_ok=True)
+        self._thread = threading.Thread(target=self._run, args=(write_seconds,),
+                                        name="profile-continuous", daemon=True)
+        self._thread.start()
+        logger.info(f"Sampling request stacks {hz} times a second")
+
+    def enter(self, route):
+        """Mark the calling thread as serving route"""
+        if self._thread is not None:
+            self.active[threading.get_ident()] = route
+
+    def leave(self):
+        if self._thread is not None:
+            self.active.pop(threading.get_ident(), None)
+
+    def sample(self):
+        frames = sys._current_frames()
+        with self._lock:
+            for thread_id, route in list(self.active.items()):
+                frame = frames.get(thread_id)
+                if frame is None:
+                    continue
+                key = (route, stack_of(frame, app_only=True))
+                if key in self.stacks:
+                    self.stacks[key] += 1
+                elif len(self.stacks) < PROFILE_MAX_STACKS:
+                    self.stacks[key] = 1
+                else:
+                    self.dropped += 1
+                self.samples += 1
+
+    def _run(self, write_seconds):
+        interval = 1 / self.hz
+        last_write = time.monotonic()
+        while True:
+            time.sleep(interval)
+            try:
+                self.sample()
+                if time.monotonic() - last_write >= write_seconds:
+                    self.write()
+                    last_write = time.monotonic()
+            except Exception as e:
+                logger.error(f"Error sampling request stacks: {e}")
+
+    def state(self):
+        with self._lock:
+            return {"hz": self.hz, "samples": self.samples, "dropped": self.dropped,
+                    "stacks": [[route, list(stack), count] for (route, stack), count in self.stacks.items()]}
+
+    def write(self):
+        """Write this process's counts for the report of any worker"""
+        if self.directory is None or self._thread is None:
+            return
+        path = os.path.join(self.directory, f"{os.getpid()}-{int(self.started_at * 1000)}.json")
+        temp_path = f"{path}.tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self.state(), f, separators=(',', ':'))
+        os.replace(temp_path, path)
+
+    def reset(self):
+        """Forget the counts of every process"""
+        with self._lock:
+            self.stacks = {}
+            self.samples = 0
+            self.dropped = 0
+        if self.directory is not None and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if name.endswith('.json'):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except OSError:
+                        pass
+
+    def _after_fork(self):
+        self.active = {}
+        self.stacks = {}
+        self.samples = 0
+        self.dropped = 0
+        self.started_at = time.time()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def collect(self):
+        """Summed {(route, stack): count} and sample totals of every process"""
+        self.write()
+        stacks = {}
+        totals = {"samples": 0, "dropped": 0, "processes": 0}
+        states = []
+        if self.directory is not None and os.path.isdir(self.directory):
+            for name in os.listdir(self.directory):
+                if not name.endswith('.json'):
+                    continue
+                try:
+                    with open(os.path.join(self.directory, name)) as f:
+                        states.append(json.load(f))
+                except (OSError, ValueError):
+                    continue
+        if not states:
+            states = [self.state()]
+        for state in states:
+            totals["processes"] += 1
+            totals["samples"] += state["samples"]
+            totals["dropped"] += state["dropped"]
+            for route, stack, count in state["stacks"]:
+                key = (route, tuple(stack))
+                stacks[key] = stacks.get(key, 0) + count
+        return stacks, totals
+
+    def report(self, route=None, limit=20):
+        """Per route: samples, and the functions with the most self and inclusive samples"""
+        stacks, totals = self.collect()
+        routes = {}
+        for (stack_route, stack), count in stacks.items():
+            if route is not None and stack_route != route:
+                continue
+            entry = routes.setdefault(stack_route, {"route": stack_route, "samples": 0, "self": {}, "inclusive": {}})
+            entry["samples"] += count
+            if stack:
+                entry["self"][stack[-1]] = entry["self"].get(stack[-1], 0) + count
+            for label in set(stack):
+                entry["inclusive"][label] = entry["inclusive"].get(label, 0) + count
+        result = []
+        for entry in sorted(routes.values(), key=lambda entry: entry["samples"], reverse=True):
+            for kind in ("self", "inclusive"):
+                top = sorted(entry[kind].items(), key=lambda item: item[1], reverse=True)[:limit]
+                entry[kind] = [{"function": label, "samples": count,
+                                "percent": round(count * 100 / entry["samples"], 1)} for label, count in top]
+            result.append(entry)
+        return dict(totals, hz=self.hz, routes=result)
+
+    def collapsed(self, route=None):
+        """Stacks as 'route;outer;...;inner count' lines (flamegraph.pl, speedscope)"""
+        stacks, _ = self.collect()
+        lines = [f"{stack_route};{';'.join(stack)} {count}" for (stack_route, stack), count in stacks.items()
+                 if route is None or stack_route == route]
+        return '\n'.join(sorted(lines)) + '\n'
+
+
+sampler = ContinuousSampler()
+os.register_at_fork(after_in_child=sampler._after_fork)
@@ -0,0 +1,379 @@
+"""
+Three-way reconciliation of icon state across local disk, GCS and MongoDB.
+
+Each store is read once into a manifest of (key, info) pairs sorted by key,
+where the key is the icon's relative path "provider/category/filename":
+
+- local: one directory scan (sorted in memory; only names and sizes are kept)
+- GCS: one list_blobs call, streamed in the server's (byte-wise) name order
+- MongoDB: one projected aggregation sorted by the same key on the server
+
+The manifests are combined with a streaming merge, so the three stores are
+compared row by row without loading GCS or MongoDB into memory. Repairs:
+
+- upload: local file missing from GCS or with a different size (local wins)
+- copy: GCS object missing locally is downloaded
+- upsert: file present but its MongoDB record is missing or not pointing at GCS
+- delete: MongoDB record whose file exists nowhere, or a duplicate record
+  of an icon (left when the provider_filename_unique index could not be
+  built); the record pointing at GCS is kept
+
+MongoDB records are unique per (provider, filename), so an icon file found
+in two categories of a provider cannot have a record for each: records are
+not created for it and its keys are reported as conflicts.
+Objects with replication operations still queued are skipped. Repairs are
+applied in bulk (thread pools for transfers, bulk_write for MongoDB); with
+dry_run=True only the report is produced.
+
+Icons stored with the legacy flat layout (provider/filename) are not
+reconciled and are counted as skipped.
+"""
+
+import os
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from pymongo import UpdateOne
+
+from icon_catalog import GCS_PREFIX, display_name_for
+from metrics import timed, timed_iter
+
+logger = logging.getLogger(__name__)
+
+UPLOAD = 'upload'
+COPY = 'copy'
+UPSERT = 'upsert'
+DELETE = 'delete'
+ACTIONS = (UPLOAD, COPY, UPSERT, DELETE)
+
+RECONCILE_WORKERS = int(os.environ.get('RECONCILE_WORKERS', 16))
+MONGO_BATCH_SIZE = 1000
+# Keys listed per action in a report
+REPORT_SAMPLE_SIZE = 50
+
+LOCAL_URL_BASE = "http://localhost:8080/cloudicons"
+
+
+def split_key(key):
+    """Return (provider, category, filename) for a manifest key"""
+    provider, rest = key.split('/', 1)
+    category, filename = rest.rsplit('/', 1)
+    return provider, category, filename
+
+
+def is_icon_key(key):
+    return key.count('/') >= 2 and key.lower().endswith('.svg')
+
+
+def local_manifest(root):
+    """Sorted (key, {"path", "size"}) for every icon file under root"""
+    rows = []
+    if not os.path.isdir(root):
+        return rows
+    for provider in os.listdir(root):
+        provider_dir = os.path.join(root, provider)
+        if not os.path.isdir(provider_dir):
+            continue
+        for directory, _, files in os.walk(provider_dir):
+            for file in files:
+                path = os.path.join(directory, file)
+                key = os.path.relpath(path, root).replace(os.sep, '/')
+                if file.lower().endswith('.svg'):
+                    rows.append((key, {"path": path, "size": os.path.getsize(path)}))
+    rows.sort(key=lambda row: row[0])
+    return rows
+
+
+def gcs_manifest(client, bucket_name, prefix=GCS_PREFIX):
+    """(key, {"name", "size"}) for every object under prefix, in listing order"""
+    blobs = client.list_blobs(bucket_name, prefix=prefix, fields="items(name,size),nextPageToken")
+    for blob in timed_iter(blobs, 'gcs', 'list'):
+        key = blob.name[len(prefix):]
+        if key and not key.endswith('/'):
+            yield key, {"name": blob.name, "size": int(blob.size) if blob.size is not None else None}
+
+
+def mongo_manifest(db):
+    """(key, document) for every icon record, sorted by key on the server"""
+    pipeline = [
+        {"$match": {"provider": {"$type": "string"}, "category": {"$type": "string"},
+                    "filename": {"$type": "string"}}},
+        {"$project": {"provider": 1, "category": 1, "filename": 1, "storage": 1, "url": 1,
+                      "key": {"$concat": ["$provider", "/", "$category", "/", "$filename"]}}},
+        {"$sort": {"key": 1}},
+    ]
+    for doc in db.icons.aggregate(pipeline, allowDiskUse=True):
+        yield doc.pop("key"), doc
+
+
+def merge_manifests(*manifests):
+    """Merge sorted manifests, yielding (key, [info or None for each manifest], extras).
+
+    A manifest may list a key more than once (duplicate MongoDB records): the
+    row holds its first info and extras the (manifest index, info) of the rest."""
+    iterators = [iter(manifest) for manifest in manifests]
+    heads = [next(it, None) for it in iterators]
+    while True:
+        keys = [head[0] for head in heads if head is not None]
+        if not keys:
+            return
+        key = min(keys)
+        row = []
+        extras = []
+        for i, head in enumerate(heads):
+            if head is not None and head[0] == key:
+                row.append(head[1])
+                following = next(iterators[i], None)
+                while following is not None and following[0] == key:
+                    extras.append((i, following[1]))
+                    following = next(iterators[i], None)
+                if following is not None and following[0] < key:
+                    raise ValueError(f"Manifest {i} is not sorted: {following[0]!r} after {key!r}")
+                heads[i] = following
+            else:
+                row.append(None)
+        yield key, row, extras
+
+
+class ReconcileReport:
+    """Planned (or applied) repairs per action"""
+
+    def __init__(self, dry_run):
+        self.dry_run = dry_run
+        self.counts = {action: 0 for action in ACTIONS}
+        self.samples = {action: [] for action in ACTIONS}
+        self.applied = {action: 0 for action in ACTIONS}
+        self.errors = []
+        self.scanned = {"local": 0, "gcs": 0, "mongodb": 0}
+        self.skipped = {"pending": 0, "legacy": 0, "conflict": 0}
+        # Keys of icon files found in more than one category of a provider
+        self.conflicts = []
+        self.started = time.time()
+
+    def plan(self, action, key):
+        self.counts[action] += 1
+        if len(self.samples[action]) < REPORT_SAMPLE_SIZE:
+            self.samples[action].append(key)
+
+    def conflict(self, key):
+        self.skipped["conflict"] += 1
+        if len(self.conflicts) < REPORT_SAMPLE_SIZE:
+            self.conflicts.append(key)
+
+    def error(self, message):
+        logger.error(message)
+        if len(self.errors) < REPORT_SAMPLE_SIZE:
+            self.errors.append(message)
+
+    def to_dict(self):
+        return {
+            "dryRun": self.dry_run,
+            "scanned": self.scanned,
+            "planned": self.counts,
+            "applied": self.applied,
+            "skipped": self.skipped,
+            "samples": self.samples,
+            "conflicts": self.conflicts,
+            "errors": self.errors,
+            "seconds": round(time.time() - self.started, 3),
+        }
+
+
+def icon_document(key, in_gcs, bucket_name):
+    """MongoDB record for an icon, matching the fields written on upload"""
+    provider, category, filename = split_key(key)
+    return {
+        "filename": filename,
+        "provider": provider,
+        "category": category,
+        "displayName": display_name_for(filename),
+        "path": f"/cloudicons/{key}",
+        "storage": "cloud" if in_gcs else "local",
+        "url": (f"https://storage.googleapis.com/{bucket_name}/{GCS_PREFIX}{key}" if in_gcs
+                else f"{LOCAL_URL_BASE}/{key}"),
+        "updatedAt": time.time(),
+    }
+
+
+def plan(rows, report, bucket_name=None, pending=frozenset(), use_gcs=True, use_mongo=True):
+    """Turn merged manifest rows into repair operations.
+
+    Upserts are (_id of the icon's record or None, document)."""
+    uploads, copies, upserts, deletes, delete_candidates = [], [], [], [], []
+    # Category of every (provider, filename) with a file somewhere, since MongoDB
+    # records are unique per (provider, filename) across categories
+    file_names = {}
+    # (provider, filename) with files in more than one category
+    conflicts = set()
+
+    for key, (local, gcs, mongo), extras in rows:
+        report.scanned["local"] += local is not None
+        report.scanned["gcs"] += gcs is not None
+        report.scanned["mongodb"] += (mongo is not None) + sum(1 for i, _ in extras if i == 2)
+        if not is_icon_key(key):
+            report.skipped["legacy"] += 1
+            continue
+        if use_gcs and GCS_PREFIX + key in pending:
+            report.skipped["pending"] += 1
+            continue
+
+        provider, category, filename = split_key(key)
+        in_gcs = gcs is not None
+        if local is not None or gcs is not None:
+            if file_names.setdefault((provider, filename), category) != category:
+                conflicts.add((provider, filename))
+
+        records = [mongo] + [info for i, info in extras if i == 2] if mongo is not None else []
+        if use_mongo and len(records) > 1:
+            # Duplicate records of the icon: keep one, preferring the one pointing at GCS
+            records.sort(key=lambda doc: doc.get("storage") != "cloud")
+            mongo = records[0]
+            for duplicate in records[1:]:
+                report.plan(DELETE, key)
+                deletes.append(duplicate["_id"])
+
+        if use_gcs and local is not None and (gcs is None or
+                                               (gcs["size"] is not None and gcs["size"] != local["size"])):
+            report.plan(UPLOAD, key)
+            uploads.append((key, local["path"]))
+        if use_gcs and local is None and gcs is not None:
+            report.plan(COPY, key)
+            copies.append((key, gcs["name"]))
+
+        if use_mongo and (local is not None or gcs is not None):
+            if mongo is None or (in_gcs and mongo.get("storage") != "cloud"):
+                upserts.append((key, mongo["_id"] if mongo is not None else None,
+                                icon_document(key, in_gcs, bucket_name)))
+        elif use_mongo and mongo is not None:
+            delete_candidates.append((key, provider, filename, mongo["_id"]))
+
+    planned_upserts = []
+    for key, mongo_id, doc in upserts:
+        if mongo_id is None and (doc["provider"], doc["filename"]) in conflicts:
+            # Upserting by (provider, filename) would move another category's record here
+            report.conflict(key)
+            continue
+        report.plan(UPSERT, key)
+        planned_upserts.append((mongo_id, doc))
+
+    for key, provider, filename, mongo_id in delete_candidates:
+        # The record belongs to an icon that moved category; its upsert updates it
+        if (provider, filename) in file_names:
+            continue
+        report.plan(DELETE, key)
+        deletes.append(mongo_id)
+    return uploads, copies, planned_upserts, deletes
+
+
+def _batches(items, size):
+    for i in range(0, len(items), size):
+        yield items[i:i + size]
+
+
+def apply_repairs(report, uploads, copies, upserts, deletes, db=None, local_root=None,
+                  client_factory=None, bucket_name=None, enqueue_upload=None, workers=RECONCILE_WORKERS):
+    """Apply planned repairs in bulk"""
+    local = threading.local()
+
+    def thread_bucket():
+        if not hasattr(local, 'bucket'):
+            local.bucket = client_factory().bucket(bucket_name)
+        return local.bucket
+
+    def upload(item):
+        key, path = item
+        if enqueue_upload is not None:
+            enqueue_upload(GCS_PREFIX + key, path)
+        else:
+            with timed('gcs', 'upload'):
+                thread_bucket().blob(GCS_PREFIX + key).upload_from_filename(path, content_type="image/svg+xml")
+
+    def copy(item):
+        key, name = item
+        target = os.path.join(local_root, *key.split('/'))
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        temp_path = target + '.reconcile'
+        with timed('gcs', 'download'):
+            thread_bucket().blob(name).download_to_filename(temp_path)
+        os.replace(temp_path, target)
+
+    uploaded = []
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='reconcile') as executor:
+        for action, fn, items in ((UPLOAD, upload, uploads), (COPY, copy, copies)):
+            for item, future in [(item, executor.submit(fn, item)) for item in items]:
+                try:
+                    future.result()
+                    report.applied[action] += 1
+                    if action == UPLOAD:
+                        uploaded.append(item[0])
+                except Exception as e:
+                    report.error(f"{action} {item[0]} failed: {e}")
+
+    if db is not None:
+        for batch in _batches(upserts, MONGO_BATCH_SIZE):
+            operations = [UpdateOne({"_id": mongo_id} if mongo_id is not None else
+                                    {"provider": doc["provider"], "filename": doc["filename"]},
+                                    {"$set": doc}, upsert=True) for mongo_id, doc in batch]
+            try:
+                result = db.icons.bulk_write(operations, ordered=False)
+                report.applied[UPSERT] += result.upserted_count + result.matched_count
+            except Exception as e:
+                report.error(f"MongoDB upsert batch failed: {e}")
+        if enqueue_upload is None:
+            # Direct uploads are done: point their records at GCS (queued ones
+            # are updated by the replication callback)
+            for batch in _batches(uploaded, MONGO_BATCH_SIZE):
+                operations = []
+                for key in batch:
+                    provider, category, filename = split_key(key)
+                    operations.append(UpdateOne(
+                        {"provider": provider, "category": category, "filename": filename},
+                        {"$set": {"storage": "cloud",
+                                  "url": f"https://storage.googleapis.com/{bucket_name}/{GCS_PREFIX}{key}"}}))
+                try:
+                    db.icons.bulk_write(operations, ordered=False)
+                except Exception as e:
+                    report.error(f"MongoDB storage update batch failed: {e}")
+        for batch in _batches(deletes, MONGO_BATCH_SIZE):
+            try:
+                report.applied[DELETE] += db.icons.delete_many({"_id": {"$in": batch}}).deleted_count
+            except Exception as e:
+                report.error(f"MongoDB delete batch failed: {e}")
+
+
+def reconcile(local_root, db=None, client_factory=None, bucket_name=None, dry_run=True,
+              enqueue_upload=None, pending_objects=None, job=None):
+    """Compare local disk, GCS and MongoDB and repair the differences.
+
+    client_factory() returns a GCS client (None disables GCS); enqueue_upload
+    (object_name, path), when given, replaces direct uploads (e.g. to go
+    through the replication queue); pending_objects() returns the object names
+    with replication still in progress.
+    """
+    report = ReconcileReport(dry_run)
+    use_gcs = client_factory is not None
+    use_mongo = db is not None
+
+    pending = pending_objects() if pending_objects is not None else frozenset()
+    with timed('filesystem', 'scan'):
+        local_rows = local_manifest(local_root)
+    rows = merge_manifests(
+        local_rows,
+        gcs_manifest(client_factory(), bucket_name) if use_gcs else (),
+        mongo_manifest(db) if use_mongo else (),
+    )
+    uploads, copies, upserts, deletes = plan(rows, report, bucket_name, pending, use_gcs, use_mongo)
+    if job is not None:
+        job.set('reconcile', phase='planned', **report.counts)
+    logger.info(f"Reconcile plan ({'dry run' if dry_run else 'applying'}): {report.counts}, "
+                f"scanned {report.scanned}")
+
+    if not dry_run:
+        apply_repairs(report, uploads, copies, upserts, deletes, db, local_root,
+                      client_factory, bucket_name, enqueue_upload)
+        if job is not None:
+            job.set('reconcile', phase='applied', **{f"applied_{k}": v for k, v in report.applied.items()})
+        logger.info(f"Reconcile applied: {report.applied}, {len(report.errors)} errors")
+    return report.to_dict()
@@ -0,0 +1,372 @@
+"""
+Write-behind replication of local icon storage to Google Cloud Storage.
+
+Icon files are written to local storage first and the request returns right
+away; the matching GCS uploads and deletes are recorded in a durable SQLite
+queue and applied by background worker threads.
+
+- Durable: operations survive restarts; in-flight operations are retried.
+- Ordered per object: an operation on an object only starts once every earlier
+  operation on the same object has finished, so an upload followed by a delete
+  can never be applied the other way round.
+- Retries: failed operations are retried with exponential backoff and jitter,
+  up to REPLICATION_MAX_ATTEMPTS, then parked as failed for inspection.
+- Backpressure: enqueue blocks while the queue holds REPLICATION_MAX_DEPTH
+  operations, and raises ReplicationQueueFull if no room frees up in time.
+  The depth is a counter row kept up to date by triggers, so checking it is
+  one lookup, and a blocked enqueue polls it every REPLICATION_FULL_POLL_SECONDS
+  since the room is usually freed by another process's workers.
+- Multi-process: every server process can enqueue, but only the process
+  holding an exclusive lock on `<db>.lock` runs the workers; if it exits,
+  another process takes over. Workers poll every REPLICATION_POLL_SECONDS for
+  operations enqueued by other processes.
+"""
+
+import os
+import time
+import random
+import fcntl
+import sqlite3
+import logging
+import threading
+
+from google.api_core import exceptions
+
+import tracing
+from metrics import timed
+
+logger = logging.getLogger(__name__)
+
+WORKERS = int(os.environ.get('REPLICATION_WORKERS', 4))
+MAX_DEPTH = int(os.environ.get('REPLICATION_MAX_DEPTH', 10000))
+MAX_ATTEMPTS = int(os.environ.get('REPLICATION_MAX_ATTEMPTS', 8))
+ENQUEUE_TIMEOUT = float(os.environ.get('REPLICATION_ENQUEUE_TIMEOUT', 30))
+BACKOFF_BASE = float(os.environ.get('REPLICATION_BACKOFF_BASE', 0.5))
+BACKOFF_MAX = float(os.environ.get('REPLICATION_BACKOFF_MAX', 300))
+POLL_SECONDS = float(os.environ.get('REPLICATION_POLL_SECONDS', 1))
+FULL_POLL_SECONDS = float(os.environ.get('REPLICATION_FULL_POLL_SECONDS', 0.05))
+
+UPLOAD = 'upload'
+DELETE = 'delete'
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS operations (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    object_name TEXT NOT NULL,
+    op TEXT NOT NULL,
+    source_path TEXT,
+    content_type TEXT,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    enqueued_at REAL NOT NULL,
+    next_attempt_at REAL NOT NULL,
+    last_error TEXT
+);
+CREATE INDEX IF NOT EXISTS operations_object ON operations (object_name, state, id);
+CREATE INDEX IF NOT EXISTS operations_state ON operations (state, next_attempt_at);
+
+-- Number of pending and in-flight operations, maintained by the triggers below
+BEGIN IMMEDIATE;
+CREATE TABLE IF NOT EXISTS queue_depth (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    depth INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO queue_depth (id, depth)
+    SELECT 1, COUNT(*) FROM operations WHERE state IN ('pending', 'inflight');
+CREATE TRIGGER IF NOT EXISTS operations_depth_insert AFTER INSERT ON operations
+WHEN NEW.state IN ('pending', 'inflight')
+BEGIN
+    UPDATE queue_depth SET depth = depth + 1 WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS operations_depth_delete AFTER DELETE ON operations
+WHEN OLD.state IN ('pending', 'inflight')
+BEGIN
+    UPDATE queue_depth SET depth = depth - 1 WHERE id = 1;
+END;
+CREATE TRIGGER IF NOT EXISTS operations_depth_update AFTER UPDATE OF state ON operations
+WHEN (OLD.state IN ('pending', 'inflight')) != (NEW.state IN ('pending', 'inflight'))
+BEGIN
+    UPDATE queue_depth SET depth = depth + (NEW.state IN ('pending', 'inflight'))
+                                         - (OLD.state IN ('pending', 'inflight')) WHERE id = 1;
+END;
+COMMIT;
+"""
+
+# The oldest ready operation that is also the oldest unfinished one for its object
+_CLAIM_SQL = """
+SELECT id, object_name, op, source_path, content_type, attempts, enqueued_at
+FROM operations o
+WHERE state = 'pending' AND next_attempt_at <= ?
+  AND id = (SELECT MIN(id) FROM operations
+            WHERE object_name = o.object_name AND state IN ('pending', 'inflight'))
+ORDER BY id
+LIMIT 1
+"""
+
+
+class ReplicationQueueFull(Exception):
+    """Raised when an operation cannot be enqueued because the queue is full"""
+
+
+class ReplicationQueue:
+    """Durable queue of GCS operations applied by background workers"""
+
+    def __init__(self, db_path, bucket, workers=WORKERS, max_depth=MAX_DEPTH,
+                 max_attempts=MAX_ATTEMPTS, on_replicated=None):
+        self.db_path = db_path
+        self.bucket = bucket
+        self.workers = workers
+        self.max_depth = max_depth
+        self.max_attempts = max_attempts
+        self.on_replicated = on_replicated
+
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._threads = []
+        self._stopping = False
+        self._lock_file = None
+        self.completed = 0
+        self.retried = 0
+        self.last_error = None
+        self.last_replicated_at = None
+        self.last_lag_seconds = None
+
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._db = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    # Producer side
+
+    def _depth(self):
+        return self._db.execute("SELECT depth FROM queue_depth WHERE id = 1").fetchone()[0]
+
+    def _insert_if_room(self, op, object_name, source_path, content_type):
+        # IMMEDIATE makes the depth check and the insert one step for every process
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            if self._depth() >= self.max_depth:
+                return False
+            now = time.time()
+            self._db.execute(
+                "INSERT INTO operations (object_name, op, source_path, content_type, enqueued_at, next_attempt_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (object_name, op, source_path, content_type, now, now))
+            return True
+        finally:
+            self._db.execute("COMMIT")
+
+    def enqueue(self, op, object_name, source_path=None, content_type=None, timeout=ENQUEUE_TIMEOUT):
+        """Durably record an operation, blocking while the queue is full"""
+        deadline = time.time() + timeout
+        with self._changed:
+            while not self._insert_if_room(op, object_name, source_path, content_type):
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise ReplicationQueueFull(
+                        f"Replication queue is full ({self.max_depth} operations pending)")
+                # Workers in other processes free room without notifying this one, so poll
+                self._changed.wait(min(remaining, FULL_POLL_SECONDS))
+            self._changed.notify_all()
+
+    def enqueue_upload(self, object_name, source_path, content_type=None):
+        """Replicate a local file to object_name"""
+        self.enqueue(UPLOAD, object_name, source_path, content_type)
+
+    def enqueue_delete(self, object_name):
+        """Replicate the deletion of object_name"""
+        self.enqueue(DELETE, object_name)
+
+    def purge(self, prefix=''):
+        """Drop pending operations for objects under prefix (e.g. before a wipe)"""
+        with self._changed:
+            count = self._db.execute(
+                "DELETE FROM operations WHERE state != 'inflight' AND object_name LIKE ? ESCAPE '\\'",
+                (prefix.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + '%',)).rowcount
+            self._changed.notify_all()
+        return count
+
+    def retry_failed(self):
+        """Move operations that exhausted their attempts back to pending"""
+        with self._changed:
+            count = self._db.execute(
+                "UPDATE operations SET state = 'pending', attempts = 0, next_attempt_at = ? "
+                "WHERE state = 'failed'", (time.time(),)).rowcount
+            self._changed.notify_all()
+        return count
+
+    def pending_objects(self):
+        """Names of objects with operations still pending or in flight"""
+        with self._changed:
+            return {row[0] for row in self._db.execute(
+                "SELECT DISTINCT object_name FROM operations WHERE state IN ('pending', 'inflight')")}
+
+    # Worker side
+
+    def _claim(self):
+        """Mark the next ready operation in flight and return it, or the wait time"""
+        now = time.time()
+        # IMMEDIATE takes the write lock up front, so processes sharing the file never claim twice
+        self._db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self._db.execute(_CLAIM_SQL, (now,)).fetchone()
+            if row is not None:
+                self._db.execute("UPDATE operations SET state = 'inflight' WHERE id = ?", (row[0],))
+        finally:
+            self._db.execute("COMMIT")
+        if row is not None:
+            return row, None
+        next_at = self._db.execute(
+            "SELECT MIN(next_attempt_at) FROM operations WHERE state = 'pending'").fetchone()[0]
+        return None, (max(0.05, next_at - now) if next_at else None)
+
+    def _apply(self, op, object_name, source_path, content_type):
+        blob = self.bucket.blob(object_name)
+        if op == UPLOAD:
+            if not os.path.exists(source_path):
+                # Deleted locally since; the delete operation queued after it covers GCS
+                logger.info(f"Skipping replication of {object_name}: {source_path} no longer exists")
+                return
+            with timed('gcs', 'upload'):
+                blob.upload_from_filename(source_path, content_type=content_type)
+        elif op == DELETE:
+            try:
+                with timed('gcs', 'delete'):
+                    blob.delete()
+            except exceptions.NotFound:
+                pass
+        else:
+            raise ValueError(f"Unknown replication operation {op}")
+
+    def _run(self):
+        while True:
+            with self._changed:
+                row, wait = self._claim()
+                while row is None:
+                    if self._stopping:
+                        return
+                    self._changed.wait(min(wait, POLL_SECONDS) if wait is not None else POLL_SECONDS)
+                    row, wait = self._claim()
+
+            op_id, object_name, op, source_path, content_type, attempts, enqueued_at = row
+            # Applied after the request that queued it, so each operation is its own trace
+            trace = tracing.start_trace(f"replicate.{op}", object=object_name, attempt=attempts + 1)
+            try:
+                with trace:
+                    self._apply(op, object_name, source_path, content_type)
+            except Exception as e:
+                attempts += 1
+                error = f"{type(e).__name__}: {e}"
+                with self._changed:
+                    self.last_error = f"{op} {object_name}: {error}"
+                    if attempts >= self.max_attempts:
+                        self._db.execute(
+                            "UPDATE operations SET state = 'failed', attempts = ?, last_error = ? WHERE id = ?",
+                            (attempts, error, op_id))
+                        logger.error(f"Giving up on {op} of {object_name} after {attempts} attempts: {error}")
+                    else:
+                        delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** (attempts - 1)))
+                        delay *= random.uniform(0.5, 1.5)
+                        self._db.execute(
+                            "UPDATE operations SET state = 'pending', attempts = ?, last_error = ?, "
+                            "next_attempt_at = ? WHERE id = ?",
+                            (attempts, error, time.time() + delay, op_id))
+                        self.retried += 1
+                        logger.warning(f"Replication {op} of {object_name} failed "
+                                       f"(attempt {attempts}), retrying in {delay:.1f}s: {error}")
+                    self._changed.notify_all()
+                continue
+
+            with self._changed:
+                self._db.execute("DELETE FROM operations WHERE id = ?", (op_id,))
+                self.completed += 1
+                self.last_replicated_at = time.time()
+                self.last_lag_seconds = self.last_replicated_at - enqueued_at
+                self._changed.notify_all()
+
+            if self.on_replicated is not None:
+                try:
+                    self.on_replicated(op, object_name)
+                except Exception as e:
+                    logger.error(f"Error in replication callback for {object_name}: {e}")
+
+    def _start_workers(self):
+        # The previous owner's in-flight operations were interrupted; retry them
+        recovered = self._db.execute(
+            "UPDATE operations SET state = 'pending' WHERE state = 'inflight'").rowcount
+        if recovered:
+            logger.info(f"Recovered {recovered} in-flight replication operations")
+        for i in range(self.workers - len(self._threads)):
+            thread = threading.Thread(target=self._run, name=f"gcs-replication-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        logger.info(f"GCS replication queue started with {self.workers} workers in process {os.getpid()}")
+
+    def _acquire_and_start(self):
+        # Blocks until no other process holds the lock, i.e. until we are the replicator
+        lock_file = open(self.db_path + '.lock', 'w')
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        with self._changed:
+            if self._stopping:
+                lock_file.close()
+                return
+            self._lock_file = lock_file
+            self._start_workers()
+
+    def start(self):
+        """Start the worker threads once this process holds the replicator lock"""
+        threading.Thread(target=self._acquire_and_start, name="gcs-replication-lock", daemon=True).start()
+        return self
+
+    def stop(self, timeout=10):
+        """Stop the workers after their current operation and hand over the lock"""
+        with self._changed:
+            self._stopping = True
+            self._changed.notify_all()
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+    def wait_idle(self, timeout=None):
+        """Block until no operation is pending or in flight (failed ones excluded)"""
+        deadline = None if timeout is None else time.time() + timeout
+        with self._changed:
+            while self._depth() > 0:
+                remaining = None if deadline is None else deadline - time.time()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._changed.wait(min(remaining, FULL_POLL_SECONDS) if remaining is not None else FULL_POLL_SECONDS)
+        return True
+
+    def status(self):
+        """Return queue depth, lag and worker state"""
+        with self._changed:
+            counts = dict(self._db.execute(
+                "SELECT state, COUNT(*) FROM operations GROUP BY state").fetchall())
+            oldest = self._db.execute(
+                "SELECT MIN(enqueued_at) FROM operations WHERE state IN ('pending', 'inflight')").fetchone()[0]
+            failed = [{"object": r[0], "op": r[1], "attempts": r[2], "error": r[3]}
+                      for r in self._db.execute(
+                          "SELECT object_name, op, attempts, last_error FROM operations "
+                          "WHERE state = 'failed' ORDER BY id LIMIT 20")]
+        now = time.time()
+        return {
+            "enabled": True,
+            "pending": counts.get('pending', 0),
+            "inflight": counts.get('inflight', 0),
+            "failed": counts.get('failed', 0),
+            "depth": counts.get('pending', 0) + counts.get('inflight', 0),
+            "maxDepth": self.max_depth,
+            "oldestPendingAgeSeconds": round(now - oldest, 3) if oldest else 0,
+            "lastLagSeconds": round(self.last_lag_seconds, 3) if self.last_lag_seconds is not None else None,
+            "completed": self.completed,
+            "retried": self.retried,
+            "lastError": self.last_error,
+            "workers": sum(1 for t in self._threads if t.is_alive()),
+            "replicator": self._lock_file is not None,
+            "failedOperations": failed,
+        }
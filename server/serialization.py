@@ -0,0 +1,125 @@
+"""
+JSON response serialization for the API.
+
+Responses are encoded with orjson when it is installed, falling back to the
+standard library json module otherwise. MongoDB ObjectIds, datetimes, bytes
+and sets are handled natively, so handlers can return documents as read from
+the database.
+
+Large arrays (or iterators such as MongoDB cursors) can be streamed as a
+chunked response instead of being encoded into one string:
+
+    return json_response({"icons": icons, "totalCount": len(icons)}, stream='icons')
+
+Values that are callables are evaluated after the streamed array has been
+sent, so totals computed while iterating can be appended at the end.
+"""
+
+import os
+import json
+import base64
+import logging
+import datetime
+from decimal import Decimal
+
+from flask import Response, stream_with_context
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    from bson import ObjectId
+except ImportError:
+    ObjectId = None
+
+logger = logging.getLogger(__name__)
+
+MIMETYPE = 'application/json'
+
+# Lists shorter than this are encoded in one go even when streaming is requested
+STREAM_THRESHOLD = int(os.environ.get('JSON_STREAM_THRESHOLD', 1000))
+# Number of array items encoded per streamed chunk
+STREAM_BATCH_SIZE = int(os.environ.get('JSON_STREAM_BATCH_SIZE', 500))
+
+ENCODER = 'orjson' if orjson is not None else 'json'
+
+
+def default(value):
+    """Encode types the JSON encoders do not handle natively"""
+    if ObjectId is not None and isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, (datetime.datetime, datetime.date)):
+        return value.isoformat()
+    if isinstance(value, (bytes, bytearray)):
+        return base64.b64encode(bytes(value)).decode('ascii')
+    if isinstance(value, (set, frozenset, tuple)):
+        return list(value)
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, 'to_decimal'):  # bson Decimal128
+        return float(value.to_decimal())
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def dumps(value):
+        """Encode a value as JSON bytes"""
+        return orjson.dumps(value, default=default, option=_ORJSON_OPTIONS)
+else:
+    def dumps(value):
+        """Encode a value as JSON bytes"""
+        return json.dumps(value, default=default, separators=(',', ':')).encode('utf-8')
+
+
+def _batches(items, size):
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def stream_object(payload, stream_key):
+    """Yield the JSON encoding of payload, streaming payload[stream_key]"""
+    yield b'{'
+    first = True
+    deferred = []
+    for key, value in payload.items():
+        if key == stream_key:
+            continue
+        if callable(value):
+            deferred.append(key)
+            continue
+        yield (b'' if first else b',') + dumps(str(key)) + b':' + dumps(value)
+        first = False
+
+    yield (b'' if first else b',') + dumps(str(stream_key)) + b':['
+    separator = b''
+    for batch in _batches(payload[stream_key], STREAM_BATCH_SIZE):
+        # Encode a whole batch as one array and drop its brackets
+        yield separator + dumps(batch)[1:-1]
+        separator = b','
+    yield b']'
+
+    for key in deferred:
+        yield b',' + dumps(str(key)) + b':' + dumps(payload[key]())
+    yield b'}'
+
+
+def json_response(payload, status=200, stream=None, headers=None):
+    """Build a JSON response, optionally streaming the array at key `stream`"""
+    if stream is not None:
+        items = payload.get(stream)
+        if not isinstance(items, (list, tuple)) or len(items) >= STREAM_THRESHOLD:
+            return Response(stream_with_context(stream_object(payload, stream)),
+                            status=status, mimetype=MIMETYPE, headers=headers)
+        payload = {k: (v() if callable(v) else v) for k, v in payload.items()}
+
+    return Response(dumps(payload), status=status, mimetype=MIMETYPE, headers=headers)
@@ -0,0 +1,134 @@
+"""
+Single-flight: concurrent identical computations run once and share the result.
+
+    diagram_fetches = Group('diagram')
+
+    diagram = diagram_fetches.do(('mongodb', diagram_id), fetch, diagram_id)
+    diagram = await diagram_fetches.do_async(('mongodb', diagram_id), fetch_async, diagram_id)
+
+The first caller for a key runs the function; callers arriving while it
+runs wait and get the same result (or exception) instead of repeating the
+work. Nothing is cached: the next call after it finishes runs again. Shared
+results must be treated as read-only.
+
+After a write, forget(key) (or forget_all()) makes later callers start a new
+execution instead of joining one that may have read the old data. Flights
+are per process.
+
+Coalescing is counted in singleflight_calls_total{group, result} with result
+leader (ran the function) or shared (got another caller's result), and
+stats() reports every group.
+"""
+
+import asyncio
+import threading
+
+from metrics import COALESCED_CALLS
+
+groups = {}
+
+
+class _Flight:
+    __slots__ = ('done', 'result', 'error', 'waiters')
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class Group:
+    def __init__(self, name):
+        self.name = name
+        self.calls = 0
+        self.executions = 0
+        self.shared = 0
+        self.errors = 0
+        self._flights = {}
+        self._tasks = {}
+        self._lock = threading.Lock()
+        groups[name] = self
+
+    def do(self, key, function, *args, **kwargs):
+        """function(*args, **kwargs), or the result of the same call already running for key"""
+        with self._lock:
+            self.calls += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                flight.waiters += 1
+                self.shared += 1
+        COALESCED_CALLS.inc(self.name, 'leader' if leader else 'shared')
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+        try:
+            flight.result = function(*args, **kwargs)
+        except BaseException as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                if self._flights.get(key) is flight:
+                    del self._flights[key]
+                self.executions += 1
+                if flight.error is not None:
+                    self.errors += 1
+            flight.done.set()
+        return flight.result
+
+    async def do_async(self, key, function, *args, **kwargs):
+        """Await function(*args, **kwargs), or the same call already running for key on this event loop.
+        The execution is a task of its own, so a caller that is cancelled does not cancel it for the others."""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self.calls += 1
+            task = self._tasks.get((loop, key))
+            leader = task is None
+            if leader:
+                task = self._tasks[(loop, key)] = loop.create_task(function(*args, **kwargs))
+                task.add_done_callback(lambda done: self._task_done(loop, key, done))
+            else:
+                self.shared += 1
+        COALESCED_CALLS.inc(self.name, 'leader' if leader else 'shared')
+        return await asyncio.shield(task)
+
+    def _task_done(self, loop, key, task):
+        with self._lock:
+            if self._tasks.get((loop, key)) is task:
+                del self._tasks[(loop, key)]
+            self.executions += 1
+            if task.cancelled() or task.exception() is not None:
+                self.errors += 1
+
+    def forget(self, key):
+        """Let later calls for key start a new execution (e.g. after a write)"""
+        with self._lock:
+            self._flights.pop(key, None)
+            for task_key in [k for k in self._tasks if k[1] == key]:
+                del self._tasks[task_key]
+
+    def forget_all(self):
+        with self._lock:
+            self._flights.clear()
+            self._tasks.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "calls": self.calls,
+                "executions": self.executions,
+                "shared": self.shared,
+                "errors": self.errors,
+                "inFlight": len(self._flights) + len(self._tasks),
+            }
+
+
+def stats():
+    """Coalescing counts of every group"""
+    return {name: group.stats() for name, group in groups.items()}
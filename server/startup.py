@@ -0,0 +1,132 @@
+"""
+Startup sequence and backend readiness for the API server.
+
+Connecting to MongoDB Atlas and GCS can take seconds on a slow network, and
+used to happen serially at import before Flask could serve anything. Now
+local, cheap setup runs as timed synchronous phases, and each remote backend
+is initialized concurrently in its own thread:
+
+    startup = Startup()
+    with startup.phase('local storage'):
+        os.makedirs(...)
+    startup.backend('mongodb', init_mongodb)
+    startup.backend('gcs', init_gcs)
+
+The server accepts requests immediately. A request that needs a backend
+calls startup.wait(name, timeout), which returns at once when the backend is
+settled (or was never registered) and otherwise blocks until its
+initialization finishes, so early requests are not routed to a fallback
+store just because they arrived first. Health checks report each backend's
+state without blocking.
+"""
+
+import time
+import logging
+import threading
+import traceback
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+READY = 'ready'
+DISABLED = 'disabled'
+FAILED = 'failed'
+
+
+class Backend:
+    """Initialization state of one remote backend"""
+
+    def __init__(self, name):
+        self.name = name
+        self.state = PENDING
+        self.detail = None
+        self.seconds = None
+        self._settled = threading.Event()
+
+    def settle(self, state, detail, seconds):
+        self.state = state
+        self.detail = detail
+        self.seconds = seconds
+        self._settled.set()
+
+    def wait(self, timeout=None):
+        return self._settled.wait(timeout)
+
+    def to_dict(self):
+        return {
+            "state": self.state,
+            "detail": self.detail,
+            "seconds": round(self.seconds, 3) if self.seconds is not None else None,
+        }
+
+
+class Startup:
+    """Times startup phases and tracks backends initialized in the background"""
+
+    def __init__(self):
+        self.started_at = time.time()
+        self._started = time.perf_counter()
+        self.phases = []
+        self.backends = {}
+        self.serving_after = None
+
+    @contextmanager
+    def phase(self, name):
+        """Run a synchronous startup phase, logging how long it took"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - started
+            self.phases.append({"phase": name, "seconds": round(seconds, 4)})
+            logger.info(f"Startup phase '{name}' took {seconds * 1000:.1f} ms")
+
+    def backend(self, name, init):
+        """Initialize a backend in a background thread.
+
+        init() returns a short description when the backend is ready, or
+        None when it is not configured; exceptions mark it failed.
+        """
+        backend = self.backends[name] = Backend(name)
+
+        def run():
+            started = time.perf_counter()
+            try:
+                detail = init()
+                state = READY if detail is not None else DISABLED
+            except Exception as e:
+                detail, state = str(e), FAILED
+                logger.error(f"Initializing {name} failed: {e}")
+                logger.error(traceback.format_exc())
+            seconds = time.perf_counter() - started
+            backend.settle(state, detail, seconds)
+            logger.info(f"Backend {name} {state} after {seconds * 1000:.1f} ms"
+                        f"{f' ({detail})' if detail else ''}")
+
+        threading.Thread(target=run, name=f"init-{name}", daemon=True).start()
+        return backend
+
+    def serving(self):
+        """Record that startup handed over to the server"""
+        self.serving_after = time.perf_counter() - self._started
+        logger.info(f"Ready to serve after {self.serving_after * 1000:.1f} ms "
+                    f"({len(self.backends)} backends initializing in the background)")
+
+    def wait(self, name, timeout=None):
+        """Wait for a backend to finish initializing; True if it has (or is unknown)"""
+        backend = self.backends.get(name)
+        return backend is None or backend.wait(timeout)
+
+    @property
+    def ready(self):
+        return all(backend.state != PENDING for backend in self.backends.values())
+
+    def status(self):
+        return {
+            "ready": self.ready,
+            "uptimeSeconds": round(time.time() - self.started_at, 3),
+            "servingAfterSeconds": round(self.serving_after, 4) if self.serving_after is not None else None,
+            "phases": list(self.phases),
+            "backends": {name: backend.to_dict() for name, backend in self.backends.items()},
+        }
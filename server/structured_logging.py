@@ -0,0 +1,258 @@
+"""
+Logging for the API server: structured records, written off the request thread.
+
+    import structured_logging
+    structured_logging.configure()
+
+Loggers keep being used as before (logger.info(f"...")). configure() puts a
+QueueHandler on the root logger: the calling thread only merges the message
+and appends the record to a bounded queue, and a QueueListener thread
+formats and writes it to stderr. Records are one JSON object per line
+(LOG_FORMAT=json, the default) or the usual text lines (LOG_FORMAT=text),
+with the trace ID of the current trace and any fields passed as
+extra={"fields": {...}}. When the queue is full (LOG_QUEUE_SIZE) records are
+dropped and counted rather than blocking a request.
+
+Per request, instead of a line per icon, handlers count events and add
+fields, and one summary is logged when the response is sent:
+
+    count('icons.inserted')
+    annotate(provider=provider, totalCount=total)
+
+    {"message": "POST /api/upload/icons 200 812.4ms", "event": "request",
+     "route": "/api/upload/icons", "status": 200, "durationMs": 812.4,
+     "counts": {"icons.inserted": 1200}, ...}
+
+Summaries of noisy routes are sampled (LOG_SAMPLE_ROUTES, e.g.
+"/api/health=0.01,/api/ready=0.01"; each logged summary carries its
+sampleRate). Errors (status 500+) and requests slower than LOG_SLOW_MS are
+always logged.
+"""
+
+import os
+import sys
+import json
+import queue
+import atexit
+import random
+import logging
+import threading
+import contextvars
+import logging.handlers
+
+import tracing
+
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'json').lower()
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO').upper()
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', 10000))
+LOG_SLOW_MS = float(os.environ.get('LOG_SLOW_MS', 1000))
+# Probes, scrapes and icon files (a page load fetches hundreds)
+DEFAULT_SAMPLE_ROUTES = '/api/health=0.01,/api/ready=0.01,/api/metrics=0.01,/cloudicons/<path:filename>=0.01'
+
+TEXT_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+request_logger = logging.getLogger('request')
+
+
+def parse_sample_routes(value):
+    """'/api/health=0.01,/api/ready=0' -> {route: rate}"""
+    rates = {}
+    for item in value.split(','):
+        route, _, rate = item.strip().rpartition('=')
+        if route:
+            rates[route] = min(1.0, max(0.0, float(rate)))
+    return rates
+
+
+SAMPLE_ROUTES = parse_sample_routes(os.environ.get('LOG_SAMPLE_ROUTES', DEFAULT_SAMPLE_ROUTES))
+
+
+class StructuredFormatter(logging.Formatter):
+    """JSON lines, or the text format with the extra fields appended as key=value"""
+
+    def __init__(self, as_json=True):
+        super().__init__(TEXT_FORMAT)
+        self.as_json = as_json
+
+    def format(self, record):
+        fields = getattr(record, 'fields', None) or {}
+        trace_id = getattr(record, 'trace_id', None)
+        if not self.as_json:
+            text = super().format(record)
+            extras = dict(fields, traceId=trace_id) if trace_id else fields
+            if extras:
+                text += ' ' + ' '.join(f"{key}={json.dumps(value, default=str)}" for key, value in extras.items())
+            return text
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "pid": record.process,
+            "thread": record.threadName,
+        }
+        if trace_id:
+            entry["traceId"] = trace_id
+        entry.update(fields)
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            entry["exception"] = record.exc_text
+        return json.dumps(entry, default=str)
+
+
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Enqueue without formatting; count records that do not fit instead of blocking"""
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Only merge the arguments here (they may change after the call); the
+        # listener thread does the formatting
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        trace = tracing.current()
+        record.trace_id = trace.trace_id if trace is not None else None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+            return
+        if self.dropped:
+            dropped, self.dropped = self.dropped, 0
+            warning = logging.LogRecord('structured_logging', logging.WARNING, __file__, 0,
+                                        f"Dropped {dropped} log records (queue full)", None, None)
+            try:
+                self.queue.put_nowait(warning)
+            except queue.Full:
+                self.dropped += dropped
+
+
+_handler = None
+_listener = None
+_lock = threading.Lock()
+
+
+def _start_listener(stream):
+    global _handler, _listener
+    log_queue = queue.Queue(LOG_QUEUE_SIZE)
+    output = logging.StreamHandler(stream)
+    output.setFormatter(StructuredFormatter(as_json=LOG_FORMAT == 'json'))
+    _handler = DroppingQueueHandler(log_queue)
+    _listener = logging.handlers.QueueListener(log_queue, output, respect_handler_level=False)
+    _listener.start()
+
+
+def configure(level=None, stream=None):
+    """Send the root logger's records through the queue; replaces its handlers (e.g. from basicConfig)"""
+    with _lock:
+        root = logging.getLogger()
+        if _listener is None:
+            _start_listener(stream or sys.stderr)
+            atexit.register(stop)
+        for handler in list(root.handlers):
+            if handler is not _handler:
+                root.removeHandler(handler)
+        if _handler not in root.handlers:
+            root.addHandler(_handler)
+        root.setLevel(level or LOG_LEVEL)
+
+
+def stop():
+    """Write out the records still queued"""
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            _listener = None
+
+
+def _after_fork():
+    # The listener thread does not survive fork: a child gets its own queue and thread
+    global _lock
+    _lock = threading.Lock()
+    if _listener is None:
+        return
+    root = logging.getLogger()
+    stream = _listener.handlers[0].stream
+    old_handler = _handler
+    _start_listener(stream)
+    root.removeHandler(old_handler)
+    root.addHandler(_handler)
+
+
+os.register_at_fork(after_in_child=_after_fork)
+
+
+def status():
+    return {
+        "format": LOG_FORMAT,
+        "queued": _handler.queue.qsize() if _handler is not None else 0,
+        "dropped": _handler.dropped if _handler is not None else 0,
+    }
+
+
+# Per-request summaries
+
+class RequestLog:
+    __slots__ = ('fields', 'counts')
+
+    def __init__(self):
+        self.fields = {}
+        self.counts = {}
+
+
+_request = contextvars.ContextVar('request_log', default=None)
+
+
+def begin_request():
+    """Start collecting the current request's counts and fields"""
+    entry = RequestLog()
+    _request.set(entry)
+    return entry
+
+
+def count(event, amount=1):
+    """Count an event (e.g. one per uploaded icon) in the current request's summary"""
+    entry = _request.get()
+    if entry is not None:
+        entry.counts[event] = entry.counts.get(event, 0) + amount
+
+
+def annotate(**fields):
+    """Add fields to the current request's summary"""
+    entry = _request.get()
+    if entry is not None:
+        entry.fields.update(fields)
+
+
+def end_request(method, route, status, seconds, trace_id=None):
+    """Log the summary of the current request, unless its route is sampled out"""
+    entry = _request.get()
+    _request.set(None)
+    duration_ms = seconds * 1000
+    rate = SAMPLE_ROUTES.get(route, 1.0)
+    if status < 500 and duration_ms < LOG_SLOW_MS and rate < 1.0 and random.random() >= rate:
+        return
+    level = logging.ERROR if status >= 500 else logging.INFO
+    if not request_logger.isEnabledFor(level):
+        return
+    fields = {"event": "request", "method": method, "route": route, "status": status,
+              "durationMs": round(duration_ms, 1)}
+    if rate < 1.0:
+        fields["sampleRate"] = rate
+    if trace_id:
+        fields["traceId"] = trace_id
+    if entry is not None:
+        fields.update(entry.fields)
+        if entry.counts:
+            fields["counts"] = entry.counts
+    request_logger.log(level, "%s %s %s %.1fms", method, route, status, duration_ms, extra={"fields": fields})
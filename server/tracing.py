@@ -0,0 +1,424 @@
+"""
+Lightweight request tracing.
+
+A sampled request gets a trace: a root span for the request and nested
+spans for its stages and for every MongoDB, GCS and filesystem call timed
+through metrics.timed() (so backend calls need no tracing code of their
+own):
+
+    with tracing.span('upload.icon', file=file):
+        ...
+
+The current span lives in a context variable, so spans nest within a
+thread or an asyncio task (and anyio worker threads, which copy the
+context). Calls made from other threads, e.g. replication workers, start
+their own traces.
+
+Sampling: TRACE_SAMPLE_RATE of requests (default 0.1) are traced; a
+request with an `X-Trace: true` header or a sampled W3C `traceparent` is
+always traced, and continues the caller's trace. Sampled responses carry
+an `X-Trace-Id` header.
+
+Finished traces go to:
+- an in-memory ring buffer of the last TRACE_BUFFER_SIZE traces,
+- `TRACE_FILE` as JSON lines (default `$DATA_DIR/traces.jsonl`, shared by
+  all workers, rotated at TRACE_FILE_MAX_BYTES; set it to "" to disable),
+- an OTLP/HTTP collector if OTEL_EXPORTER_OTLP_ENDPOINT is set (JSON
+  encoding, sent in batches by a background thread).
+
+GET /api/admin/traces lists recent traces and /api/admin/traces/<id>
+shows one as a span tree.
+"""
+
+import os
+import json
+import time
+import queue
+import random
+import logging
+import threading
+import contextvars
+import urllib.request
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+SAMPLE_RATE = float(os.environ.get('TRACE_SAMPLE_RATE', 0.1))
+BUFFER_SIZE = int(os.environ.get('TRACE_BUFFER_SIZE', 200))
+# Spans kept per trace; a bulk operation touching thousands of files keeps the first ones
+MAX_SPANS = int(os.environ.get('TRACE_MAX_SPANS', 2000))
+FILE_MAX_BYTES = int(os.environ.get('TRACE_FILE_MAX_BYTES', 16 * 1024 * 1024))
+OTLP_ENDPOINT = os.environ.get('OTEL_EXPORTER_OTLP_ENDPOINT', '').rstrip('/')
+SERVICE_NAME = os.environ.get('OTEL_SERVICE_NAME', 'azure-diagram-maker')
+EXPORT_INTERVAL = float(os.environ.get('TRACE_EXPORT_INTERVAL', 2))
+
+_current = contextvars.ContextVar('trace_span', default=None)
+
+
+class Trace:
+    """The spans of one trace, exported when its local root span ends"""
+
+    def __init__(self, trace_id):
+        self.trace_id = trace_id
+        self.spans = []
+        self.dropped = 0
+        self._lock = threading.Lock()
+
+    def add(self, span):
+        with self._lock:
+            if len(self.spans) < MAX_SPANS:
+                self.spans.append(span)
+            else:
+                self.dropped += 1
+
+
+class Span:
+    __slots__ = ('trace', 'span_id', 'parent_id', 'name', 'start_ns', 'end_ns', 'attributes', 'error',
+                 'is_root', '_token')
+
+    def __init__(self, trace, name, parent_id, attributes, is_root=False, start_ns=None):
+        self.trace = trace
+        self.span_id = random.getrandbits(64).to_bytes(8, 'big').hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.start_ns = start_ns or time.time_ns()
+        self.end_ns = None
+        self.attributes = attributes
+        self.error = None
+        self.is_root = is_root
+        self._token = None
+
+    @property
+    def trace_id(self):
+        return self.trace.trace_id
+
+    def set(self, key, value):
+        self.attributes[key] = value
+
+    def start(self):
+        """Make this the current span"""
+        self._token = _current.set(self)
+        return self
+
+    def detach(self):
+        """Stop being the current span, without ending"""
+        if self._token is not None:
+            _current.reset(self._token)
+            self._token = None
+
+    def end(self, error=None):
+        self.detach()
+        if self.end_ns is not None:
+            return
+        if error is not None:
+            self.error = error
+        self.end_ns = time.time_ns()
+        self.trace.add(self)
+        if self.is_root:
+            exporter.export(self.trace)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc, tb):
+        self.end(f"{exc_type.__name__}: {exc}" if exc_type is not None else None)
+        return False
+
+
+class _NoSpan:
+    """Stands in for a span when the request is not sampled"""
+    trace_id = None
+
+    def set(self, key, value):
+        pass
+
+    def start(self):
+        return self
+
+    def detach(self):
+        pass
+
+    def end(self, error=None):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+NO_SPAN = _NoSpan()
+
+
+def current():
+    return _current.get()
+
+
+def clear():
+    """Forget any span left current in this thread (e.g. by a response never closed)"""
+    _current.set(None)
+
+
+def span(name, **attributes):
+    """A child of the current span (use as a context manager); a no-op outside a trace"""
+    parent = _current.get()
+    if parent is None:
+        return NO_SPAN
+    return Span(parent.trace, name, parent.span_id, attributes)
+
+
+def record_span(name, seconds, error=None, **attributes):
+    """Add an already finished child span, e.g. a MongoDB command timed by the driver"""
+    parent = _current.get()
+    if parent is None:
+        return
+    attributes = {key: value for key, value in attributes.items() if value is not None}
+    now = time.time_ns()
+    child = Span(parent.trace, name, parent.span_id, attributes, start_ns=now - int(seconds * 1e9))
+    child.error = error
+    child.end_ns = now
+    parent.trace.add(child)
+
+
+def _parse_traceparent(value):
+    """(trace id, parent span id, sampled) from a W3C traceparent header, or None"""
+    parts = (value or '').strip().split('-')
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        int(parts[1], 16), int(parts[2], 16)
+        sampled = int(parts[3], 16) & 1
+    except ValueError:
+        return None
+    if parts[1] == '0' * 32:
+        return None
+    return parts[1], parts[2], bool(sampled)
+
+
+def start_trace(name, traceparent=None, force=False, **attributes):
+    """A new root span if this trace is sampled (NO_SPAN otherwise); call start() on it"""
+    parent_id = None
+    remote = _parse_traceparent(traceparent)
+    if remote is not None:
+        trace_id, parent_id, sampled = remote
+    else:
+        trace_id, sampled = None, False
+    if not (sampled or force or random.random() < SAMPLE_RATE):
+        return NO_SPAN
+    if trace_id is None:
+        trace_id = random.getrandbits(128).to_bytes(16, 'big').hex()
+    return Span(Trace(trace_id), name, parent_id, attributes, is_root=True)
+
+
+def start_request(method, route, headers):
+    """Root span of an HTTP request, from its headers (a mapping with .get)"""
+    force = (headers.get('X-Trace') or '').lower() in ('1', 'true')
+    return start_trace(f"{method} {route}", traceparent=headers.get('traceparent'), force=force,
+                       **{"http.method": method, "http.route": route})
+
+
+# Export
+
+def trace_record(trace):
+    """JSON form of a finished trace, as stored in the buffer and trace file"""
+    with trace._lock:
+        spans = sorted(trace.spans, key=lambda s: s.start_ns)
+        dropped = trace.dropped
+    root = next((s for s in spans if s.is_root), spans[0])
+    started = min(s.start_ns for s in spans)
+    return {
+        "traceId": trace.trace_id,
+        "name": root.name,
+        "startTime": started / 1e9,
+        "durationMs": round((root.end_ns - root.start_ns) / 1e6, 3),
+        "error": any(s.error for s in spans),
+        "pid": os.getpid(),
+        "droppedSpans": dropped,
+        "spans": [{
+            "spanId": s.span_id,
+            "parentId": s.parent_id,
+            "name": s.name,
+            "startMs": round((s.start_ns - started) / 1e6, 3),
+            "durationMs": round(((s.end_ns or s.start_ns) - s.start_ns) / 1e6, 3),
+            "attributes": s.attributes,
+            "error": s.error,
+        } for s in spans],
+    }
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+def otlp_span(trace, span):
+    result = {
+        "traceId": trace.trace_id,
+        "spanId": span.span_id,
+        "name": span.name,
+        "kind": 2 if span.is_root else 1,  # SERVER, INTERNAL
+        "startTimeUnixNano": str(span.start_ns),
+        "endTimeUnixNano": str(span.end_ns or span.start_ns),
+        "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items()],
+        "status": {"code": 2, "message": span.error} if span.error else {},
+    }
+    if span.parent_id:
+        result["parentSpanId"] = span.parent_id
+    return result
+
+
+class Exporter:
+    """Sends finished traces to the ring buffer, the trace file and OTLP"""
+
+    def __init__(self):
+        self.buffer = deque(maxlen=BUFFER_SIZE)
+        self.path = None
+        self.otlp_endpoint = OTLP_ENDPOINT
+        self.exported = 0
+        self.export_errors = 0
+        self._queue = queue.SimpleQueue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def configure(self, path=None):
+        """Write traces to path (None: memory only) and start the background writer"""
+        self.path = path or None
+        if self.path:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._lock:
+            if self._thread is None and (self.path or self.otlp_endpoint):
+                self._thread = threading.Thread(target=self._run, name="trace-exporter", daemon=True)
+                self._thread.start()
+
+    def export(self, trace):
+        record = trace_record(trace)
+        self.buffer.append(record)
+        self.exported += 1
+        if self._thread is not None:
+            self._queue.put((trace, record))
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + EXPORT_INTERVAL
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self.flush(batch)
+
+    def flush(self, batch):
+        if self.path:
+            try:
+                self._write(record for _, record in batch)
+            except Exception as e:
+                self.export_errors += 1
+                logger.error(f"Error writing traces to {self.path}: {e}")
+        if self.otlp_endpoint:
+            try:
+                self._send_otlp([trace for trace, _ in batch])
+            except Exception as e:
+                self.export_errors += 1
+                logger.warning(f"Error sending traces to {self.otlp_endpoint}: {e}")
+
+    def _write(self, records):
+        data = ''.join(json.dumps(record, separators=(',', ':'), default=str) + '\n' for record in records)
+        try:
+            if os.path.getsize(self.path) >= FILE_MAX_BYTES:
+                os.replace(self.path, self.path + '.1')
+        except FileNotFoundError:
+            pass
+        # One append per batch: whole lines from concurrent workers do not interleave
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data.encode('utf-8'))
+        finally:
+            os.close(fd)
+
+    def _send_otlp(self, traces):
+        spans = []
+        for trace in traces:
+            with trace._lock:
+                spans.extend(otlp_span(trace, span) for span in trace.spans)
+        body = {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": spans}],
+        }]}
+        request = urllib.request.Request(f"{self.otlp_endpoint}/v1/traces", data=json.dumps(body).encode('utf-8'),
+                                         headers={"Content-Type": "application/json"}, method='POST')
+        with urllib.request.urlopen(request, timeout=10) as response:
+            response.read()
+
+    def recent(self, limit=50):
+        """The most recent traces, newest first, from the shared trace file if there is one"""
+        if self.path and os.path.exists(self.path):
+            return _tail_records(self.path, limit)
+        return list(self.buffer)[::-1][:limit]
+
+    def find(self, trace_id, limit=10000):
+        """A recent trace by id, or None"""
+        return next((r for r in self.recent(limit) if r["traceId"] == trace_id), None)
+
+
+def _tail_records(path, limit, chunk_size=1024 * 1024):
+    """The last limit JSON lines of path, newest first"""
+    records = []
+    with open(path, 'rb') as f:
+        end = f.seek(0, os.SEEK_END)
+        remainder = b''
+        while end > 0 and len(records) < limit:
+            start = max(0, end - chunk_size)
+            f.seek(start)
+            lines = (f.read(end - start) + remainder).split(b'\n')
+            # The first line may continue in the previous chunk
+            remainder = lines.pop(0) if start > 0 else b''
+            for line in reversed(lines):
+                if line.strip():
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        continue
+                    if len(records) >= limit:
+                        break
+            end = start
+    return records
+
+
+exporter = Exporter()
+
+
+def summary(record):
+    result = {key: record[key] for key in ("traceId", "name", "startTime", "durationMs", "error", "pid")}
+    result["spanCount"] = len(record["spans"])
+    return result
+
+
+def span_tree(record):
+    """The spans of a trace record nested under their parents"""
+    spans = {s["spanId"]: dict(s, children=[]) for s in record["spans"]}
+    roots = []
+    for s in sorted(spans.values(), key=lambda s: s["startMs"]):
+        parent = spans.get(s["parentId"])
+        (parent["children"] if parent is not None else roots).append(s)
+    return roots
+
+
+def status():
+    return {
+        "sampleRate": SAMPLE_RATE,
+        "buffered": len(exporter.buffer),
+        "exported": exporter.exported,
+        "exportErrors": exporter.export_errors,
+        "file": exporter.path,
+        "otlpEndpoint": exporter.otlp_endpoint or None,
+    }
@@ -0,0 +1,13 @@
+"""
+WSGI entry point for production serving:
+
+    cd server && gunicorn -c gunicorn.conf.py wsgi:app
+
+Each worker process imports this module after the fork and runs the startup
+sequence itself, so MongoDB connection pools, GCS clients and background
+threads are created per worker rather than inherited across fork().
+"""
+
+from upload import create_app
+
+app = create_app()